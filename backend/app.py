@@ -4,31 +4,161 @@ ArciTEK.AI Backend Server
 High-end AI creation platform for music, images, and stories
 """
 
-from flask import Flask, request, jsonify, send_file
+import time
+
+# Measured from before the first heavy import, for --profile-startup
+_startup_start = time.perf_counter()
+
+from flask import Flask, Response, g, request, jsonify, send_file
 from flask_cors import CORS
+from werkzeug.security import safe_join
+import argparse
+import json
 import os
 from dotenv import load_dotenv
 
-from services.music_service import MusicService
-from services.image_service import ImageService
-from services.story_service import StoryService
+from services.registry import ServiceRegistry, parse_service_names
+from services.job_service import JobService, QueueFullError
+from services.batch_service import BatchService
+from services.cache_service import content_hash_from_name, file_digest
+from services.storage_service import get_storage, locate
+from services.catalog_service import DEFAULT_PAGE_SIZE, get_catalog
+from services.ratelimit_service import RateLimitedError, get_limiter
+from services.circuit_service import CircuitOpenError, get_breakers
+from services.metrics_service import metrics, configure_logging
 
 # Load environment variables
 load_dotenv()
+configure_logging()
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)  # Enable CORS for React frontend
 
-# Initialize services
-music_service = MusicService()
-image_service = ImageService()
-story_service = StoryService()
+# Services are built on first use; WARM_SERVICES pre-builds them at startup
+registry = ServiceRegistry()
+registry.register('music', 'services.music_service:MusicService')
+registry.register('image', 'services.image_service:ImageService')
+registry.register('story', 'services.story_service:StoryService')
 
 # Configuration
 OUTPUT_DIR = os.path.join(os.path.dirname(__file__), 'outputs')
+OUTPUT_CATEGORIES = ('images', 'music', 'stories')
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# Hand file bodies to the front-end server (X-Sendfile) when it supports it;
+# otherwise werkzeug uses the WSGI server's file_wrapper (sendfile) if offered
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+
+# path -> ((size, mtime), etag) for files without a hash in their name
+_etag_cache = {}
+
+# Background jobs: type -> (handler, required field)
+JOB_TYPES = {
+    'music': (lambda data: registry.get('music').generate(
+        data['prompt'], data.get('genre', 'electronic'), data.get('duration', 30),
+        data.get('format'), data.get('preview'), data.get('process')), 'prompt'),
+    'image': (lambda data: registry.get('image').generate(
+        data['prompt'], data.get('style', 'photorealistic'), data.get('resolution', '4k'),
+        data.get('format'), data.get('effort', 'balanced'), data.get('variant', 0)), 'prompt'),
+    'story': (lambda data: registry.get('story').generate(
+        data['prompt'], data.get('genre', 'sci-fi'), data.get('length', 'short'),
+        data.get('variant', 0)), 'prompt'),
+    'narration': (lambda data: registry.get('story').narrate(
+        data['text'], data.get('voice', 'alloy'), data.get('speed', 1.0)), 'text')
+}
+
+job_service = JobService(
+    handlers={job_type: handler for job_type, (handler, _) in JOB_TYPES.items()},
+    limits={
+        'music': int(os.getenv('JOB_LIMIT_MUSIC', 2)),
+        'image': int(os.getenv('JOB_LIMIT_IMAGE', 2)),
+        'story': int(os.getenv('JOB_LIMIT_STORY', 4)),
+        'narration': int(os.getenv('JOB_LIMIT_NARRATION', 4))
+    }
+)
+
+# Batches run on the job pools, so JOB_LIMIT_* caps them per service too
+batch_service = BatchService(
+    job_service,
+    required={job_type: required for job_type, (_, required) in JOB_TYPES.items()},
+    variant_types=('image', 'story'),
+    native_variants={
+        # Single-pass stories get every variant from one completion (n>1)
+        'story': (
+            lambda data: data.get('length', 'short') not in registry.get('story').chaptered_lengths,
+            lambda data, count: registry.get('story').generate_variants(
+                data['prompt'], data.get('genre', 'sci-fi'), data.get('length', 'short'), count)
+        )
+    },
+    expand_all={('image', 'style'): lambda: registry.get('image').style_prompts}
+)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    # Label by route pattern, not raw path, to keep series bounded
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    if 'request_start' in g:
+        metrics.observe('arcitek_request_duration_seconds', time.perf_counter() - g.request_start,
+                        help='HTTP request latency (streamed bodies excluded)',
+                        endpoint=endpoint, method=request.method, status=response.status_code)
+    return response
+
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Expose counters and histograms in Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/storage/stats', methods=['GET'])
+def storage_stats():
+    """Report output storage usage per category against quotas and TTLs"""
+    return jsonify({'success': True, 'storage': get_storage().stats()})
+
+
+@app.route('/api/library', methods=['GET'])
+def library():
+    """
+    List generated artifacts, newest first
+    
+    Query parameters: kind (music, image, story, narration), page and
+    per_page (at most 100).
+    """
+    try:
+        return jsonify(dict(get_catalog().list(
+            request.args.get('kind'),
+            request.args.get('page', 1),
+            request.args.get('per_page', DEFAULT_PAGE_SIZE)
+        ), success=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@app.route('/api/library/search', methods=['GET'])
+def library_search():
+    """
+    Full-text search over titles, prompts and story text
+    
+    Query parameters: q (required), kind, page and per_page. Items are
+    ranked by relevance and carry a 'snippet' with matches in [brackets].
+    """
+    try:
+        return jsonify(dict(get_catalog().search(
+            request.args.get('q', ''),
+            request.args.get('kind'),
+            request.args.get('page', 1),
+            request.args.get('per_page', DEFAULT_PAGE_SIZE)
+        ), success=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -37,7 +167,10 @@ def health_check():
         'status': 'online',
         'service': 'ArciTEK.AI Backend',
         'version': '1.0.0',
-        'branding': 'infinite♾2025'
+        'branding': 'infinite♾2025',
+        'services_loaded': registry.loaded(),
+        'rate_limits': get_limiter().stats(),
+        'circuits': get_breakers().stats()
     })
 
 
@@ -50,29 +183,117 @@ def generate_music():
     {
         "prompt": "Epic orchestral soundtrack",
         "genre": "orchestral",
-        "duration": 30
+        "duration": 30,
+        "format": "flac",
+        "preview": "opus",
+        "process": {"loudness": -14, "fade_out": 3, "sample_rate": 48000},
+        "stream": false
     }
+    
+    "format" is the master, flac or wav; "preview" is opus, mp3 or none.
+    Both default from MUSIC_FORMAT / MUSIC_PREVIEW. "process" optionally
+    normalizes loudness, trims, fades and resamples the track (see
+    /api/music/reprocess). With "stream": true the WAV body is returned
+    directly with chunked transfer while it is being generated.
     """
     try:
         data = request.json
         prompt = data.get('prompt')
         genre = data.get('genre', 'electronic')
         duration = data.get('duration', 30)
+        format = data.get('format')
+        preview = data.get('preview')
+        process = data.get('process')
+        stream = data.get('stream', False)
         
         if not prompt:
             return jsonify({'error': 'Prompt is required'}), 400
         
+        if stream:
+            if format not in (None, 'wav'):
+                return jsonify({'error': 'Streamed music is always WAV'}), 400
+            if process:
+                return jsonify({'error': 'Streamed music cannot be post-processed'}), 400
+            result = registry.get('music').generate_stream(prompt, genre, duration)
+            return Response(result['stream'], mimetype='audio/wav', headers={
+                'X-Output-Url': result['url'],
+                'X-Output-Filename': result['filename']
+            })
+        
         # Generate music
-        result = music_service.generate(prompt, genre, duration)
+        result = registry.get('music').generate(prompt, genre, duration, format, preview, process)
+        
+        return jsonify({
+            'success': True,
+            'url': result['url'],
+            'filename': result['filename'],
+            'format': result['format'],
+            'quality': f"{result['sample_rate']}/{result['bit_depth']}",
+            'bytes': result.get('bytes'),
+            'encode_time': result.get('encode_time'),
+            'preview': result.get('preview'),
+            'processing': result.get('processing')
+        })
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/music/reprocess', methods=['POST'])
+def reprocess_music():
+    """
+    Post-process an existing track in outputs/music into new files
+    
+    Request body:
+    {
+        "filename": "music_<hash>.wav",
+        "process": {
+            "loudness": -14,
+            "peak_ceiling": -1,
+            "trim_silence": true,
+            "trim_start": 0.5,
+            "trim_end": 0,
+            "fade_in": 1,
+            "fade_out": 3,
+            "sample_rate": 44100
+        },
+        "format": "flac",
+        "preview": "opus"
+    }
+    
+    "loudness" is an integrated loudness target in LUFS, reached without
+    letting peaks exceed "peak_ceiling" dBFS. Trims and fades are in
+    seconds; "sample_rate" is 96000, 48000 or 44100.
+    """
+    try:
+        data = request.json
+        filename = data.get('filename')
+        
+        if not filename:
+            return jsonify({'error': 'Filename is required'}), 400
+        
+        result = registry.get('music').reprocess(
+            filename, data.get('process'), data.get('format'), data.get('preview'))
         
         return jsonify({
             'success': True,
             'url': result['url'],
             'filename': result['filename'],
-            'format': 'WAV',
-            'quality': '96kHz/24-bit'
+            'source': result['source'],
+            'format': result['format'],
+            'quality': f"{result['sample_rate']}/{result['bit_depth']}",
+            'bytes': result.get('bytes'),
+            'encode_time': result.get('encode_time'),
+            'preview': result.get('preview'),
+            'processing': result.get('processing')
         })
         
+    except FileNotFoundError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -86,29 +307,48 @@ def generate_image():
     {
         "prompt": "A futuristic cityscape at sunset",
         "style": "photorealistic",
-        "resolution": "4k"
+        "resolution": "4k",
+        "format": "webp-lossless",
+        "effort": "balanced"
     }
+    
+    "format" is one of png, webp-lossless, webp, jpeg or avif (when the
+    plugin is installed) and defaults per resolution. "effort" is fast,
+    balanced or max.
     """
     try:
         data = request.json
         prompt = data.get('prompt')
         style = data.get('style', 'photorealistic')
         resolution = data.get('resolution', '4k')
+        image_format = data.get('format')
+        effort = data.get('effort', 'balanced')
         
         if not prompt:
             return jsonify({'error': 'Prompt is required'}), 400
         
         # Generate image
-        result = image_service.generate(prompt, style, resolution)
+        result = registry.get('image').generate(prompt, style, resolution, image_format, effort)
         
         return jsonify({
             'success': True,
             'url': result['url'],
             'filename': result['filename'],
             'resolution': result['resolution'],
-            'megapixels': result['megapixels']
+            'megapixels': result['megapixels'],
+            'format': result['format'],
+            'bytes': result['bytes'],
+            'encode_time': result['encode_time'],
+            'derivatives': result.get('derivatives'),
+            'timings': result.get('timings'),
+            'placeholder': result.get('placeholder', False),
+            'upscale': result.get('upscale')
         })
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RateLimitedError as e:
+        return _rate_limited(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -135,7 +375,7 @@ def generate_story():
             return jsonify({'error': 'Prompt is required'}), 400
         
         # Generate story
-        result = story_service.generate(prompt, genre, length)
+        result = registry.get('story').generate(prompt, genre, length)
         
         return jsonify({
             'success': True,
@@ -146,6 +386,54 @@ def generate_story():
             }
         })
         
+    except RateLimitedError as e:
+        return _rate_limited(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/generate-story/stream', methods=['POST'])
+def generate_story_stream():
+    """
+    Generate a story and relay it as Server-Sent Events while it is written
+    
+    Request body matches /api/generate-story. Events:
+        title  {"title": "..."}
+        delta  {"text": "..."}
+        done   {"title", "word_count", "filename", "url"}
+        error  {"error": "..."}
+    """
+    try:
+        data = request.json
+        prompt = data.get('prompt')
+        genre = data.get('genre', 'sci-fi')
+        length = data.get('length', 'short')
+        
+        if not prompt:
+            return jsonify({'error': 'Prompt is required'}), 400
+        
+        def events():
+            for event, payload in registry.get('story').generate_stream(prompt, genre, length):
+                if event == 'title':
+                    payload = {'title': payload}
+                elif event == 'delta':
+                    payload = {'text': payload}
+                elif event == 'done':
+                    payload = {
+                        'title': payload['title'],
+                        'word_count': payload['word_count'],
+                        'filename': payload['filename'],
+                        'url': f"/api/outputs/stories/{payload['filename']}"
+                    }
+                else:
+                    payload = {'error': payload}
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        
+        return Response(events(), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # Stop nginx from buffering the stream
+        })
+        
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -172,33 +460,269 @@ def narrate_story():
             return jsonify({'error': 'Text is required'}), 400
         
         # Generate narration
-        result = story_service.narrate(text, voice, speed)
+        result = registry.get('story').narrate(text, voice, speed)
         
         return jsonify({
             'success': True,
             'url': result['url'],
             'filename': result['filename'],
-            'duration': result['duration']
+            'duration': result['duration'],
+            'chunks': result.get('chunks')
         })
         
+    except RateLimitedError as e:
+        return _rate_limited(e)
+    except CircuitOpenError as e:
+        return _circuit_open(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/batch', methods=['POST'])
+def generate_batch():
+    """
+    Run several generation requests concurrently, streaming each result
+    as Server-Sent Events when it completes
+    
+    Request body:
+    {
+        "items": [
+            {"type": "image", "params": {"prompt": "A lighthouse", "resolution": "2k"},
+             "expand": {"style": "all"}},
+            {"type": "music", "params": {"prompt": "Rainy night", "duration": 30},
+             "expand": {"genre": ["ambient", "jazz", "lo-fi"]}},
+            {"type": "story", "params": {"prompt": "A lost map", "length": "flash"},
+             "variants": 3}
+        ]
+    }
+    
+    Types and params match /api/jobs. "expand" makes one request per listed
+    value ("all" expands image styles); "variants" asks for several
+    different results for image and story items. Events:
+        item  {"index", "item", "type", "variant", "params", "status",
+               "result" or "error"}
+        done  {"completed", "failed", "total", "seconds"}
+    """
+    try:
+        data = request.json or {}
+        tasks = batch_service.plan(data.get('items'))
+        
+        def events():
+            for event, payload in batch_service.run(tasks):
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        
+        return Response(events(), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # Stop nginx from buffering the stream
+        })
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """
+    Queue a generation job and return its id immediately
+    
+    Request body:
+    {
+        "type": "image",
+        "params": {
+            "prompt": "A futuristic cityscape at sunset",
+            "resolution": "8k"
+        }
+    }
+    
+    Job types: music, image, story, narration. Params match the
+    corresponding /api/generate-* or /api/narrate-story request body.
+    """
+    try:
+        data = request.json
+        job_type = data.get('type')
+        params = data.get('params') or {}
+        
+        if job_type not in JOB_TYPES:
+            return jsonify({'error': f"Job type must be one of: {', '.join(JOB_TYPES)}"}), 400
+        
+        required = JOB_TYPES[job_type][1]
+        if not params.get(required):
+            return jsonify({'error': f"{required.title()} is required"}), 400
+        
+        job = job_service.submit(job_type, params)
+        
+        return jsonify({
+            'success': True,
+            'job': job,
+            'status_url': f"/api/jobs/{job['id']}",
+            'result_url': f"/api/jobs/{job['id']}/result"
+        }), 202
+        
+    except QueueFullError as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Report the status of a queued job"""
+    job = job_service.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job})
+
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """Return a finished job's result (202 while it is still pending)"""
+    job = job_service.result(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    result = job.pop('result')
+    if job['status'] == 'completed':
+        return jsonify({'success': True, 'job': job, 'result': result})
+    if job['status'] == 'failed':
+        return jsonify({'error': job['error'], 'job': job}), 500
+    return jsonify({'success': True, 'job': job}), 202
+
+
 @app.route('/api/outputs/<path:filename>', methods=['GET'])
 def serve_output(filename):
-    """Serve generated output files"""
+    """
+    Serve generated output files
+    
+    Images accept ?size=256|1024|full to fetch a downscaled preview
+    instead of the full-resolution file. Responses carry a strong ETag
+    and support If-None-Match (304) and byte ranges (206).
+    """
     try:
-        file_path = os.path.join(OUTPUT_DIR, filename)
-        if os.path.exists(file_path):
-            return send_file(file_path)
-        else:
+        # Only files inside the output categories are public. safe_join
+        # rejects absolute paths and escapes from OUTPUT_DIR, but resolves
+        # 'images/../x' to the outputs root, so the category is checked on
+        # the normalized path
+        file_path = safe_join(OUTPUT_DIR, filename)
+        if not file_path:
             return jsonify({'error': 'File not found'}), 404
+        parts = os.path.relpath(file_path, OUTPUT_DIR).split(os.sep)
+        if (len(parts) < 2 or parts[0] not in OUTPUT_CATEGORIES
+                or any(part.startswith('.') for part in parts)):
+            return jsonify({'error': 'File not found'}), 404
+        filename = '/'.join(parts)
+        category = parts[0]
+        
+        size = request.args.get('size', 'full')
+        if size != 'full' and category == 'images':
+            if not size.isdigit():
+                return jsonify({'error': 'Size must be a number of pixels or "full"'}), 400
+            file_path = registry.get('image').get_derivative(filename, int(size))
+            if not file_path:
+                return jsonify({'error': 'File not found'}), 404
+        
+        # Public URLs name the file only; it lives in a shard or, for
+        # outputs written before sharding, directly in the category
+        file_path = locate(os.path.dirname(file_path), os.path.basename(file_path))
+        if not file_path:
+            return jsonify({'error': 'File not found'}), 404
+        get_storage().touch(file_path)
+        
+        # Content-addressed names never change content, so clients may
+        # keep them forever; anything else must revalidate
+        immutable = content_hash_from_name(filename) is not None
+        response = send_file(
+            file_path,
+            etag=_output_etag(file_path),
+            conditional=True
+        )
+        if immutable:
+            response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        else:
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+def _rate_limited(error):
+    """429 for a call shed by the rate limiter, with a Retry-After hint"""
+    response = jsonify({'error': str(error), 'retry_after': round(error.retry_after, 3)})
+    response.headers['Retry-After'] = str(max(1, round(error.retry_after)))
+    return response, 429
+
+
+def _circuit_open(error):
+    """503 for a call refused by an open circuit breaker, with a Retry-After hint"""
+    response = jsonify({'error': str(error), 'retry_after': round(error.retry_after, 3)})
+    response.headers['Retry-After'] = str(max(1, round(error.retry_after)))
+    return response, 503
+
+
+def _output_etag(file_path):
+    """
+    Strong ETag from the file's content hash
+    
+    Content-addressed names already carry their hash; other files are
+    hashed once and remembered until their size or mtime changes.
+    """
+    embedded = content_hash_from_name(file_path)
+    if embedded:
+        return embedded
+    
+    stat = os.stat(file_path)
+    signature = (stat.st_size, stat.st_mtime_ns)
+    cached = _etag_cache.get(file_path)
+    if cached and cached[0] == signature:
+        return cached[1]
+    
+    etag = file_digest(file_path)[:32]
+    _etag_cache[file_path] = (signature, etag)
+    return etag
+
+
+# Expire and evict outputs in the background (STORAGE_SWEEP_INTERVAL=0 disables)
+storage = get_storage()
+if storage.interval:
+    storage.start()
+
+# Optional warm-up, e.g. WARM_SERVICES=image,story or all; with gunicorn
+# --preload it runs once before workers fork
+if os.getenv('WARM_SERVICES'):
+    registry.warm(parse_service_names(os.getenv('WARM_SERVICES')))
+
+startup_seconds = time.perf_counter() - _startup_start
+
+
+def profile_startup(names):
+    """Print how long the app module and each service take to become ready"""
+    start = time.perf_counter()
+    timings = registry.warm(names)
+    total = startup_seconds + time.perf_counter() - start
+    
+    print(f"{'app module':<12} {startup_seconds:8.3f}s")
+    for name, stages in timings.items():
+        parts = '  '.join(f"{stage} {seconds:.3f}s" for stage, seconds in stages.items())
+        print(f"{name:<12} {sum(stages.values()):8.3f}s  ({parts})")
+    print(f"{'total':<12} {total:8.3f}s")
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ArciTEK.AI backend server')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='Report import, construction and warm-up times, then exit')
+    parser.add_argument('--warm', default='all',
+                        help="Services to warm with --profile-startup (comma-separated or 'all')")
+    args = parser.parse_args()
+    
+    if args.profile_startup:
+        profile_startup(parse_service_names(args.warm))
+        raise SystemExit(0)
+    
     print("=" * 60)
     print("ArciTEK.AI Backend Server")
     print("infinite♾2025")
@@ -206,9 +730,16 @@ if __name__ == '__main__':
     print("Starting server on http://localhost:5000")
     print("API Endpoints:")
     print("  - POST /api/generate-music")
+    print("  - POST /api/music/reprocess")
     print("  - POST /api/generate-image")
     print("  - POST /api/generate-story")
+    print("  - POST /api/generate-story/stream")
     print("  - POST /api/narrate-story")
+    print("  - POST /api/batch")
+    print("  - POST /api/jobs")
+    print("  - GET  /api/storage/stats")
+    print("  - GET  /api/library")
+    print("  - GET  /api/library/search")
     print("=" * 60)
     
     app.run(debug=True, host='0.0.0.0', port=5000)
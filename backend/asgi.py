@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+ArciTEK.AI ASGI Server
+Async entry point, so one process can hold hundreds of generations in flight
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+The generate and narrate endpoints run on the services' async variants,
+awaiting OpenAI on the event loop and handing CPU-bound steps to a thread
+pool. Every other route (streams, jobs, batch, outputs, metrics) is served
+by the Flask app on a separate pool, so long streams cannot starve the
+services' CPU-bound steps.
+"""
+
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.wsgi import FileWrapper
+
+import app as backend
+from services.metrics_service import metrics
+from services.ratelimit_service import RateLimitedError
+from services.circuit_service import CircuitOpenError
+
+# Threads for CPU-bound steps (decode, upscale, encode, WAV packing, file I/O)
+EXECUTOR_WORKERS = int(os.getenv('ASGI_EXECUTOR_WORKERS', 4 * (os.cpu_count() or 1)))
+
+# Threads for requests served by the Flask app, each held while its response
+# (possibly a long SSE stream) is relayed
+WSGI_WORKERS = int(os.getenv('ASGI_WSGI_WORKERS', 4 * (os.cpu_count() or 1)))
+
+# Block size for file bodies from the Flask app (werkzeug defaults to 8 KB)
+FILE_BLOCK_SIZE = 1024 * 1024
+
+
+class ClientDisconnected(Exception):
+    """Raised while relaying a response whose client has gone"""
+
+
+async def generate_music(data):
+    prompt = data.get('prompt')
+    if not prompt:
+        return 400, {'error': 'Prompt is required'}
+
+    try:
+        result = await backend.registry.get('music').generate_async(
+            prompt, data.get('genre', 'electronic'), data.get('duration', 30),
+            data.get('format'), data.get('preview'), data.get('process'))
+    except ValueError as e:
+        return 400, {'error': str(e)}
+
+    return 200, {
+        'success': True,
+        'url': result['url'],
+        'filename': result['filename'],
+        'format': result['format'],
+        'quality': f"{result['sample_rate']}/{result['bit_depth']}",
+        'bytes': result.get('bytes'),
+        'encode_time': result.get('encode_time'),
+        'preview': result.get('preview'),
+        'processing': result.get('processing')
+    }
+
+
+async def generate_image(data):
+    prompt = data.get('prompt')
+    if not prompt:
+        return 400, {'error': 'Prompt is required'}
+
+    try:
+        result = await backend.registry.get('image').generate_async(
+            prompt, data.get('style', 'photorealistic'), data.get('resolution', '4k'),
+            data.get('format'), data.get('effort', 'balanced'))
+    except ValueError as e:
+        return 400, {'error': str(e)}
+
+    return 200, {
+        'success': True,
+        'url': result['url'],
+        'filename': result['filename'],
+        'resolution': result['resolution'],
+        'megapixels': result['megapixels'],
+        'format': result['format'],
+        'bytes': result['bytes'],
+        'encode_time': result['encode_time'],
+        'derivatives': result.get('derivatives'),
+        'timings': result.get('timings'),
+        'placeholder': result.get('placeholder', False),
+        'upscale': result.get('upscale')
+    }
+
+
+async def generate_story(data):
+    prompt = data.get('prompt')
+    if not prompt:
+        return 400, {'error': 'Prompt is required'}
+
+    result = await backend.registry.get('story').generate_async(
+        prompt, data.get('genre', 'sci-fi'), data.get('length', 'short'))
+
+    return 200, {
+        'success': True,
+        'story': {
+            'title': result['title'],
+            'content': result['content'],
+            'word_count': result['word_count']
+        }
+    }
+
+
+async def narrate_story(data):
+    text = data.get('text')
+    if not text:
+        return 400, {'error': 'Text is required'}
+
+    result = await backend.registry.get('story').narrate_async(
+        text, data.get('voice', 'alloy'), data.get('speed', 1.0))
+
+    return 200, {
+        'success': True,
+        'url': result['url'],
+        'filename': result['filename'],
+        'duration': result['duration'],
+        'chunks': result.get('chunks')
+    }
+
+
+# POST routes served natively; request bodies and responses match app.py
+ASYNC_ROUTES = {
+    '/api/generate-music': generate_music,
+    '/api/generate-image': generate_image,
+    '/api/generate-story': generate_story,
+    '/api/narrate-story': narrate_story
+}
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    body = await _read_body(receive)
+    handler = ASYNC_ROUTES.get(scope['path']) if scope['method'] == 'POST' else None
+
+    # Streamed music is a chunked WAV body, which the Flask route produces
+    if handler and not (handler is generate_music and _wants_stream(body)):
+        await _serve_async(scope, handler, body, send)
+    else:
+        await _serve_wsgi(scope, body, receive, send)
+
+
+async def _serve_async(scope, handler, body, send):
+    start = time.perf_counter()
+    try:
+        data = json.loads(body or b'null')
+        if not isinstance(data, dict):
+            raise ValueError('Request body must be a JSON object')
+    except ValueError as e:
+        status, payload = 400, {'error': str(e)}
+    else:
+        try:
+            status, payload = await handler(data)
+        except RateLimitedError as e:
+            status, payload = 429, {'error': str(e), 'retry_after': round(e.retry_after, 3)}
+        except CircuitOpenError as e:
+            status, payload = 503, {'error': str(e), 'retry_after': round(e.retry_after, 3)}
+        except Exception as e:
+            status, payload = 500, {'error': str(e)}
+
+    content = json.dumps(payload).encode('utf-8')
+    headers = [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(content)).encode('ascii')),
+        (b'access-control-allow-origin', b'*')
+    ]
+    if status in (429, 503):
+        headers.append((b'retry-after', str(max(1, round(payload['retry_after']))).encode('ascii')))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': content})
+
+    metrics.observe('arcitek_request_duration_seconds', time.perf_counter() - start,
+                    help='HTTP request latency (streamed bodies excluded)',
+                    endpoint=scope['path'], method='POST', status=status)
+
+
+async def _serve_wsgi(scope, body, receive, send):
+    """
+    Run the Flask app on the WSGI pool and relay its response
+
+    Each body chunk is pulled on the pool too, so streamed responses (SSE,
+    chunked WAV) never block the event loop. The server drops sends to a
+    client that has gone, so the response is closed as soon as receive()
+    reports the disconnect; streams then stop generating.
+    """
+    loop = asyncio.get_running_loop()
+    executor = _wsgi_executor()
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [
+            (name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in headers
+        ]
+
+    environ = _environ(scope, body)
+    iterable = await loop.run_in_executor(executor, backend.app, environ, start_response)
+    try:
+        iterator = iter(iterable)
+        chunk = await _next_chunk(loop, executor, iterator, disconnected)
+        await send({'type': 'http.response.start', 'status': started['status'],
+                    'headers': started['headers']})
+        while chunk is not None:
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            chunk = await _next_chunk(loop, executor, iterator, disconnected)
+        await send({'type': 'http.response.body', 'body': b''})
+    except ClientDisconnected:
+        pass
+    finally:
+        disconnected.cancel()
+        # Runs generators' cleanup (scratch files, cancelling pending work)
+        if hasattr(iterable, 'close'):
+            await loop.run_in_executor(executor, iterable.close)
+
+
+async def _next_chunk(loop, executor, iterator, disconnected):
+    """
+    Pull the next body chunk, or None at the end
+
+    Raises:
+        ClientDisconnected: If the client goes first. The chunk being
+            produced is waited for and dropped, since a running generator
+            cannot be closed.
+    """
+    chunk = loop.run_in_executor(executor, next, iterator, None)
+    await asyncio.wait((chunk, disconnected), return_when=asyncio.FIRST_COMPLETED)
+    if disconnected.done():
+        with contextlib.suppress(Exception):
+            await chunk
+        raise ClientDisconnected()
+    return chunk.result()
+
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+_wsgi_pool = None
+
+
+def _wsgi_executor():
+    """Return the pool for Flask-served requests, created on first use"""
+    global _wsgi_pool
+    if _wsgi_pool is None:
+        _wsgi_pool = ThreadPoolExecutor(max_workers=WSGI_WORKERS, thread_name_prefix='asgi-wsgi')
+    return _wsgi_pool
+
+
+def _environ(scope, body):
+    """Build a WSGI environ for an ASGI HTTP scope"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        'wsgi.file_wrapper': lambda file, block_size=FILE_BLOCK_SIZE: FileWrapper(file, FILE_BLOCK_SIZE)
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+def _wants_stream(body):
+    try:
+        data = json.loads(body or b'null')
+    except ValueError:
+        return False
+    return isinstance(data, dict) and bool(data.get('stream'))
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # asyncio.to_thread and run_in_executor(None, ...) use this pool
+            asyncio.get_running_loop().set_default_executor(
+                ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS, thread_name_prefix='asgi')
+            )
+            # Services named in WARM_SERVICES were already built by app.py
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _wsgi_pool is not None:
+                _wsgi_pool.shutdown(wait=False)
+            backend.registry.shutdown()
+            backend.job_service.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host='0.0.0.0', port=int(os.getenv('PORT', 5000)))
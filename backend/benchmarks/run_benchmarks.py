@@ -0,0 +1,543 @@
+"""
+Benchmark Harness
+Offline load and latency benchmarks for the generation services and API
+
+Every scenario runs against the fake OpenAI client, so no API key or
+network access is needed and results are comparable between releases.
+
+Usage (from backend/):
+    python benchmarks/run_benchmarks.py --quick
+    python benchmarks/run_benchmarks.py --suite http --concurrency 8
+    python benchmarks/run_benchmarks.py --baseline benchmarks/results/v1.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+RESULTS_DIR = os.path.join(BACKEND_DIR, 'benchmarks', 'results')
+sys.path.insert(0, BACKEND_DIR)
+
+# Scenario matrix: (name, parameters); --quick keeps the first entries only
+MUSIC_DURATIONS = (10, 30, 120)
+IMAGE_RESOLUTIONS = ('hd', '2k', '4k', '8k')
+STORY_LENGTHS = ('flash', 'short', 'medium', 'long')
+NARRATION_SIZES = (('1k', 1000), ('20k', 20000), ('80k', 80000))
+
+PROMPT = 'A lighthouse keeper who collects storms in glass jars'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks for the arcitekAI backend')
+    parser.add_argument('--suite', choices=('services', 'http', 'all'), default='all')
+    parser.add_argument('--quick', action='store_true', help='Smallest scenario of each kind, few iterations')
+    parser.add_argument('--iterations', type=int, default=5, help='Calls per service scenario')
+    parser.add_argument('--requests', type=int, default=40, help='Requests per HTTP scenario')
+    parser.add_argument('--concurrency', type=int, default=4, help='Concurrent HTTP clients')
+    parser.add_argument('--latency', type=float, default=0.05, help='Fake API seconds per call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Extra random fake API seconds per call')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of fake API calls failing')
+    parser.add_argument('--image', help='PNG returned by the fake image API')
+    parser.add_argument('--text', help='Text file used for fake completions')
+    parser.add_argument('--audio', help='MP3 returned by the fake speech API')
+    parser.add_argument('--cached', action='store_true', help='Repeat identical requests to measure cache hits')
+    parser.add_argument('--rate-limits', action='store_true',
+                        help='Keep the per-model rate limits (off by default so they do not cap throughput)')
+    parser.add_argument('--url', help='Benchmark a running server instead of the in-process app')
+    parser.add_argument('--output', help='Results file (default benchmarks/results/<timestamp>.json)')
+    parser.add_argument('--baseline', help='Earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='Relative p95 slowdown reported as a regression')
+    args = parser.parse_args()
+
+    if args.quick:
+        args.iterations = min(args.iterations, 2)
+        args.requests = min(args.requests, 8)
+
+    # The fake client is built from the environment on first use
+    os.environ['OPENAI_FAKE'] = '1'
+    os.environ['FAKE_OPENAI_LATENCY'] = str(args.latency)
+    os.environ['FAKE_OPENAI_JITTER'] = str(args.jitter)
+    os.environ['FAKE_OPENAI_ERROR_RATE'] = str(args.error_rate)
+    for name, value in (('FAKE_OPENAI_IMAGE', args.image), ('FAKE_OPENAI_TEXT', args.text),
+                        ('FAKE_OPENAI_AUDIO', args.audio)):
+        if value:
+            os.environ[name] = os.path.abspath(value)
+    if not args.rate_limits:
+        from services.ratelimit_service import DEFAULT_LIMITS, get_limiter
+        get_limiter().limits = {model: (0, 0) for model in DEFAULT_LIMITS}
+    # Failures are expected with --error-rate; keep the report readable
+    os.environ.setdefault('LOG_LEVEL', 'CRITICAL')
+    from services.metrics_service import configure_logging
+    configure_logging()
+
+    workdir = tempfile.mkdtemp(prefix='arcitek-bench-')
+    scenarios = []
+    try:
+        if args.suite in ('services', 'all'):
+            scenarios.extend(run_service_suite(args, workdir))
+        if args.suite in ('http', 'all'):
+            scenarios.extend(run_http_suite(args, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'environment': _environment(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'scenarios': scenarios
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime('%Y%m%d-%H%M%S.json'))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+def run_service_suite(args, workdir):
+    """
+    Call each service directly across durations, resolutions and lengths
+
+    Returns:
+        list: Scenario result dicts
+    """
+    from services.cache_service import ResultCache
+    from services.image_service import ImageService
+    from services.music_service import MusicService
+    from services.story_service import StoryService
+
+    cache = ResultCache(root=workdir)
+    music, image, story = _isolate(MusicService(), ImageService(), StoryService(), workdir, cache)
+
+    durations = MUSIC_DURATIONS[:1] if args.quick else MUSIC_DURATIONS
+    resolutions = IMAGE_RESOLUTIONS[:2] if args.quick else IMAGE_RESOLUTIONS
+    lengths = STORY_LENGTHS[:2] if args.quick else STORY_LENGTHS
+    narrations = NARRATION_SIZES[:1] if args.quick else NARRATION_SIZES
+
+    sample_text = _sample_text(max(size for _, size in narrations))
+
+    results = []
+    try:
+        for duration in durations:
+            results.append(_run_service_scenario(
+                f'music.generate[{duration}s]', args,
+                lambda prompt: music.generate(prompt, 'ambient', duration)
+            ))
+        for resolution in resolutions:
+            results.append(_run_service_scenario(
+                f'image.generate[{resolution}]', args,
+                lambda prompt: image.generate(prompt, 'photorealistic', resolution)
+            ))
+        for length in lengths:
+            results.append(_run_service_scenario(
+                f'story.generate[{length}]', args,
+                lambda prompt: story.generate(prompt, 'fantasy', length)
+            ))
+        for label, size in narrations:
+            results.append(_run_service_scenario(
+                f'story.narrate[{label}]', args,
+                lambda prompt: story.narrate(f"{prompt}\n\n{sample_text[:size]}", 'alloy', 1.0)
+            ))
+    finally:
+        image.upscaler.shutdown()
+
+    return results
+
+
+def run_http_suite(args, workdir):
+    """
+    Drive the Flask endpoints with concurrent clients
+
+    Uses the in-process app through its test client, or a running server
+    when --url is given.
+
+    Returns:
+        list: Scenario result dicts
+    """
+    if args.url:
+        send = _http_sender(args.url)
+        shutdown = None
+    else:
+        import app as backend
+        from services.cache_service import ResultCache
+
+        services = backend.registry
+        _isolate(services.get('music'), services.get('image'), services.get('story'), workdir,
+                 ResultCache(root=workdir))
+        backend.OUTPUT_DIR = workdir
+        send = _test_client_sender(backend.app)
+        shutdown = services.shutdown
+
+    narration = _sample_text(20000)
+    scenarios = [
+        ('GET /api/health', 'GET', '/api/health', lambda prompt: None, False),
+        ('POST /api/generate-image[hd]', 'POST', '/api/generate-image',
+         lambda prompt: {'prompt': prompt, 'resolution': 'hd'}, False),
+        ('POST /api/generate-music[10s]', 'POST', '/api/generate-music',
+         lambda prompt: {'prompt': prompt, 'duration': 10}, False),
+        ('POST /api/generate-music[10s,stream]', 'POST', '/api/generate-music',
+         lambda prompt: {'prompt': prompt, 'duration': 10, 'stream': True}, True),
+        ('POST /api/generate-story[short]', 'POST', '/api/generate-story',
+         lambda prompt: {'prompt': prompt, 'length': 'short'}, False),
+        ('POST /api/generate-story/stream[short]', 'POST', '/api/generate-story/stream',
+         lambda prompt: {'prompt': prompt, 'length': 'short'}, True),
+        ('POST /api/narrate-story[20k]', 'POST', '/api/narrate-story',
+         lambda prompt: {'text': f"{prompt}\n\n{narration}"}, False),
+    ]
+    if args.quick:
+        scenarios = scenarios[:3] + scenarios[5:6]
+
+    try:
+        return [
+            _run_http_scenario(name, args, send, method, path, body, streamed)
+            for name, method, path, body, streamed in scenarios
+        ]
+    finally:
+        if shutdown:
+            shutdown()
+
+
+def _isolate(music, image, story, workdir, cache):
+    """Point services at a scratch outputs tree so runs leave nothing behind"""
+    from services.catalog_service import Catalog
+
+    music.output_dir = os.path.join(workdir, 'music')
+    image.output_dir = os.path.join(workdir, 'images')
+    image.derivative_dir = os.path.join(image.output_dir, 'derivatives')
+    story.output_dir = os.path.join(workdir, 'stories')
+    for directory in (music.output_dir, image.derivative_dir, story.output_dir):
+        os.makedirs(directory, exist_ok=True)
+    catalog = Catalog(os.path.join(workdir, 'catalog.db'), root=workdir)
+    for service in (music, image, story):
+        service.cache = cache
+        service.catalog = catalog
+    return music, image, story
+
+
+def _run_service_scenario(name, args, call):
+    """
+    Run call(prompt) sequentially and collect latency and resource usage
+
+    Prompts are unique per call unless --cached, so every call does the
+    full work instead of hitting the result cache.
+    """
+    print(f"{name} ...", end=' ', flush=True)
+    latencies = []
+    failures = 0
+
+    with _ResourceMonitor() as monitor:
+        for i in range(args.iterations):
+            prompt = PROMPT if args.cached else f"{PROMPT} ({uuid.uuid4().hex[:8]})"
+            start = time.perf_counter()
+            try:
+                call(prompt)
+            except Exception:
+                failures += 1
+            latencies.append(time.perf_counter() - start)
+
+    result = _summarize(name, latencies, failures, monitor)
+    print(_format(result))
+    return result
+
+
+def _run_http_scenario(name, args, send, method, path, body, streamed):
+    """
+    Issue --requests requests from --concurrency closed-loop clients
+
+    Each client sends its next request as soon as the previous response
+    has been fully read. Streamed responses also record time to first byte.
+    """
+    print(f"{name} ...", end=' ', flush=True)
+    latencies = []
+    first_bytes = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def worker(count):
+        for _ in range(count):
+            prompt = PROMPT if args.cached else f"{PROMPT} ({uuid.uuid4().hex[:8]})"
+            start = time.perf_counter()
+            try:
+                status, first_byte = send(method, path, body(prompt))
+            except Exception:
+                status, first_byte = 'exception', None
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                if streamed and first_byte is not None:
+                    first_bytes.append(first_byte - start)
+
+    concurrency = max(1, min(args.concurrency, args.requests))
+    shares = [args.requests // concurrency + (i < args.requests % concurrency) for i in range(concurrency)]
+
+    with _ResourceMonitor() as monitor:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(worker, shares))
+
+    failures = sum(count for status, count in statuses.items() if not status.startswith('2'))
+    result = _summarize(name, latencies, failures, monitor)
+    result['concurrency'] = concurrency
+    result['statuses'] = statuses
+    if first_bytes:
+        result['ttfb'] = _percentiles(first_bytes)
+    print(_format(result))
+    return result
+
+
+def _test_client_sender(flask_app):
+    client = flask_app.test_client()
+
+    def send(method, path, body):
+        response = client.open(path, method=method, json=body, buffered=False)
+        first_byte = None
+        try:
+            for chunk in response.response:
+                if first_byte is None and chunk:
+                    first_byte = time.perf_counter()
+        finally:
+            response.close()
+        return response.status_code, first_byte
+
+    return send
+
+
+def _http_sender(base_url):
+    import requests
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=64, pool_maxsize=64)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    def send(method, path, body):
+        with session.request(method, base_url.rstrip('/') + path, json=body, stream=True, timeout=600) as response:
+            first_byte = None
+            for chunk in response.iter_content(chunk_size=65536):
+                if first_byte is None and chunk:
+                    first_byte = time.perf_counter()
+            return response.status_code, first_byte
+
+    return send
+
+
+class _ResourceMonitor:
+    """
+    Measure wall time, CPU, peak RSS and per-stage metrics over a block
+
+    Peak RSS is reset at the start where the kernel allows it
+    (/proc/self/clear_refs), so each scenario reports its own high-water
+    mark; elsewhere it is the process peak so far.
+    """
+
+    def __enter__(self):
+        from services.metrics_service import metrics
+        metrics.reset()
+        _reset_peak_rss()
+        self.start = time.perf_counter()
+        self.cpu_start = _cpu_times()
+        return self
+
+    def __exit__(self, *exc):
+        from services.metrics_service import metrics
+        self.wall = time.perf_counter() - self.start
+        cpu_end = _cpu_times()
+        self.cpu = {key: cpu_end[key] - self.cpu_start[key] for key in cpu_end}
+        self.peak_rss_mb = _peak_rss_mb()
+        self.stages = _stage_stats(metrics)
+        self.counters = _counter_totals(metrics)
+        return False
+
+
+def _summarize(name, latencies, failures, monitor):
+    count = len(latencies)
+    return {
+        'name': name,
+        'count': count,
+        'failures': failures,
+        'latency': _percentiles(latencies),
+        'throughput': round(count / monitor.wall, 3) if monitor.wall else None,
+        'wall_seconds': round(monitor.wall, 4),
+        'cpu_seconds': {key: round(value, 4) for key, value in monitor.cpu.items()},
+        'peak_rss_mb': monitor.peak_rss_mb,
+        'stages': monitor.stages,
+        'fallbacks': monitor.counters.get('arcitek_fallbacks_total', 0),
+        'upstream_errors': monitor.counters.get('arcitek_errors_total', 0),
+        'output_bytes': monitor.counters.get('arcitek_output_bytes_total', 0)
+    }
+
+
+def _percentiles(values):
+    ordered = sorted(values)
+    return {
+        'p50': round(_percentile(ordered, 50), 4),
+        'p95': round(_percentile(ordered, 95), 4),
+        'p99': round(_percentile(ordered, 99), 4),
+        'mean': round(sum(ordered) / len(ordered), 4) if ordered else 0.0,
+        'max': round(ordered[-1], 4) if ordered else 0.0
+    }
+
+
+def _percentile(ordered, pct):
+    """Linearly interpolated percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def _stage_stats(metrics):
+    """
+    Per-stage wall and CPU totals recorded by the services' timed() blocks
+
+    Returns:
+        dict: 'service.stage' -> {count, mean_seconds, total_seconds, cpu_seconds}
+    """
+    stages = {}
+    with metrics.lock:
+        for (name, labels), series in metrics.histograms.items():
+            if name not in ('arcitek_stage_duration_seconds', 'arcitek_stage_cpu_seconds'):
+                continue
+            labels = dict(labels)
+            stage = stages.setdefault(f"{labels['service']}.{labels['stage']}", {})
+            if name == 'arcitek_stage_duration_seconds':
+                stage['count'] = series['count']
+                stage['total_seconds'] = round(series['sum'], 4)
+                stage['mean_seconds'] = round(series['sum'] / series['count'], 4)
+            else:
+                stage['cpu_seconds'] = round(series['sum'], 4)
+    return dict(sorted(stages.items()))
+
+
+def _counter_totals(metrics):
+    totals = {}
+    with metrics.lock:
+        for (name, _), value in metrics.counters.items():
+            totals[name] = totals.get(name, 0) + value
+    return totals
+
+
+def _cpu_times():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    # Includes finished worker processes only; live pool workers are not counted
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        'user': own.ru_utime,
+        'system': own.ru_stime,
+        'children': children.ru_utime + children.ru_stime
+    }
+
+
+def _reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _sample_text(size):
+    paragraph = (
+        "The keeper climbed the spiral stair each evening, counting the steps aloud. "
+        "Below, the sea argued with the rocks, and the jars along the wall hummed "
+        "with weather that had nowhere left to go. "
+    )
+    paragraphs = []
+    while sum(len(p) + 2 for p in paragraphs) < size:
+        paragraphs.append(paragraph * 4)
+    return '\n\n'.join(paragraphs)[:size]
+
+
+def _environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def _format(result):
+    latency = result['latency']
+    line = (f"p50 {latency['p50'] * 1000:.0f}ms  p95 {latency['p95'] * 1000:.0f}ms  "
+            f"p99 {latency['p99'] * 1000:.0f}ms  {result['throughput']}/s  "
+            f"rss {result['peak_rss_mb']}MB")
+    if result['failures']:
+        line += f"  failures {result['failures']}"
+    return line
+
+
+def compare(baseline, current, threshold):
+    """
+    Print scenarios whose p95 latency or peak RSS grew beyond threshold
+
+    Returns:
+        list: Names of regressed scenarios
+    """
+    previous = {scenario['name']: scenario for scenario in baseline.get('scenarios', [])}
+    regressions = []
+
+    print(f"\nCompared with baseline from {baseline.get('created_at')} "
+          f"({baseline.get('environment', {}).get('commit')}):")
+    for scenario in current['scenarios']:
+        before = previous.get(scenario['name'])
+        if not before:
+            continue
+        changes = {
+            'p95': (before['latency']['p95'], scenario['latency']['p95']),
+            'rss': (before['peak_rss_mb'], scenario['peak_rss_mb'])
+        }
+        flagged = [
+            f"{metric} {old} -> {new}"
+            for metric, (old, new) in changes.items()
+            if old and new > old * (1 + threshold)
+        ]
+        if flagged:
+            regressions.append(scenario['name'])
+            print(f"  REGRESSION {scenario['name']}: {', '.join(flagged)}")
+
+    if not regressions:
+        print('  no regressions')
+    return regressions
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,402 @@
+"""
+Audio Encoder Service
+Writes one stream of PCM blocks to several audio formats in a single pass
+"""
+
+import math
+import os
+import struct
+import time
+import wave
+
+# Frames encoded per WAV write (~768 KB of 24-bit stereo)
+WAV_CHUNK_FRAMES = 131072
+
+# Output formats. Masters keep the source rate and 24-bit depth; previews
+# are lossy, resampled to 48 kHz (the rate Opus requires). compression_level
+# is libsndfile's 0 (best quality) to 1 (smallest) scale.
+FORMATS = {
+    'wav': {'label': 'WAV', 'extension': '.wav', 'role': 'master'},
+    'flac': {'label': 'FLAC', 'extension': '.flac', 'role': 'master',
+             'container': 'FLAC', 'subtype': 'PCM_24'},
+    'opus': {'label': 'Opus', 'extension': '.opus', 'role': 'preview', 'bitrate': '~64 kbps',
+             'container': 'OGG', 'subtype': 'OPUS', 'sample_rate': 48000, 'compression_level': 0.9},
+    'mp3': {'label': 'MP3', 'extension': '.mp3', 'role': 'preview', 'bitrate': '96 kbps',
+            'container': 'MP3', 'subtype': 'MPEG_LAYER_III', 'sample_rate': 48000, 'compression_level': 0.8,
+            'bitrate_mode': 'CONSTANT'}
+}
+
+# Filter taps per output sample when resampling, and output frames
+# computed per vectorized step
+RESAMPLER_TAPS = 64
+RESAMPLER_SLICE = 8192
+
+
+def available_formats():
+    """
+    Formats this installation can write
+
+    FLAC, Opus and MP3 need the optional soundfile package (libsndfile
+    1.1+ for MP3); WAV is always available.
+
+    Returns:
+        tuple: Format names, a subset of FORMATS
+    """
+    try:
+        import soundfile
+    except (ImportError, OSError):
+        return ('wav',)
+    supported = soundfile.available_formats()
+    return ('wav',) + tuple(
+        name for name, spec in FORMATS.items()
+        if 'container' in spec and spec['container'] in supported
+        and spec['subtype'] in soundfile.available_subtypes(spec['container'])
+    )
+
+
+class MultiEncoder:
+    """
+    Encodes the same audio blocks to several files at once
+
+    Every writer receives each block as it is synthesized, so a master and
+    its preview cost one pass over the audio and neither is read back from
+    disk.
+    """
+
+    def __init__(self, outputs, sample_rate, num_channels=2):
+        """
+        Args:
+            outputs (dict): Format name -> destination path
+            sample_rate (int): Source sample rate in Hz
+            num_channels (int): Output channel count; mono blocks are
+                duplicated across channels by each writer
+        """
+        self.sample_rate = sample_rate
+        self.num_channels = num_channels
+        self.writers = {
+            format: _open_writer(format, path, sample_rate, num_channels)
+            for format, path in outputs.items()
+        }
+        self.paths = dict(outputs)
+
+    def write(self, block):
+        """Encode one block of float samples in [-1.0, 1.0] to every output"""
+        import numpy as np
+
+        frames = np.asarray(block)
+        if frames.ndim == 1:
+            frames = frames[:, np.newaxis]
+
+        for writer in self.writers.values():
+            start = time.perf_counter()
+            writer.write(frames)
+            writer.encode_time += time.perf_counter() - start
+
+    def close(self):
+        """
+        Finish every output
+
+        Returns:
+            dict: Format name -> {'bytes', 'encode_time'}
+        """
+        stats = {}
+        for format, writer in self.writers.items():
+            start = time.perf_counter()
+            writer.close()
+            writer.encode_time += time.perf_counter() - start
+            stats[format] = {
+                'bytes': os.path.getsize(self.paths[format]),
+                'encode_time': round(writer.encode_time, 4)
+            }
+        return stats
+
+    def abort(self):
+        """Close and delete every output after a failure"""
+        for format, writer in self.writers.items():
+            try:
+                writer.close()
+            except Exception:
+                pass
+            try:
+                os.remove(self.paths[format])
+            except FileNotFoundError:
+                pass
+
+
+def encode_blocks(blocks, outputs, sample_rate, num_channels=2):
+    """
+    Encode an iterable of float blocks to every format in outputs
+
+    Args:
+        blocks (iterable): Float sample blocks in [-1.0, 1.0]
+        outputs (dict): Format name -> destination path
+        sample_rate (int): Source sample rate in Hz
+        num_channels (int): Output channel count
+
+    Returns:
+        dict: Format name -> {'bytes', 'encode_time'}
+    """
+    encoder = MultiEncoder(outputs, sample_rate, num_channels)
+    try:
+        for block in blocks:
+            encoder.write(block)
+    except BaseException:
+        encoder.abort()
+        raise
+    return encoder.close()
+
+
+class _WavWriter:
+    """24-bit PCM WAV through the standard library"""
+
+    def __init__(self, path, sample_rate, num_channels):
+        self.num_channels = num_channels
+        self.encode_time = 0.0
+        self.file = wave.open(path, 'wb')
+        self.file.setnchannels(num_channels)
+        self.file.setsampwidth(3)  # 24-bit (3 bytes)
+        self.file.setframerate(sample_rate)
+
+    def write(self, frames):
+        self.file.writeframesraw(encode_pcm24(frames, self.num_channels))
+
+    def close(self):
+        self.file.close()
+
+
+class _SoundFileWriter:
+    """FLAC, Opus or MP3 through libsndfile, resampling if the format needs it"""
+
+    def __init__(self, spec, path, sample_rate, num_channels):
+        import soundfile
+
+        self.num_channels = num_channels
+        self.encode_time = 0.0
+        target_rate = spec.get('sample_rate', sample_rate)
+        self.resampler = Resampler(sample_rate, target_rate) if target_rate != sample_rate else None
+        options = {name: spec[name] for name in ('compression_level', 'bitrate_mode') if name in spec}
+        self.file = soundfile.SoundFile(path, 'w', samplerate=target_rate, channels=num_channels,
+                                        format=spec['container'], subtype=spec['subtype'], **options)
+
+    def write(self, frames):
+        if self.resampler:
+            frames = self.resampler.process(frames)
+        self._write(frames)
+
+    def close(self):
+        if self.resampler:
+            self._write(self.resampler.flush())
+            self.resampler = None
+        self.file.close()
+
+    def _write(self, frames):
+        import numpy as np
+
+        # Duplicate mono after resampling so it is filtered only once
+        if frames.shape[1] != self.num_channels:
+            frames = np.repeat(frames[:, :1], self.num_channels, axis=1)
+        self.file.write(frames)
+
+
+class Resampler:
+    """
+    Streaming rational-ratio resampler, e.g. 96 kHz to 48 or 44.1 kHz
+
+    The input is treated as upsampled by `up`, low-passed by a windowed
+    sinc below the lower of the two Nyquist rates, and decimated by `down`.
+    Only the filter branch that lands on a kept sample is evaluated
+    (polyphase). Filter history carries across blocks, so block boundaries
+    are seamless, and the filter delay is compensated: output frame m
+    lines up with input time m / target_rate, and flush() emits the tail.
+    """
+
+    def __init__(self, source_rate, target_rate, taps=RESAMPLER_TAPS):
+        """
+        Args:
+            source_rate (int): Input sample rate in Hz
+            target_rate (int): Output sample rate in Hz
+            taps (int): Filter taps per output sample
+        """
+        import numpy as np
+
+        divisor = math.gcd(source_rate, target_rate)
+        self.up = target_rate // divisor
+        self.down = source_rate // divisor
+        self.taps = taps
+
+        # Odd length, so the delay is a whole number of upsampled samples
+        length = taps * self.up - 1
+        offsets = np.arange(length) - (length - 1) / 2
+        cutoff = 0.45 / max(self.up, self.down)  # cycles per upsampled sample
+        prototype = 2 * cutoff * np.sinc(2 * cutoff * offsets) * np.blackman(length)
+        prototype *= self.up / prototype.sum()  # unity gain despite zero-stuffing
+        prototype = np.append(prototype, 0.0)
+
+        # bank[p] is branch p, reversed to match input windows in time order
+        self.bank = prototype.reshape(taps, self.up).T[:, ::-1].copy()
+        self.delay = (length - 1) // 2
+        self.history = None
+        self.received = 0
+        self.emitted = 0
+
+    def process(self, frames):
+        """
+        Args:
+            frames (ndarray): Float frames with shape (frames, channels)
+
+        Returns:
+            ndarray: Resampled frames with the same channel count
+        """
+        import numpy as np
+        from numpy.lib.stride_tricks import sliding_window_view
+
+        if self.history is None:
+            self.history = np.zeros((self.taps - 1, frames.shape[1]))
+        padded = np.concatenate([self.history, frames])
+        base = self.received
+        self.received += len(frames)
+        self.history = padded[len(padded) - (self.taps - 1):]
+
+        # Output m is upsampled sample m * down + delay, which needs input
+        # frame (m * down + delay) // up and filter branch (m * down + delay) % up
+        last = (self.received * self.up - 1 - self.delay) // self.down
+        positions = np.arange(self.emitted, last + 1) * self.down + self.delay
+        self.emitted = max(self.emitted, last + 1)
+
+        if self.up == 1:
+            # Integer decimation has a single branch: a plain convolution is
+            # faster than gathering windows, even computing every frame
+            kernel = self.bank[0][::-1]
+            filtered = np.stack([
+                np.convolve(padded[:, channel], kernel, mode='valid')
+                for channel in range(padded.shape[1])
+            ], axis=1)
+            return filtered[positions - base]
+
+        windows = sliding_window_view(padded, self.taps, axis=0)
+        output = np.empty((len(positions), frames.shape[1]))
+        # Gather windows in slices to bound the temporary copy
+        for start in range(0, len(positions), RESAMPLER_SLICE):
+            chunk = positions[start:start + RESAMPLER_SLICE]
+            output[start:start + len(chunk)] = np.einsum(
+                'nct,nt->nc', windows[chunk // self.up - base], self.bank[chunk % self.up])
+        return output
+
+    def flush(self):
+        """
+        Emit the frames still held back by the filter delay
+
+        Returns:
+            ndarray: The last resampled frames
+        """
+        import numpy as np
+
+        if self.history is None:
+            return np.zeros((0, 1))
+        total = -(-self.received * self.up // self.down)
+        if self.emitted >= total:
+            return np.zeros((0, self.history.shape[1]))
+        emitted = self.emitted
+        needed = ((total - 1) * self.down + self.delay) // self.up + 1 - self.received
+        output = self.process(np.zeros((needed, self.history.shape[1])))
+        return output[:total - emitted]
+
+
+def _open_writer(format, path, sample_rate, num_channels):
+    if format == 'wav':
+        return _WavWriter(path, sample_rate, num_channels)
+    return _SoundFileWriter(FORMATS[format], path, sample_rate, num_channels)
+
+
+def encode_pcm24(audio, num_channels=2):
+    """
+    Pack float audio into 24-bit little-endian interleaved PCM bytes
+
+    Args:
+        audio (ndarray): Float samples in [-1.0, 1.0], either mono with
+            shape (frames,) or multichannel with shape (frames, channels)
+        num_channels (int): Output channel count; mono input is duplicated
+            across all channels
+
+    Returns:
+        bytes: Interleaved PCM frames, 3 bytes per sample
+    """
+    import numpy as np
+
+    audio = np.asarray(audio)
+    if audio.ndim == 1:
+        audio = audio[:, np.newaxis]
+
+    # Scale to signed 24-bit range, held in little-endian int32
+    samples = np.clip(audio, -1.0, 1.0)
+    samples *= 2**23 - 1
+    samples = samples.astype('<i4')
+
+    # Duplicate after conversion so only the source channels are scaled
+    if samples.shape[1] != num_channels:
+        samples = np.repeat(samples[:, :1], num_channels, axis=1)
+
+    # Drop the high byte of each int32 to get 3-byte samples
+    return samples.view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+
+
+def write_pcm24_wav(filepath, audio, sample_rate, num_channels=2, chunk_frames=WAV_CHUNK_FRAMES):
+    """
+    Write float audio to a 24-bit PCM WAV file in fixed-size chunks
+
+    Args:
+        filepath (str): Destination path
+        audio (ndarray or iterable): Float samples in [-1.0, 1.0], or an
+            iterable of such blocks
+        sample_rate (int): Sample rate in Hz
+        num_channels (int): Output channel count
+        chunk_frames (int): Frames encoded per write
+    """
+    import numpy as np
+
+    if isinstance(audio, np.ndarray):
+        blocks = (audio[i:i + chunk_frames] for i in range(0, len(audio), chunk_frames))
+    else:
+        blocks = audio
+
+    with wave.open(filepath, 'wb') as wav_file:
+        wav_file.setnchannels(num_channels)
+        wav_file.setsampwidth(3)  # 24-bit (3 bytes)
+        wav_file.setframerate(sample_rate)
+
+        for block in blocks:
+            wav_file.writeframesraw(encode_pcm24(block, num_channels))
+
+
+def iter_pcm24_wav(blocks, num_frames, sample_rate, num_channels=2):
+    """
+    Yield a complete 24-bit PCM WAV file as byte chunks
+
+    The header is emitted first using num_frames, so the body can be
+    streamed to a client before synthesis has finished.
+
+    Args:
+        blocks (iterable): Float sample blocks in [-1.0, 1.0]
+        num_frames (int): Total frames the blocks will produce
+        sample_rate (int): Sample rate in Hz
+        num_channels (int): Output channel count
+
+    Yields:
+        bytes: WAV header followed by encoded PCM chunks
+    """
+    yield wav_header(num_frames, sample_rate, num_channels, sample_width=3)
+    for block in blocks:
+        yield encode_pcm24(block, num_channels)
+
+
+def wav_header(num_frames, sample_rate, num_channels, sample_width):
+    """Build a canonical 44-byte RIFF/WAVE header for PCM data"""
+    block_align = num_channels * sample_width
+    data_size = num_frames * block_align
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + data_size, b'WAVE',
+        b'fmt ', 16, 1, num_channels, sample_rate,
+        sample_rate * block_align, block_align, sample_width * 8,
+        b'data', data_size
+    )
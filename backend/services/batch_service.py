@@ -0,0 +1,200 @@
+"""
+Batch Service
+Fans a list of generation specs out across the per-service job pools
+"""
+
+import itertools
+import math
+import os
+import time
+from concurrent.futures import as_completed
+from services.metrics_service import get_logger, log_event, metrics
+from services.ratelimit_service import priority
+
+logger = get_logger('batch')
+
+
+class BatchService:
+    def __init__(self, job_service, required, variant_types=(), native_variants=None,
+                 expand_all=None, max_items=None, max_variants=10):
+        """
+        Args:
+            job_service (JobService): Supplies the handlers and the bounded
+                per-type pools batch work runs on
+            required (dict): Job type -> name of its required param
+            variant_types (tuple): Job types whose handlers accept a 'variant' param
+            native_variants (dict): Job type -> (supports(params), handler(params, count))
+                for types that can produce several variants in one API call
+            expand_all (dict): (job type, param) -> callable returning the values
+                an "all" expansion stands for
+            max_items (int): Maximum results per batch after expansion
+            max_variants (int): Maximum variants per item
+        """
+        self.job_service = job_service
+        self.required = required
+        self.variant_types = variant_types
+        self.native_variants = native_variants or {}
+        self.expand_all = expand_all or {}
+        self.max_items = max_items or int(os.getenv('BATCH_MAX_ITEMS', 32))
+        self.max_variants = max_variants
+
+    def plan(self, items):
+        """
+        Validate batch items and expand them into tasks
+
+        Each item is {"type", "params", "variants"?, "expand"?}. "expand"
+        maps param names to lists of values (or "all" where supported); one
+        request is made per combination, each producing "variants" results.
+
+        Args:
+            items (list): Item specs from the request body
+
+        Returns:
+            list: Task dicts, each yielding one or more results when run
+
+        Raises:
+            ValueError: If an item is malformed or the batch is too large
+        """
+        if not isinstance(items, list) or not items:
+            raise ValueError('Items must be a non-empty list')
+
+        tasks = []
+        total = 0
+        for item_index, item in enumerate(items):
+            if not isinstance(item, dict):
+                raise ValueError(f"Item {item_index}: must be an object")
+
+            job_type = item.get('type')
+            if job_type not in self.required:
+                raise ValueError(f"Item {item_index}: type must be one of: {', '.join(self.required)}")
+
+            variants = item.get('variants', 1)
+            if not isinstance(variants, int) or not 1 <= variants <= self.max_variants:
+                raise ValueError(f"Item {item_index}: variants must be between 1 and {self.max_variants}")
+            if variants > 1 and job_type not in self.variant_types:
+                raise ValueError(f"Item {item_index}: {job_type} does not support variants")
+
+            base_params, names, choices = self._expansion(item_index, job_type, item)
+            # Counted before expanding, so an oversized batch allocates nothing
+            expands_to = total + math.prod(len(values) for values in choices) * variants
+            if expands_to > self.max_items:
+                raise ValueError(f"Batch expands to at least {expands_to} results; "
+                                 f"the maximum is {self.max_items}")
+
+            for combination in itertools.product(*choices):
+                expanded = dict(zip(names, combination))
+                params = dict(base_params, **expanded)
+                if not params.get(self.required[job_type]):
+                    raise ValueError(f"Item {item_index}: {self.required[job_type]} is required")
+
+                supports, _ = self.native_variants.get(job_type, (None, None))
+                if variants > 1 and supports and supports(params):
+                    # One API call returns every variant
+                    groups = [list(range(variants))]
+                else:
+                    groups = [[variant] for variant in range(variants)]
+
+                for group in groups:
+                    tasks.append({
+                        'item': item_index,
+                        'type': job_type,
+                        'params': params,
+                        'expanded': expanded,
+                        'variants': group,
+                        'first_index': total
+                    })
+                    total += len(group)
+        return tasks
+
+    def run(self, tasks):
+        """
+        Run planned tasks concurrently, yielding results as each finishes
+
+        Tasks go to their job type's pool, so each service's concurrency
+        limit holds across batches and background jobs. A failed task is
+        reported per result and does not stop the rest of the batch.
+
+        Yields:
+            tuple: ('item', result event) per result, then ('done', summary)
+        """
+        start = time.perf_counter()
+        futures = {
+            self.job_service.execute(task['type'], self._call, task): task
+            for task in tasks
+        }
+        counts = {'completed': 0, 'failed': 0}
+
+        try:
+            for future in as_completed(futures):
+                task = futures[future]
+                try:
+                    results, error = future.result(), None
+                except Exception as e:
+                    results, error = [None] * len(task['variants']), str(e)
+                    log_event(logger, 'batch.item_failed', item=task['item'], type=task['type'], error=error)
+
+                for offset, (variant, result) in enumerate(zip(task['variants'], results)):
+                    status = 'failed' if error else 'completed'
+                    counts[status] += 1
+                    metrics.count('arcitek_batch_results_total', help='Batch results by outcome',
+                                  type=task['type'], status=status)
+                    event = {
+                        'index': task['first_index'] + offset,
+                        'item': task['item'],
+                        'type': task['type'],
+                        'variant': variant,
+                        'params': task['expanded'],
+                        'status': status
+                    }
+                    if error:
+                        event['error'] = error
+                    else:
+                        # Internal paths stay on the server; clients fetch via 'url'
+                        event['result'] = {k: v for k, v in result.items() if k != 'filepath'}
+                    yield 'item', event
+        finally:
+            # Client gone or batch finished: drop anything not yet started
+            for future in futures:
+                future.cancel()
+
+        elapsed = time.perf_counter() - start
+        log_event(logger, 'batch.completed', tasks=len(tasks), seconds=round(elapsed, 3), **counts)
+        yield 'done', dict(counts, total=sum(counts.values()), seconds=round(elapsed, 3))
+
+    def _call(self, task):
+        """Run one task and return its results in variant order"""
+        params = task['params']
+        variants = task['variants']
+        with priority('batch'):
+            if len(variants) > 1:
+                _, handler = self.native_variants[task['type']]
+                return handler(params, len(variants))
+            if task['type'] in self.variant_types:
+                params = dict(params, variant=variants[0])
+            return [self.job_service.handlers[task['type']](params)]
+
+    def _expansion(self, item_index, job_type, item):
+        """
+        Validate an item's params and expand lists
+
+        Returns:
+            tuple: (params, expanded param names, list of value lists), one
+                request per combination of the value lists
+        """
+        params = item.get('params') or {}
+        expand = item.get('expand') or {}
+        if not isinstance(params, dict) or not isinstance(expand, dict):
+            raise ValueError(f"Item {item_index}: params and expand must be objects")
+
+        names = list(expand)
+        choices = []
+        for name in names:
+            values = expand[name]
+            if values == 'all':
+                if (job_type, name) not in self.expand_all:
+                    raise ValueError(f"Item {item_index}: {name} cannot be expanded to all")
+                values = list(self.expand_all[(job_type, name)]())
+            if not isinstance(values, list) or not values:
+                raise ValueError(f"Item {item_index}: expand.{name} must be a non-empty list or \"all\"")
+            choices.append(values)
+        return params, names, choices
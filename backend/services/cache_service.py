@@ -0,0 +1,208 @@
+"""
+Result Cache Service
+Content-addressed outputs and the request -> result index
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from services.metrics_service import get_logger
+from services.storage_service import OUTPUT_ROOT, JsonIndex, get_storage, shard_path
+
+logger = get_logger('cache')
+
+# Names produced by content_address, e.g. image_<32 hex>.webp
+CONTENT_ADDRESSED_NAME = re.compile(r'^[a-z]+(?:_demo)?_([0-9a-f]{32})\.[a-z0-9]+$')
+
+
+class ResultCache:
+    """
+    Maps generation requests to the outputs they produced
+
+    Files are owned by the StorageManager, which enforces quotas and TTLs;
+    entries whose file it removed are dropped on the next lookup.
+    """
+
+    def __init__(self, root=OUTPUT_ROOT):
+        """
+        Args:
+            root (str): Outputs directory; file paths in the index are relative to it
+        """
+        self.root = os.path.abspath(root)
+        self.index = JsonIndex(os.path.join(self.root, 'cache_index.json'))
+        self.lock = threading.Lock()
+        self.entries = self.index.read()
+        # Keys updated or deleted here since the index was last written
+        self.changed = set()
+        self.removed = set()
+
+    @staticmethod
+    def key(service, **params):
+        """
+        Hash a normalized generation request
+
+        Strings are stripped and have internal whitespace collapsed, so
+        trivially different prompts share an entry.
+
+        Args:
+            service (str): Service name, e.g. 'image'
+            **params: Everything that affects the output (model, prompt, ...)
+
+        Returns:
+            str: Hex SHA-256 of the request
+        """
+        normalized = {
+            name: ' '.join(value.split()) if isinstance(value, str) else value
+            for name, value in params.items()
+        }
+        payload = json.dumps([service, normalized], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Look up a cached result
+
+        Returns:
+            dict: The stored result with 'filepath' restored, or None on a miss
+        """
+        with self.lock:
+            entry = self.entries.get(key) or self._refresh().get(key)
+            if not entry:
+                return None
+
+            filepath = os.path.join(self.root, entry['path'])
+            if not os.path.exists(filepath):
+                # Removed outside the cache; forget it
+                del self.entries[key]
+                self.removed.add(key)
+                self._save()
+                return None
+
+            entry['last_access'] = time.time()
+            self.changed.add(key)
+        get_storage().touch(filepath)
+        return dict(entry['result'], filepath=filepath)
+
+    def put(self, key, result):
+        """
+        Record a generated result
+
+        Args:
+            key (str): Request key from ResultCache.key
+            result (dict): Service result; result['filepath'] must be under root
+        """
+        filepath = os.path.abspath(result['filepath'])
+        entry = {
+            'path': os.path.relpath(filepath, self.root),
+            'size': os.path.getsize(filepath),
+            'created_at': time.time(),
+            'last_access': time.time(),
+            'result': {k: v for k, v in result.items() if k != 'filepath'}
+        }
+
+        with self.lock:
+            self.entries[key] = entry
+            self.changed.add(key)
+            self.removed.discard(key)
+            self._save()
+
+    def total_bytes(self):
+        with self.lock:
+            return sum(entry['size'] for entry in self.entries.values())
+
+    def forget(self, paths):
+        """Drop entries whose file was removed by the storage sweeper"""
+        removed = set(paths)
+        with self.lock:
+            stale = [key for key, entry in self.entries.items() if entry['path'] in removed]
+            for key in stale:
+                del self.entries[key]
+                self.removed.add(key)
+            if stale:
+                self._save()
+
+    def _refresh(self):
+        """
+        Take in entries other worker processes saved since our last read
+        (lock held)
+
+        Returns:
+            dict: The updated entries
+        """
+        if self.index.stale():
+            self.entries = self.index.merge(self.entries, self.changed, self.removed)
+        return self.entries
+
+    def _save(self):
+        """Merge this process's changes into the shared index (lock held)"""
+        with self.index.locked():
+            self.entries = self.index.merge(self.entries, self.changed, self.removed)
+            self.index.write(self.entries)
+        self.changed.clear()
+        self.removed.clear()
+
+
+def temp_output_path(directory, extension):
+    """Return a unique scratch path in directory for an output being written"""
+    return os.path.join(directory, f".tmp_{uuid.uuid4().hex}{extension}")
+
+
+def content_address(filepath, prefix):
+    """
+    Move a finished output to a name derived from its SHA-256
+
+    The file lands in its shard of the same directory and is registered
+    with the StorageManager.
+
+    Args:
+        filepath (str): File to rename, usually from temp_output_path
+        prefix (str): Filename prefix, e.g. 'image'
+
+    Returns:
+        tuple: (filename, filepath) after the move
+    """
+    extension = os.path.splitext(filepath)[1]
+    filename = f"{prefix}_{file_digest(filepath)[:32]}{extension}"
+    final_path = shard_path(os.path.dirname(filepath), filename)
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    os.replace(filepath, final_path)
+    get_storage().register(final_path)
+    return filename, final_path
+
+
+def file_digest(filepath):
+    """Return the hex SHA-256 of a file, read in 1 MB blocks"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def content_hash_from_name(filename):
+    """
+    Return the content hash embedded in a content-addressed filename
+
+    Returns:
+        str: The 32-hex-digit hash, or None if the name is not content-addressed
+    """
+    match = CONTENT_ADDRESSED_NAME.match(os.path.basename(filename))
+    return match.group(1) if match else None
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide ResultCache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+            get_storage().listeners.append(_cache.forget)
+        return _cache
@@ -0,0 +1,304 @@
+"""
+Catalog Service
+Indexed record of every generated artifact, with full-text search over stories
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from services.storage_service import OUTPUT_ROOT, get_storage
+from services.metrics_service import get_logger, log_event, metrics
+
+logger = get_logger('catalog')
+
+CATALOG_PATH = os.path.join(OUTPUT_ROOT, 'catalog.db')
+
+# Artifact kind -> outputs category its files live in
+KINDS = {
+    'music': 'music',
+    'image': 'images',
+    'story': 'stories',
+    'narration': 'stories'
+}
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    id INTEGER PRIMARY KEY,
+    request_key TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    url TEXT NOT NULL,
+    path TEXT NOT NULL,
+    prompt TEXT,
+    title TEXT,
+    params TEXT NOT NULL,
+    word_count INTEGER,
+    resolution TEXT,
+    duration REAL,
+    format TEXT,
+    bytes INTEGER,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS artifacts_kind ON artifacts (kind, id);
+CREATE INDEX IF NOT EXISTS artifacts_path ON artifacts (path);
+"""
+
+# Searchable text, one row per artifact (rowid = artifacts.id)
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS artifacts_text
+USING fts5(title, prompt, body, tokenize = 'porter unicode61')
+"""
+
+# Columns returned for each artifact
+COLUMNS = ('id', 'kind', 'filename', 'url', 'prompt', 'title', 'params', 'word_count',
+           'resolution', 'duration', 'format', 'bytes', 'created_at')
+
+
+class Catalog:
+    """
+    SQLite catalog of generated outputs
+
+    Services record each result as it is written, keyed by its request so
+    regenerating a request updates its row. Listing is an index scan and
+    search is an FTS5 query over titles, prompts and story text, so neither
+    touches the outputs directories. The database runs in WAL mode, so
+    worker processes can write while others read.
+    """
+
+    def __init__(self, path=None, root=OUTPUT_ROOT):
+        """
+        Args:
+            path (str): Database file (default CATALOG_PATH)
+            root (str): Outputs directory that recorded paths are relative to
+        """
+        self.path = path or os.getenv('CATALOG_PATH', CATALOG_PATH)
+        self.root = os.path.abspath(root)
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        conn = self._conn()
+        with conn:
+            conn.executescript(SCHEMA)
+            try:
+                conn.execute(FTS_SCHEMA)
+                self.fts = True
+            except sqlite3.OperationalError:
+                # SQLite built without FTS5: search falls back to LIKE
+                self.fts = False
+                log_event(logger, 'catalog.no_fts5')
+
+    def record(self, kind, request_key, result, prompt=None, params=None, body=None):
+        """
+        Add or update the entry for a generated artifact
+
+        Failures are logged and swallowed; the catalog never fails a request.
+
+        Args:
+            kind (str): Artifact kind, a key of KINDS
+            request_key (str): Cache key of the request that produced it
+            result (dict): Service result; needs 'filename' and 'filepath'
+            prompt (str): The user's prompt
+            params (dict): Other request parameters (genre, style, ...)
+            body (str): Additional searchable text, e.g. story content
+        """
+        start = time.perf_counter()
+        row = {
+            'request_key': request_key,
+            'kind': kind,
+            'filename': result['filename'],
+            'url': result.get('url') or f"/api/outputs/{KINDS[kind]}/{result['filename']}",
+            'path': os.path.relpath(os.path.abspath(result['filepath']), self.root),
+            'prompt': prompt,
+            'title': result.get('title'),
+            'params': json.dumps(params or {}, sort_keys=True),
+            'word_count': result.get('word_count'),
+            'resolution': result.get('resolution'),
+            'duration': result.get('duration'),
+            'format': result.get('format'),
+            'bytes': result.get('bytes') or _size(result['filepath']),
+            'created_at': time.time()
+        }
+        names = ', '.join(row)
+        updates = ', '.join(f"{name} = excluded.{name}" for name in row
+                            if name not in ('request_key', 'created_at'))
+        try:
+            conn = self._conn()
+            with conn:
+                artifact_id = conn.execute(
+                    f"INSERT INTO artifacts ({names}) VALUES ({', '.join('?' * len(row))}) "
+                    f"ON CONFLICT (request_key) DO UPDATE SET {updates} RETURNING id",
+                    tuple(row.values())
+                ).fetchone()[0]
+                if self.fts:
+                    conn.execute("DELETE FROM artifacts_text WHERE rowid = ?", (artifact_id,))
+                    conn.execute("INSERT INTO artifacts_text (rowid, title, prompt, body) VALUES (?, ?, ?, ?)",
+                                 (artifact_id, row['title'] or '', prompt or '', body or ''))
+        except sqlite3.Error as e:
+            log_event(logger, 'catalog.write_failed', kind=kind, filename=row['filename'], error=str(e))
+            return
+        metrics.observe('arcitek_catalog_write_seconds', time.perf_counter() - start,
+                        help='Time to record an artifact in the catalog', kind=kind)
+
+    def list(self, kind=None, page=1, per_page=DEFAULT_PAGE_SIZE):
+        """
+        List artifacts, newest first
+
+        Args:
+            kind (str): Only artifacts of this kind
+            page (int): 1-based page number
+            per_page (int): Items per page, at most MAX_PAGE_SIZE
+
+        Returns:
+            dict: 'items', 'page', 'per_page' and 'total'
+        """
+        page, per_page = _page(page, per_page)
+        where, args = _kind_filter(kind)
+        conn = self._conn()
+        total = conn.execute(f"SELECT COUNT(*) FROM artifacts {where}", args).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM artifacts {where} ORDER BY id DESC LIMIT ? OFFSET ?",
+            args + (per_page, (page - 1) * per_page)
+        ).fetchall()
+        return {'items': [_item(row) for row in rows], 'page': page, 'per_page': per_page, 'total': total}
+
+    def search(self, query, kind=None, page=1, per_page=DEFAULT_PAGE_SIZE):
+        """
+        Full-text search over titles, prompts and story text, best match first
+
+        Every word of the query must match; the last may be a prefix.
+
+        Args:
+            query (str): Words to search for
+            kind (str): Only artifacts of this kind
+            page (int): 1-based page number
+            per_page (int): Items per page, at most MAX_PAGE_SIZE
+
+        Returns:
+            dict: 'items' (each with a 'snippet'), 'page', 'per_page' and 'total'
+        """
+        page, per_page = _page(page, per_page)
+        words = re.findall(r'\w+', query or '')
+        if not words:
+            raise ValueError('Search query must contain at least one word')
+        where, args = _kind_filter(kind, prefix='AND a.')
+        conn = self._conn()
+        columns = ', '.join(f"a.{column}" for column in COLUMNS)
+
+        if self.fts:
+            # Quoted terms keep FTS5 query syntax in user input literal
+            match = ' '.join(f'"{word}"' for word in words) + '*'
+            # CROSS JOIN keeps the full-text match as the outer loop; otherwise
+            # a kind filter can make SQLite re-run the match once per artifact
+            total = conn.execute(
+                f"SELECT COUNT(*) FROM artifacts_text t CROSS JOIN artifacts a ON a.id = t.rowid "
+                f"WHERE artifacts_text MATCH ? {where}", (match,) + args
+            ).fetchone()[0]
+            rows = conn.execute(
+                f"SELECT {columns} FROM artifacts_text t CROSS JOIN artifacts a ON a.id = t.rowid "
+                f"WHERE artifacts_text MATCH ? {where} ORDER BY bm25(artifacts_text, 10.0, 5.0, 1.0) "
+                f"LIMIT ? OFFSET ?", (match,) + args + (per_page, (page - 1) * per_page)
+            ).fetchall()
+            # Snippets only for the page being returned
+            snippets = dict(conn.execute(
+                f"SELECT rowid, snippet(artifacts_text, -1, '[', ']', '...', 16) FROM artifacts_text "
+                f"WHERE artifacts_text MATCH ? AND rowid IN ({', '.join('?' * len(rows))})",
+                (match,) + tuple(row[0] for row in rows)
+            )) if rows else {}
+            rows = [row + (snippets.get(row[0]),) for row in rows]
+        else:
+            conditions = ' AND '.join("(a.title LIKE ? OR a.prompt LIKE ?)" for _ in words)
+            patterns = tuple(pattern for word in words for pattern in (f'%{word}%',) * 2)
+            total = conn.execute(f"SELECT COUNT(*) FROM artifacts a WHERE {conditions} {where}",
+                                 patterns + args).fetchone()[0]
+            rows = conn.execute(
+                f"SELECT {columns}, NULL FROM artifacts a WHERE {conditions} {where} "
+                f"ORDER BY a.id DESC LIMIT ? OFFSET ?", patterns + args + (per_page, (page - 1) * per_page)
+            ).fetchall()
+
+        items = []
+        for row in rows:
+            item = _item(row[:-1])
+            item['snippet'] = row[-1]
+            items.append(item)
+        return {'items': items, 'page': page, 'per_page': per_page, 'total': total}
+
+    def forget(self, paths):
+        """Drop entries whose file was removed by the storage sweeper"""
+        paths = list(paths)
+        try:
+            conn = self._conn()
+            with conn:
+                for start in range(0, len(paths), 500):
+                    batch = paths[start:start + 500]
+                    marks = ', '.join('?' * len(batch))
+                    ids = [row[0] for row in conn.execute(
+                        f"SELECT id FROM artifacts WHERE path IN ({marks})", batch)]
+                    if not ids:
+                        continue
+                    id_marks = ', '.join('?' * len(ids))
+                    conn.execute(f"DELETE FROM artifacts WHERE id IN ({id_marks})", ids)
+                    if self.fts:
+                        conn.execute(f"DELETE FROM artifacts_text WHERE rowid IN ({id_marks})", ids)
+        except sqlite3.Error as e:
+            log_event(logger, 'catalog.forget_failed', error=str(e))
+
+    def _conn(self):
+        """This thread's connection, opened on first use"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self.local.conn = conn
+        return conn
+
+
+def _kind_filter(kind, prefix='WHERE '):
+    if kind is None:
+        return '', ()
+    if kind not in KINDS:
+        raise ValueError(f"Kind must be one of: {', '.join(KINDS)}")
+    return f"{prefix}kind = ?", (kind,)
+
+
+def _page(page, per_page):
+    try:
+        page, per_page = int(page), int(per_page)
+    except (TypeError, ValueError):
+        raise ValueError('page and per_page must be integers')
+    if page < 1 or not 1 <= per_page <= MAX_PAGE_SIZE:
+        raise ValueError(f"page must be at least 1 and per_page between 1 and {MAX_PAGE_SIZE}")
+    return page, per_page
+
+
+def _item(row):
+    item = dict(zip(COLUMNS, row))
+    item['params'] = json.loads(item['params'])
+    return item
+
+
+def _size(filepath):
+    try:
+        return os.path.getsize(filepath)
+    except OSError:
+        return None
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """Return the process-wide Catalog"""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = Catalog()
+            get_storage().listeners.append(_catalog.forget)
+        return _catalog
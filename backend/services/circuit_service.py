@@ -0,0 +1,337 @@
+"""
+Circuit Service
+Per-model circuit breakers that fail fast while an upstream model is degraded
+"""
+
+import collections
+import itertools
+import os
+import re
+import threading
+import time
+from services.metrics_service import get_logger, log_event, metrics
+
+logger = get_logger('circuit')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Calls slower than this count against a model like errors do. Overridden
+# by CIRCUIT_<MODEL>_SLOW_SECONDS, then CIRCUIT_SLOW_CALL_SECONDS for models
+# not listed here.
+DEFAULT_SLOW_CALL_SECONDS = {
+    'gpt-4.1-mini': 60,
+    'dall-e-3': 90,
+    'tts-1-hd': 30
+}
+
+# Seconds added to the slow-call limit per completion token a call waits
+# for (max_tokens x n), so long completions are not taken for a slow model.
+# Overridden by CIRCUIT_SECONDS_PER_TOKEN.
+DEFAULT_SECONDS_PER_TOKEN = 0.03
+
+# Per-call timeout passed to the API, as a multiple of the slow-call limit
+CALL_TIMEOUT_MULTIPLE = 2
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a model whose circuit is open"""
+
+    def __init__(self, model, retry_after):
+        super().__init__(f"{model} is unavailable; retry in {retry_after:.0f}s")
+        self.model = model
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Tracks one model's recent outcomes and stops calls while it is failing
+
+    Closed, calls go through and their outcomes are kept for window seconds.
+    Once at least min_calls have been seen and the share that failed (5xx,
+    timeouts, connection errors) or ran past their slow-call limit reaches
+    failure_rate, the circuit opens: calls raise CircuitOpenError at once
+    for open_seconds. A call's limit is slow_seconds plus seconds_per_token
+    for each completion token it waits for. Calls still outstanding past
+    their limit count as bad too, so a hanging model trips the circuit
+    while its calls wait. It then turns half-open and lets up to
+    half_open_calls probes through; if they all succeed it closes, and any
+    bad probe opens it again. Client errors (4xx, including 429) say
+    nothing about the model's health and are not counted.
+    """
+
+    def __init__(self, model, failure_rate=None, min_calls=None, window=None,
+                 slow_seconds=None, seconds_per_token=None, open_seconds=None,
+                 half_open_calls=None):
+        """
+        Args:
+            model (str): Model name, e.g. 'dall-e-3'
+            failure_rate (float): Share of bad calls that opens the circuit
+                (CIRCUIT_FAILURE_RATE)
+            min_calls (int): Calls in the window before the rate is trusted
+                (CIRCUIT_MIN_CALLS)
+            window (float): Seconds of outcomes considered (CIRCUIT_WINDOW)
+            slow_seconds (float): Calls taking longer count as bad; defaults to
+                DEFAULT_SLOW_CALL_SECONDS with CIRCUIT_<MODEL>_SLOW_SECONDS override
+            seconds_per_token (float): Added to slow_seconds per completion
+                token awaited (CIRCUIT_SECONDS_PER_TOKEN)
+            open_seconds (float): Seconds to fail fast before probing
+                (CIRCUIT_OPEN_SECONDS)
+            half_open_calls (int): Probes that must succeed to close again
+                (CIRCUIT_HALF_OPEN_CALLS)
+        """
+        self.model = model
+        self.failure_rate = failure_rate or float(os.getenv('CIRCUIT_FAILURE_RATE', 0.5))
+        self.min_calls = min_calls or int(os.getenv('CIRCUIT_MIN_CALLS', 5))
+        self.window = window or float(os.getenv('CIRCUIT_WINDOW', 60))
+        self.slow_seconds = slow_seconds or _env_slow_seconds(model)
+        if seconds_per_token is None:
+            seconds_per_token = float(os.getenv('CIRCUIT_SECONDS_PER_TOKEN', DEFAULT_SECONDS_PER_TOKEN))
+        self.seconds_per_token = seconds_per_token
+        self.open_seconds = open_seconds or float(os.getenv('CIRCUIT_OPEN_SECONDS', 30))
+        self.half_open_calls = half_open_calls or int(os.getenv('CIRCUIT_HALF_OPEN_CALLS', 2))
+
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.outcomes = collections.deque()  # (time, bad)
+        self.outstanding = {}  # ticket -> (start time, slow limit) of calls not finished
+        self.tickets = itertools.count()
+        self.probes = 0
+        self.probe_successes = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        """
+        Admit one call, or refuse it without touching the API
+
+        Every admitted call must be followed by start() and success() or
+        failure(), or by release() if it is never sent.
+
+        Raises:
+            CircuitOpenError: If the circuit is open, or half-open with all
+                probes already in flight
+        """
+        now = time.monotonic()
+        with self.lock:
+            if self.state == CLOSED and self._overdue(now):
+                self._trim(now)
+                if self._tripped(now):
+                    self._open(now)
+            if self.state == OPEN:
+                remaining = self.opened_at + self.open_seconds - now
+                if remaining > 0:
+                    self._reject(remaining)
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self.probes >= self.half_open_calls:
+                    self._reject(1.0)
+                self.probes += 1
+
+    def start(self, completion_tokens=0):
+        """
+        Note that an admitted call is being sent
+
+        Args:
+            completion_tokens (int): Tokens the call waits for before it
+                returns, which extend its slow-call limit
+
+        Returns:
+            int: Ticket for success(), failure() or release()
+        """
+        limit = self.slow_limit(completion_tokens)
+        with self.lock:
+            ticket = next(self.tickets)
+            self.outstanding[ticket] = (time.monotonic(), limit)
+            return ticket
+
+    def success(self, ticket):
+        """Record a started call that returned"""
+        seconds, limit = self._finish(ticket)
+        if seconds > limit:
+            log_event(logger, 'circuit.slow_call', model=self.model, seconds=round(seconds, 3),
+                      limit=round(limit, 3))
+            self._record(True)
+        else:
+            self._record(False)
+
+    def failure(self, ticket, error):
+        """Record a started call that raised error"""
+        self._finish(ticket)
+        self._record(True if is_upstream_failure(error) else None)
+
+    def release(self, ticket=None):
+        """Give back an admission whose call was never sent or was cancelled"""
+        if ticket is not None:
+            self._finish(ticket)
+        self._record(None)
+
+    def slow_limit(self, completion_tokens=0):
+        """Seconds after which a call awaiting completion_tokens is slow"""
+        return self.slow_seconds + completion_tokens * self.seconds_per_token
+
+    def call_timeout(self, completion_tokens=0):
+        """Seconds to allow an API request before giving up on it"""
+        return self.slow_limit(completion_tokens) * CALL_TIMEOUT_MULTIPLE
+
+    def stats(self):
+        """
+        Returns:
+            dict: State, recent call counts and failure rate, and seconds
+                until the next probe while open
+        """
+        now = time.monotonic()
+        with self.lock:
+            self._trim(now)
+            calls = len(self.outcomes)
+            bad = sum(outcome for _, outcome in self.outcomes)
+            retry_in = 0.0
+            if self.state == OPEN:
+                retry_in = max(0.0, self.opened_at + self.open_seconds - now)
+            overdue = self._overdue(now)
+            return {
+                # Past its cooldown, an open circuit lets the next call probe
+                'state': HALF_OPEN if self.state == OPEN and not retry_in else self.state,
+                'calls': calls,
+                'failures': bad,
+                'failure_rate': round(bad / calls, 3) if calls else 0.0,
+                'retry_in': round(retry_in, 3),
+                'rejected': self.rejected,
+                'outstanding': len(self.outstanding),
+                'overdue': overdue
+            }
+
+    def _record(self, bad):
+        # bad is None for calls that say nothing about the model's health
+        now = time.monotonic()
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.probes = max(0, self.probes - 1)
+                if bad:
+                    self._open(now)
+                elif bad is not None:
+                    self.probe_successes += 1
+                    if self.probe_successes >= self.half_open_calls:
+                        self._transition(CLOSED)
+                return
+            if bad is None or self.state == OPEN:
+                return
+
+            self.outcomes.append((now, bad))
+            self._trim(now)
+            if bad and self._tripped(now):
+                self._open(now)
+
+    def _tripped(self, now):
+        """Whether recent and overdue calls reach the failure rate (lock held)"""
+        overdue = self._overdue(now)
+        calls = len(self.outcomes) + overdue
+        bad = sum(outcome for _, outcome in self.outcomes) + overdue
+        return calls >= self.min_calls and bad / calls >= self.failure_rate
+
+    def _overdue(self, now):
+        """Calls outstanding past their slow-call limit (lock held)"""
+        return sum(1 for started, limit in self.outstanding.values() if now - started > limit)
+
+    def _finish(self, ticket):
+        """
+        Stop tracking a started call
+
+        Returns:
+            tuple: (seconds it took, its slow-call limit)
+        """
+        with self.lock:
+            started, limit = self.outstanding.pop(ticket)
+        return time.monotonic() - started, limit
+
+    def _open(self, now):
+        self.opened_at = now
+        self._transition(OPEN)
+
+    def _transition(self, state):
+        previous, self.state = self.state, state
+        self.probes = 0
+        self.probe_successes = 0
+        if state == CLOSED:
+            self.outcomes.clear()
+        log_event(logger, 'circuit.state', model=self.model, previous=previous, state=state)
+        metrics.count('arcitek_circuit_transitions_total', help='Circuit breaker state changes',
+                      model=self.model, state=state)
+
+    def _reject(self, retry_after):
+        self.rejected += 1
+        metrics.count('arcitek_circuit_rejected_total', help='Calls refused by an open circuit',
+                      model=self.model)
+        raise CircuitOpenError(self.model, retry_after)
+
+    def _trim(self, now):
+        while self.outcomes and self.outcomes[0][0] < now - self.window:
+            self.outcomes.popleft()
+
+
+class CircuitBreakers:
+    """One CircuitBreaker per model, created on first use"""
+
+    def __init__(self, **options):
+        """
+        Args:
+            **options: Passed to every CircuitBreaker
+        """
+        self.options = options
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def get(self, model):
+        with self.lock:
+            breaker = self.breakers.get(model)
+            if breaker is None:
+                breaker = self.breakers[model] = CircuitBreaker(model, **self.options)
+            return breaker
+
+    def stats(self):
+        """
+        Returns:
+            dict: Model -> CircuitBreaker.stats()
+        """
+        with self.lock:
+            breakers = list(self.breakers.values())
+        return {breaker.model: breaker.stats() for breaker in breakers}
+
+
+def is_upstream_failure(error):
+    """
+    Whether error means the model is unhealthy rather than the request bad
+
+    Server errors, timeouts and connection failures count; client errors,
+    including 429s (left to the rate limiter), do not.
+    """
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status >= 500 or status == 408
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    try:
+        from openai import APIConnectionError  # Also covers APITimeoutError
+    except ImportError:
+        return False
+    return isinstance(error, APIConnectionError)
+
+
+def _env_slow_seconds(model):
+    name = re.sub(r'[^A-Z0-9]+', '_', (model or '').upper())
+    default = DEFAULT_SLOW_CALL_SECONDS.get(model, os.getenv('CIRCUIT_SLOW_CALL_SECONDS', 60))
+    return float(os.getenv(f'CIRCUIT_{name}_SLOW_SECONDS', default))
+
+
+_breakers = None
+_breakers_lock = threading.Lock()
+
+
+def get_breakers():
+    """Return the process-wide CircuitBreakers"""
+    global _breakers
+    with _breakers_lock:
+        if _breakers is None:
+            _breakers = CircuitBreakers()
+        return _breakers
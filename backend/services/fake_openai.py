@@ -0,0 +1,228 @@
+"""
+Fake OpenAI Client
+Offline stand-in for the OpenAI SDK, used for local development and testing
+"""
+
+import asyncio
+import base64
+import io
+import json
+import os
+import random
+import re
+import time
+from types import SimpleNamespace
+
+
+class FakeAPIError(Exception):
+    """Simulated upstream failure, carrying an HTTP status like the real SDK errors"""
+
+    def __init__(self, status_code):
+        super().__init__(f"Fake OpenAI error {status_code}")
+        self.status_code = status_code
+
+
+class FakeOpenAI:
+    """
+    Mimics the subset of the OpenAI client used by the services
+
+    Enable with OPENAI_FAKE=1. Behaviour is configured with arguments or
+    the matching environment variables:
+
+        latency      FAKE_OPENAI_LATENCY       seconds per API call
+        jitter       FAKE_OPENAI_JITTER        extra random seconds, 0..jitter
+        error_rate   FAKE_OPENAI_ERROR_RATE    fraction of calls raising 429/500
+        image_path   FAKE_OPENAI_IMAGE         PNG returned by images.generate
+        text_path    FAKE_OPENAI_TEXT          prose used for completions
+        audio_path   FAKE_OPENAI_AUDIO         MP3 returned by audio.speech
+    """
+
+    def __init__(self, latency=None, jitter=None, error_rate=None,
+                 image_path=None, text_path=None, audio_path=None, seed=None):
+        self.latency = float(os.getenv('FAKE_OPENAI_LATENCY', 0)) if latency is None else latency
+        self.jitter = float(os.getenv('FAKE_OPENAI_JITTER', 0)) if jitter is None else jitter
+        self.error_rate = float(os.getenv('FAKE_OPENAI_ERROR_RATE', 0)) if error_rate is None else error_rate
+        self.random = random.Random(seed)
+
+        image_path = image_path or os.getenv('FAKE_OPENAI_IMAGE')
+        text_path = text_path or os.getenv('FAKE_OPENAI_TEXT')
+        audio_path = audio_path or os.getenv('FAKE_OPENAI_AUDIO')
+        self.image_bytes = _read(image_path, 'rb')
+        self.text = _read(text_path, 'r')
+        self.audio_bytes = _read(audio_path, 'rb')
+
+        self.images = SimpleNamespace(generate=self._generate_image)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_completion))
+        self.audio = SimpleNamespace(speech=SimpleNamespace(create=self._create_speech))
+
+    def _wait(self):
+        delay = self._delay()
+        if delay:
+            time.sleep(delay)
+        self._maybe_fail()
+
+    def _delay(self):
+        return self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+
+    def _maybe_fail(self):
+        if self.error_rate and self.random.random() < self.error_rate:
+            raise FakeAPIError(self.random.choice((429, 500)))
+
+    def _generate_image(self, model, prompt, size='1024x1024', quality='standard', n=1, **kwargs):
+        from PIL import Image
+
+        self._wait()
+        width, height = (int(x) for x in size.split('x'))
+
+        data = []
+        for i in range(n):
+            if self.image_bytes:
+                data.append(SimpleNamespace(
+                    url=None,
+                    b64_json=base64.b64encode(self.image_bytes).decode('ascii'),
+                    revised_prompt=prompt
+                ))
+                continue
+            img = Image.new('RGB', (width, height), color=(40 + 20 * i, 80, 160))
+            buffer = io.BytesIO()
+            img.save(buffer, 'PNG')
+            data.append(SimpleNamespace(
+                url=None,
+                b64_json=base64.b64encode(buffer.getvalue()).decode('ascii'),
+                revised_prompt=prompt
+            ))
+
+        return SimpleNamespace(created=int(time.time()), data=data)
+
+    def _create_completion(self, model, messages, max_tokens=1000, stream=False, n=1, **kwargs):
+        self._wait()
+        prompt = messages[-1]['content']
+        words = max(1, max_tokens // 2)
+        if self.text:
+            # Repeat the canned prose up to the requested length
+            source = self.text.split()
+            body = ' '.join(source[i % len(source)] for i in range(words))
+        else:
+            body = ' '.join(['Lorem'] + ['ipsum'] * (words - 1))
+        # Follow the requested reply format: titled story, bare text or JSON outline
+        if 'TITLE:' in prompt:
+            content = f"TITLE: Fake Story\n\n{body}"
+        else:
+            content = body
+        if (kwargs.get('response_format') or {}).get('type') == 'json_object':
+            match = re.search(r'exactly (\d+) chapters', prompt)
+            chapters = [
+                {'title': f"Fake Chapter {i + 1}", 'summary': f"Events of chapter {i + 1}."}
+                for i in range(int(match.group(1)) if match else 3)
+            ]
+            content = json.dumps({'title': 'Fake Story', 'chapters': chapters})
+
+        if stream:
+            return self._stream_completion(model, content)
+
+        # Number the variants so each choice has distinct content
+        contents = [content] if n == 1 else [
+            content.replace('Fake Story', f"Fake Story {i + 1}", 1) if 'Fake Story' in content
+            else f"{content} ({i + 1})"
+            for i in range(n)
+        ]
+        return SimpleNamespace(
+            model=model,
+            choices=[
+                SimpleNamespace(
+                    index=i,
+                    finish_reason='stop',
+                    message=SimpleNamespace(role='assistant', content=text)
+                )
+                for i, text in enumerate(contents)
+            ],
+            usage=SimpleNamespace(
+                prompt_tokens=len(prompt.split()),
+                completion_tokens=words * 2 * n,
+                total_tokens=len(prompt.split()) + words * 2 * n
+            )
+        )
+
+    def _stream_completion(self, model, content, chunk_chars=12):
+        for start in range(0, len(content), chunk_chars):
+            yield SimpleNamespace(
+                model=model,
+                choices=[SimpleNamespace(
+                    index=0,
+                    finish_reason=None,
+                    delta=SimpleNamespace(role='assistant', content=content[start:start + chunk_chars])
+                )]
+            )
+        yield SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(index=0, finish_reason='stop', delta=SimpleNamespace(content=None))]
+        )
+
+    def _create_speech(self, model, voice, input, speed=1.0, **kwargs):
+        self._wait()
+        if self.audio_bytes:
+            return FakeSpeechResponse(self.audio_bytes)
+        # Silent MPEG-1 Layer III frames (128 kbps, 44.1 kHz), one per
+        # ~15 characters of input so output size tracks input length,
+        # after an Info frame as real encoders write
+        frame = b'\xff\xfb\x90\x64' + b'\x00' * 413
+        info = b'\xff\xfb\x90\x64' + b'\x00' * 32 + b'Info' + b'\x00' * 377
+        return FakeSpeechResponse(info + frame * max(1, len(input) // 15))
+
+
+class AsyncFakeOpenAI(FakeOpenAI):
+    """
+    Mimics the subset of AsyncOpenAI used by the services
+
+    Takes the same options as FakeOpenAI. Latency is awaited rather than
+    slept, so many calls can be in flight on one event loop.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.images = SimpleNamespace(generate=self._async(self._generate_image))
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._async(self._create_completion)))
+        self.audio = SimpleNamespace(speech=SimpleNamespace(create=self._async(self._create_speech)))
+
+    def _wait(self):
+        # The delay was already awaited by the wrapper
+        self._maybe_fail()
+
+    def _async(self, method):
+        async def call(*args, **kwargs):
+            delay = self._delay()
+            if delay:
+                await asyncio.sleep(delay)
+            # Payload rendering (e.g. PNG encoding) stays off the event loop
+            response = await asyncio.to_thread(method, *args, **kwargs)
+            if kwargs.get('stream'):
+                return _iterate_async(response)
+            return response
+        return call
+
+
+class FakeSpeechResponse:
+    def __init__(self, content):
+        self.content = content
+
+    def read(self):
+        return self.content
+
+    async def aread(self):
+        return self.content
+
+    def stream_to_file(self, file):
+        with open(file, 'wb') as f:
+            f.write(self.content)
+
+
+async def _iterate_async(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def _read(path, mode):
+    if not path:
+        return None
+    with open(path, mode) as f:
+        return f.read()
@@ -3,19 +3,46 @@ Image Generation Service
 Uses DALL-E 3 and upscaling for high-resolution images (10+ megapixels)
 """
 
+import asyncio
+import base64
+import logging
 import os
 import time
-import requests
-from openai import OpenAI
+from services.openai_client import create_client, create_async_client, download_to_file
+from services.cache_service import get_cache, temp_output_path, content_address
+from services.catalog_service import get_catalog
+from services.storage_service import get_storage, locate, shard_path
+from services.singleflight_service import SingleFlight
+from services.ratelimit_service import RateLimitedError
+from services.upscale_service import TiledUpscaler
+from services.placeholder_service import PlaceholderRenderer
+from services.metrics_service import (
+    get_logger, log_event, timed, record_stage, record_bytes, record_cache, record_error
+)
 from PIL import Image
 import io
 
+logger = get_logger('image')
+
 class ImageService:
     def __init__(self):
-        self.client = OpenAI()
+        self.client = create_client()
+        self._async_client = None
+        self.cache = get_cache()
+        self.catalog = get_catalog()
+        self.flight = SingleFlight('image')
+        self.upscaler = TiledUpscaler()
+        self.placeholders = PlaceholderRenderer()
+        # Fallback placeholders at full resolution, or preview-sized ('small')
+        self.fallback_size = os.getenv('IMAGE_FALLBACK_SIZE', 'full')
         self.output_dir = os.path.join(os.path.dirname(__file__), '..', 'outputs', 'images')
         os.makedirs(self.output_dir, exist_ok=True)
         
+        # Downscaled previews (longest edge in pixels) for galleries
+        self.derivative_dir = os.path.join(self.output_dir, 'derivatives')
+        self.derivative_sizes = (256, 1024)
+        os.makedirs(self.derivative_dir, exist_ok=True)
+        
         # Resolution configurations
         self.resolutions = {
             'hd': (1920, 1080),
@@ -23,21 +50,9 @@ class ImageService:
             '4k': (3840, 2160),
             '8k': (7680, 4320)
         }
-    
-    def generate(self, prompt, style, resolution):
-        """
-        Generate high-resolution image from text prompt
         
-        Args:
-            prompt (str): Description of the image to generate
-            style (str): Image style
-            resolution (str): Target resolution (hd, 2k, 4k, 8k)
-            
-        Returns:
-            dict: Generated image information
-        """
-        # Enhanced prompt with style
-        style_prompts = {
+        # Prompt suffix per style
+        self.style_prompts = {
             'photorealistic': 'photorealistic, highly detailed, professional photography',
             'artistic': 'artistic, creative, expressive art style',
             'concept-art': 'concept art, detailed illustration, professional design',
@@ -48,94 +63,435 @@ class ImageService:
             'fantasy': 'fantasy art, magical, ethereal atmosphere'
         }
         
-        style_desc = style_prompts.get(style, 'high quality artwork')
-        enhanced_prompt = f"{prompt}, {style_desc}"
+        # Output encoders: name -> (PIL format, extension, save options per effort)
+        self.encoders = {
+            'png': ('PNG', '.png', {
+                'fast': {'compress_level': 1},
+                'balanced': {'compress_level': 3},
+                'max': {'compress_level': 9, 'optimize': True}
+            }),
+            'webp-lossless': ('WEBP', '.webp', {
+                'fast': {'lossless': True, 'quality': 0, 'method': 0},
+                'balanced': {'lossless': True, 'quality': 25, 'method': 1},
+                'max': {'lossless': True, 'quality': 100, 'method': 6}
+            }),
+            'webp': ('WEBP', '.webp', {
+                'fast': {'quality': 92, 'method': 0},
+                'balanced': {'quality': 92, 'method': 4},
+                'max': {'quality': 92, 'method': 6}
+            }),
+            'jpeg': ('JPEG', '.jpg', {
+                'fast': {'quality': 95, 'subsampling': 0},
+                'balanced': {'quality': 95, 'subsampling': 0, 'optimize': True},
+                'max': {'quality': 95, 'subsampling': 0, 'optimize': True, 'progressive': True}
+            }),
+            'avif': ('AVIF', '.avif', {
+                'fast': {'quality': 85, 'speed': 8},
+                'balanced': {'quality': 85, 'speed': 6},
+                'max': {'quality': 85, 'speed': 2}
+            })
+        }
         
+        # AVIF needs the optional pillow-avif-plugin
         try:
-            # Generate image using DALL-E 3
-            print(f"Generating image with DALL-E 3...")
-            print(f"Prompt: {enhanced_prompt}")
-            
-            response = self.client.images.generate(
-                model="dall-e-3",
-                prompt=enhanced_prompt,
-                size="1792x1024",  # DALL-E 3 max size
-                quality="hd",
-                n=1
-            )
-            
-            # Download the generated image
-            image_url = response.data[0].url
-            image_data = requests.get(image_url).content
-            
-            # Open image with PIL
-            img = Image.open(io.BytesIO(image_data))
+            import pillow_avif  # noqa: F401 (registers the AVIF codec)
+        except ImportError:
+            pass
+        if 'AVIF' not in Image.SAVE:
+            del self.encoders['avif']
+        
+        # Default format per resolution: lossless while encode time and
+        # size stay manageable, high-quality lossy above that
+        self.default_formats = {
+            'hd': 'png',
+            '2k': 'webp-lossless',
+            '4k': 'webp',
+            '8k': 'jpeg'
+        }
+    
+    def generate(self, prompt, style, resolution, format=None, effort='balanced', variant=0):
+        """
+        Generate high-resolution image from text prompt
+        
+        Args:
+            prompt (str): Description of the image to generate
+            style (str): Image style
+            resolution (str): Target resolution (hd, 2k, 4k, 8k)
+            format (str): Output format (png, webp-lossless, webp, jpeg, avif);
+                defaults per resolution
+            effort (str): Encoder effort (fast, balanced, max)
+            variant (int): Variant number; non-zero variants of the same
+                request are generated and cached separately. DALL-E 3 only
+                accepts n=1, so each variant is its own API call.
             
-            # Upscale to target resolution if needed
-            target_size = self.resolutions.get(resolution, (3840, 2160))
-            if target_size[0] > img.width or target_size[1] > img.height:
-                print(f"Upscaling to {resolution} ({target_size[0]}x{target_size[1]})...")
-                img = img.resize(target_size, Image.Resampling.LANCZOS)
+        Returns:
+            dict: Generated image information
+        """
+        format, enhanced_prompt, target_size, cache_key = self._prepare(
+            prompt, style, resolution, format, effort, variant)
+        
+        cached = self._cached(cache_key)
+        if cached:
+            return cached
+        
+        def produce():
+            # Seconds spent in each stage of this request
+            timings = {}
             
-            # Save high-resolution image
-            filename = f"image_{int(time.time())}.png"
-            filepath = os.path.join(self.output_dir, filename)
-            img.save(filepath, 'PNG', quality=100, optimize=False)
+            try:
+                # Generate image using DALL-E 3
+                log_event(logger, 'image.generate', model='dall-e-3', prompt=enhanced_prompt,
+                          resolution=resolution)
+                
+                with timed('image', 'api', timings):
+                    response = self.client.images.generate(**self._request(enhanced_prompt))
+                
+                # Download the generated image (or decode it when returned inline)
+                with timed('image', 'download', timings):
+                    img = self._load_image(response.data[0])
+                
+                return self._finish(img, target_size, format, effort, cache_key, timings,
+                                    self._catalog_entry(prompt, style, resolution, format, effort, variant))
+                
+            except RateLimitedError:
+                # Shed before reaching the API; the caller retries, not a demo image
+                raise
+            except Exception as e:
+                log_event(logger, 'image.error', level=logging.ERROR, error=str(e), fallback=True)
+                record_error('image', fallback=True)
+                # Fallback to demo image
+                return self._create_demo_image(prompt, resolution, format)
+        
+        # Identical requests already in flight share one DALL-E call
+        return self.flight.do(cache_key, produce, lambda: self.cache.get(cache_key))
+    
+    async def generate_async(self, prompt, style, resolution, format=None, effort='balanced', variant=0):
+        """
+        Async variant of generate for the ASGI server
+        
+        The API call is awaited on the event loop; decoding, upscaling,
+        encoding and cache I/O run in the loop's executor. Arguments and
+        result match generate.
+        """
+        format, enhanced_prompt, target_size, cache_key = self._prepare(
+            prompt, style, resolution, format, effort, variant)
+        
+        cached = await asyncio.to_thread(self._cached, cache_key)
+        if cached:
+            return cached
+        
+        async def produce():
+            timings = {}
             
-            # Calculate megapixels
-            megapixels = (img.width * img.height) / 1_000_000
+            try:
+                log_event(logger, 'image.generate', model='dall-e-3', prompt=enhanced_prompt,
+                          resolution=resolution, mode='async')
+                
+                with timed('image', 'api', timings, cpu=False):
+                    response = await self.async_client.images.generate(**self._request(enhanced_prompt))
+                
+                with timed('image', 'download', timings, cpu=False):
+                    img = await asyncio.to_thread(self._load_image, response.data[0])
+                
+                return await asyncio.to_thread(
+                    self._finish, img, target_size, format, effort, cache_key, timings,
+                    self._catalog_entry(prompt, style, resolution, format, effort, variant))
+                
+            except RateLimitedError:
+                raise
+            except Exception as e:
+                log_event(logger, 'image.error', level=logging.ERROR, error=str(e), fallback=True)
+                record_error('image', fallback=True)
+                return await asyncio.to_thread(self._create_demo_image, prompt, resolution, format)
+        
+        return await self.flight.do_async(cache_key, produce, lambda: self.cache.get(cache_key))
+    
+    def warm_up(self):
+        """
+        Load every encoder's codec, start the upscaler's worker processes
+        and pre-encode the fallback placeholders
+        
+        The first save in each format pays for loading its plugin and
+        library (WebP, AVIF); a tiny image takes that cost off the first request.
+        """
+        img = Image.new('RGB', (64, 64), (20, 30, 60))
+        img.resize((32, 32), Image.Resampling.LANCZOS)
+        for pil_format, _, options in self.encoders.values():
+            img.save(io.BytesIO(), pil_format, **options['fast'])
+        self.upscaler.warm_up()
+        self.placeholders.warm_up(self.resolutions.values())
+    
+    def shutdown(self):
+        self.upscaler.shutdown()
+    
+    @property
+    def async_client(self):
+        # Built on first async call, so sync-only servers never create it
+        if self._async_client is None:
+            self._async_client = create_async_client()
+        return self._async_client
+    
+    def _prepare(self, prompt, style, resolution, format, effort, variant):
+        """
+        Validate options and derive the prompt, target size and cache key
+        
+        Returns:
+            tuple: (format, enhanced_prompt, target_size, cache_key)
+        """
+        format = format or self.default_formats.get(resolution, self.default_formats['4k'])
+        if format not in self.encoders:
+            raise ValueError(f"Format must be one of: {', '.join(self.encoders)}")
+        if effort not in self.encoders[format][2]:
+            raise ValueError("Effort must be one of: fast, balanced, max")
+        
+        # Enhanced prompt with style
+        style_desc = self.style_prompts.get(style, 'high quality artwork')
+        enhanced_prompt = f"{prompt}, {style_desc}"
+        target_size = self.resolutions.get(resolution, (3840, 2160))
+        
+        # Identical requests reuse the stored output
+        extra = {'variant': variant} if variant else {}
+        cache_key = self.cache.key('image', model='dall-e-3', prompt=enhanced_prompt,
+                                   size=f"{target_size[0]}x{target_size[1]}", format=format, effort=effort,
+                                   **extra)
+        return format, enhanced_prompt, target_size, cache_key
+    
+    def _cached(self, cache_key):
+        cached = self.cache.get(cache_key)
+        record_cache('image', cached is not None)
+        if cached:
+            log_event(logger, 'image.cache_hit', filename=cached['filename'])
+        return cached
+    
+    def _catalog_entry(self, prompt, style, resolution, format, effort, variant):
+        return {
+            'prompt': prompt,
+            'params': {'style': style, 'resolution': resolution, 'format': format,
+                       'effort': effort, 'variant': variant}
+        }
+    
+    def _request(self, enhanced_prompt):
+        """Keyword arguments for images.generate"""
+        return {
+            'model': "dall-e-3",
+            'prompt': enhanced_prompt,
+            'size': "1792x1024",  # DALL-E 3 max size
+            'quality': "hd",
+            'n': 1
+        }
+    
+    def _load_image(self, image):
+        """Decode an inline result or download it from its URL"""
+        if getattr(image, 'b64_json', None):
+            return Image.open(io.BytesIO(base64.b64decode(image.b64_json)))
+        
+        download_path = temp_output_path(self.output_dir, '.download')
+        try:
+            download_to_file(image.url, download_path)
+            img = Image.open(download_path)
+            img.load()
+            return img
+        finally:
+            os.remove(download_path)
+    
+    def _finish(self, img, target_size, format, effort, cache_key, timings, entry):
+        """
+        Upscale, encode, write previews, cache and catalog a generated image
+        
+        Args:
+            entry (dict): Prompt and parameters for the catalog, from _catalog_entry
+        
+        Returns:
+            dict: Generated image information with this run's timings
+        """
+        # Upscale to target resolution if needed, tile by tile across cores
+        if target_size[0] > img.width or target_size[1] > img.height:
+            img, upscale_timings = self.upscaler.upscale(img, target_size)
+            for stage, seconds in upscale_timings.items():
+                record_stage('image', f'upscale_{stage}', seconds, timings)
+        
+        # Encode and save high-resolution image
+        encoded = self._encode(img, format, effort, 'image')
+        record_stage('image', 'encode', encoded['encode_time'], timings)
+        record_bytes('image', encoded['bytes'])
+        
+        # Calculate megapixels
+        megapixels = (img.width * img.height) / 1_000_000
+        
+        result = dict(encoded, resolution=f"{img.width}x{img.height}", megapixels=round(megapixels, 1))
+        
+        # Gallery previews are cut from the in-memory image while we have it
+        with timed('image', 'derivatives', timings):
+            result['derivatives'] = self._create_derivatives(img, encoded['filename'])
+        
+        log_event(logger, 'image.generated', filename=encoded['filename'],
+                  resolution=result['resolution'], megapixels=result['megapixels'],
+                  format=format, effort=effort, bytes=encoded['bytes'],
+                  timings={stage: round(t, 4) for stage, t in timings.items()})
+        
+        self.cache.put(cache_key, result)
+        self.catalog.record('image', cache_key, result, **entry)
+        # Timings describe this run only, so they are not cached
+        return dict(result, timings={stage: round(t, 4) for stage, t in timings.items()})
+    
+    def get_derivative(self, filename, size):
+        """
+        Return the path of a downscaled preview, creating it if missing
+        
+        Args:
+            filename (str): Full-size image filename in the images directory
+            size (int): Longest edge in pixels; must be in self.derivative_sizes
             
-            print(f"✓ Generated image: {filepath}")
-            print(f"  Resolution: {img.width}x{img.height} ({megapixels:.1f} MP)")
+        Returns:
+            str: Path to the preview, or None if the original does not exist
+        """
+        if size not in self.derivative_sizes:
+            raise ValueError(f"Size must be one of: {', '.join(map(str, self.derivative_sizes))}, full")
+        
+        path = self._derivative_path(filename, size)
+        if os.path.exists(path):
+            return path
+        
+        source = locate(self.output_dir, os.path.basename(filename))
+        if not source:
+            return None
+        
+        # Generated lazily for images that predate previews or lost them
+        with Image.open(source) as img:
+            self._write_derivative(img, filename, size)
+        return path
+    
+    def _create_derivatives(self, img, filename, method=4):
+        """
+        Write every preview size for a freshly generated image
+        
+        Args:
+            img (PIL.Image): Full image, or any image at least as large as the biggest preview
+            filename (str): Output filename the previews belong to
+            method (int): WebP encoder method, 0 (fastest) to 6
             
-            return {
-                'url': f'/api/outputs/images/{filename}',
-                'filename': filename,
-                'filepath': filepath,
-                'resolution': f"{img.width}x{img.height}",
-                'megapixels': round(megapixels, 1)
-            }
+        Returns:
+            dict: Preview size -> URL
+        """
+        derivatives = {}
+        # Largest first, each cut from the previous one rather than the original
+        for size in sorted(self.derivative_sizes, reverse=True):
+            img = self._write_derivative(img, filename, size, method)
+            derivatives[str(size)] = f'/api/outputs/images/{filename}?size={size}'
+        return derivatives
+    
+    def _write_derivative(self, img, filename, size, method=4):
+        """Write one preview of img and return it"""
+        scale = min(1.0, size / max(img.width, img.height))
+        preview_size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        # reducing_gap lets PIL shrink by integer factors before the final
+        # Lanczos pass, which keeps 8k -> 1024px cheap
+        preview = img.resize(preview_size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+        if preview.mode not in ('RGB', 'RGBA'):
+            preview = preview.convert('RGB')
+        
+        path = self._derivative_path(filename, size)
+        scratch_path = temp_output_path(self.derivative_dir, '.webp')
+        preview.save(scratch_path, 'WEBP', quality=82, method=method)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(scratch_path, path)
+        get_storage().register(path)
+        return preview
+    
+    def _derivative_path(self, filename, size):
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        return shard_path(self.derivative_dir, f"{stem}_{size}.webp")
+    
+    def _encode(self, img, format, effort, prefix):
+        """
+        Encode an image to disk under a content-addressed name
+        
+        Args:
+            img (PIL.Image): Image to encode
+            format (str): Key into self.encoders
+            effort (str): Encoder effort (fast, balanced, max)
+            prefix (str): Filename prefix
             
-        except Exception as e:
-            print(f"Error generating image: {e}")
-            # Fallback to demo image
-            return self._create_demo_image(prompt, resolution)
+        Returns:
+            dict: url, filename, filepath, format, bytes and encode_time
+        """
+        pil_format, extension, options = self.encoders[format]
+        
+        # JPEG has no alpha channel
+        if pil_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        
+        start = time.perf_counter()
+        filepath = temp_output_path(self.output_dir, extension)
+        img.save(filepath, pil_format, **options[effort])
+        filename, filepath = content_address(filepath, prefix)
+        encode_time = time.perf_counter() - start
+        
+        return {
+            'url': f'/api/outputs/images/{filename}',
+            'filename': filename,
+            'filepath': filepath,
+            'format': format,
+            'bytes': os.path.getsize(filepath),
+            'encode_time': round(encode_time, 4)
+        }
     
-    def _create_demo_image(self, prompt, resolution):
+    def _create_demo_image(self, prompt, resolution, format):
         """
         Create a demo placeholder image
         Fallback when API is unavailable
-        """
-        from PIL import Image, ImageDraw, ImageFont
         
+        Full-size placeholders are PNGs spliced from cached blank rows and a
+        freshly drawn text band, so an outage costs milliseconds per request
+        whatever the resolution. With IMAGE_FALLBACK_SIZE=small a preview-sized
+        placeholder in the requested format is returned instead, with the
+        size it stands in for under 'upscale'.
+        """
         target_size = self.resolutions.get(resolution, (3840, 2160))
+        lines = ['ArciTEK.AI', '', ' '.join(prompt[:100].split()), '', 'Demo Image',
+                 f"{target_size[0]}x{target_size[1]}"]
         
-        # Create gradient background
-        img = Image.new('RGB', target_size, color=(20, 30, 60))
-        draw = ImageDraw.Draw(img)
-        
-        # Add text
-        text = f"ArciTEK.AI\n\n{prompt[:100]}\n\nDemo Image\n{target_size[0]}x{target_size[1]}"
+        with timed('image', 'fallback_render'):
+            # Also the source of the previews
+            small = self.placeholders.render(*self.placeholders.small_size(target_size), lines)
+            if self.fallback_size == 'small':
+                encoded = self._encode(small, format, 'fast', 'image_demo')
+                size = small.size
+            else:
+                png = self.placeholders.render_png(target_size, lines)
+                encoded = self._write_encoded(png, 'png', 'image_demo')
+                size = target_size
         
-        # Draw centered text
-        bbox = draw.textbbox((0, 0), text)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
-        position = ((target_size[0] - text_width) // 2, (target_size[1] - text_height) // 2)
-        draw.text(position, text, fill=(100, 200, 255))
+        megapixels = (size[0] * size[1]) / 1_000_000
         
-        # Save
-        filename = f"image_demo_{int(time.time())}.png"
-        filepath = os.path.join(self.output_dir, filename)
-        img.save(filepath, 'PNG')
+        result = dict(encoded, resolution=f"{size[0]}x{size[1]}", megapixels=round(megapixels, 1),
+                      placeholder=True, derivatives=self._create_derivatives(small, encoded['filename'], method=0))
+        if size != target_size:
+            result['upscale'] = {
+                'resolution': f"{target_size[0]}x{target_size[1]}",
+                'factor': round(target_size[0] / size[0], 3)
+            }
+        return result
+    
+    def _write_encoded(self, data, format, prefix):
+        """
+        Write already encoded image bytes under a content-addressed name
         
-        megapixels = (target_size[0] * target_size[1]) / 1_000_000
+        Returns:
+            dict: Same fields as _encode
+        """
+        start = time.perf_counter()
+        filepath = temp_output_path(self.output_dir, self.encoders[format][1])
+        with open(filepath, 'wb') as f:
+            f.write(data)
+        filename, filepath = content_address(filepath, prefix)
         
         return {
             'url': f'/api/outputs/images/{filename}',
             'filename': filename,
             'filepath': filepath,
-            'resolution': f"{target_size[0]}x{target_size[1]}",
-            'megapixels': round(megapixels, 1)
+            'format': format,
+            'bytes': len(data),
+            'encode_time': round(time.perf_counter() - start, 4)
         }
 
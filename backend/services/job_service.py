@@ -0,0 +1,170 @@
+"""
+Job Queue Service
+Runs generation requests in the background so HTTP workers return immediately
+"""
+
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from services.metrics_service import get_logger, log_event, metrics
+from services.ratelimit_service import priority
+
+logger = get_logger('jobs')
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity"""
+
+
+class JobService:
+    def __init__(self, handlers, limits=None, max_pending=None, retention=3600):
+        """
+        Args:
+            handlers (dict): Job type -> callable taking the request params
+                and returning a result dict
+            limits (dict): Job type -> maximum concurrently running jobs
+            max_pending (int): Maximum queued plus running jobs across all types
+            retention (int): Seconds finished jobs are kept for status lookups
+        """
+        limits = limits or {}
+        self.handlers = handlers
+        self.max_pending = max_pending or int(os.getenv('JOB_MAX_PENDING', 64))
+        self.retention = retention
+
+        # One bounded pool per job type, so a burst of slow stories cannot
+        # starve image or music jobs
+        self.executors = {
+            job_type: ThreadPoolExecutor(
+                max_workers=limits.get(job_type, 2),
+                thread_name_prefix=f'job-{job_type}'
+            )
+            for job_type in handlers
+        }
+
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, job_type, params):
+        """
+        Queue a job for background execution
+
+        Args:
+            job_type (str): One of the registered handler names
+            params (dict): Request parameters passed to the handler
+
+        Returns:
+            dict: Public job record including its id
+        """
+        if job_type not in self.handlers:
+            raise ValueError(f"Unknown job type: {job_type}")
+
+        with self.lock:
+            self._prune()
+            pending = sum(1 for job in self.jobs.values() if job['status'] in ('queued', 'running'))
+            if pending >= self.max_pending:
+                raise QueueFullError('Job queue is full, try again later')
+
+            job = {
+                'id': uuid.uuid4().hex,
+                'type': job_type,
+                'status': 'queued',
+                'created_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'result': None,
+                'error': None
+            }
+            self.jobs[job['id']] = job
+
+        self.executors[job_type].submit(self._run, job, params)
+        return self._public(job)
+
+    def get(self, job_id):
+        """
+        Look up a job by id
+
+        Returns:
+            dict: Public job record, or None if unknown or expired
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return self._public(job) if job else None
+
+    def result(self, job_id):
+        """
+        Return the result of a finished job
+
+        Returns:
+            dict: Job record with 'result' populated, or None if unknown
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if not job:
+                return None
+            return dict(self._public(job), result=job['result'])
+
+    def execute(self, job_type, fn, *args):
+        """
+        Run fn on a job type's pool without recording a job
+
+        Work submitted this way shares the type's concurrency limit with
+        queued jobs, so batches cannot oversubscribe a service.
+
+        Returns:
+            Future: Completes with fn's return value
+        """
+        return self.executors[job_type].submit(fn, *args)
+
+    def shutdown(self, wait=True):
+        for executor in self.executors.values():
+            executor.shutdown(wait=wait)
+
+    def _run(self, job, params):
+        with self.lock:
+            job['status'] = 'running'
+            job['started_at'] = time.time()
+
+        try:
+            # Queued jobs yield API budget to interactive requests
+            with priority('background'):
+                result = self.handlers[job['type']](params)
+            # Internal paths stay on the server; clients fetch via 'url'
+            result = {k: v for k, v in result.items() if k != 'filepath'}
+            status, error = 'completed', None
+        except Exception as e:
+            log_event(logger, 'job.failed', level=logging.ERROR, job_id=job['id'], type=job['type'], error=str(e))
+            result, status, error = None, 'failed', str(e)
+
+        with self.lock:
+            job['status'] = status
+            job['result'] = result
+            job['error'] = error
+            job['finished_at'] = time.time()
+
+        metrics.count('arcitek_jobs_total', help='Background jobs finished', type=job['type'], status=status)
+        metrics.observe('arcitek_job_queue_seconds', job['started_at'] - job['created_at'],
+                        help='Time jobs wait before starting', type=job['type'])
+
+    def _prune(self):
+        """Drop finished jobs older than the retention window (lock held)"""
+        cutoff = time.time() - self.retention
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job['finished_at'] and job['finished_at'] < cutoff
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def _public(self, job):
+        return {
+            'id': job['id'],
+            'type': job['type'],
+            'status': job['status'],
+            'created_at': job['created_at'],
+            'started_at': job['started_at'],
+            'finished_at': job['finished_at'],
+            'error': job['error']
+        }
@@ -0,0 +1,224 @@
+"""
+Metrics Service
+Stage timing histograms, counters and structured logging for the backend
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram buckets in seconds, from cache hits up to long-form stories
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Histogram buckets in bytes, from previews up to 8k masters and long WAVs
+SIZE_BUCKETS = (10e3, 100e3, 1e6, 10e6, 50e6, 100e6, 500e6)
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters and histograms
+
+    Series are keyed by metric name plus a sorted tuple of label pairs and
+    rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.help = {}
+
+    def count(self, name, amount=1, help=None, **labels):
+        """Increment a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if help:
+                self.help.setdefault(name, ('counter', help))
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, buckets=DURATION_BUCKETS, help=None, **labels):
+        """Record a value in a histogram"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if help:
+                self.help.setdefault(name, ('histogram', help))
+            series = self.histograms.get(key)
+            if series is None:
+                series = self.histograms[key] = {
+                    'buckets': buckets,
+                    'counts': [0] * len(buckets),
+                    'sum': 0.0,
+                    'count': 0
+                }
+            for i, bound in enumerate(series['buckets']):
+                if value <= bound:
+                    series['counts'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def reset(self):
+        """Clear every series, e.g. between benchmark scenarios"""
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def render(self):
+        """
+        Render every series in Prometheus text format
+
+        Returns:
+            str: Exposition text for /api/metrics
+        """
+        with self.lock:
+            lines = []
+            seen = set()
+
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in seen:
+                    seen.add(name)
+                    lines.extend(self._header(name, 'counter'))
+                lines.append(f"{name}{_labels(labels)} {value}")
+
+            for (name, labels), series in sorted(self.histograms.items()):
+                if name not in seen:
+                    seen.add(name)
+                    lines.extend(self._header(name, 'histogram'))
+                for bound, count in zip(series['buckets'], series['counts']):
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', _number(bound)),))} {count}")
+                lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {series['count']}")
+                lines.append(f"{name}_sum{_labels(labels)} {series['sum']}")
+                lines.append(f"{name}_count{_labels(labels)} {series['count']}")
+
+            return '\n'.join(lines) + '\n'
+
+    def _header(self, name, kind):
+        lines = []
+        if name in self.help:
+            lines.append(f"# HELP {name} {self.help[name][1]}")
+        lines.append(f"# TYPE {name} {kind}")
+        return lines
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in pairs
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def timed(service, stage, timings=None, cpu=True):
+    """
+    Time a block as one stage of a request
+
+    Args:
+        service (str): Service label, e.g. 'image'
+        stage (str): Stage label, e.g. 'api' or 'encode'
+        timings (dict): Optional per-request dict to record the duration in
+        cpu (bool): Also record thread CPU time; pass False around awaits,
+            where the event loop thread runs other requests meanwhile
+    """
+    start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield
+    finally:
+        record_stage(service, stage, time.perf_counter() - start, timings)
+        if cpu:
+            # CPU of the calling thread only; work handed to pools is not included
+            metrics.observe('arcitek_stage_cpu_seconds', time.thread_time() - cpu_start,
+                            help='Thread CPU time spent per generation stage', service=service, stage=stage)
+
+
+def record_stage(service, stage, seconds, timings=None):
+    """Record a stage duration measured elsewhere"""
+    metrics.observe('arcitek_stage_duration_seconds', seconds,
+                    help='Time spent per generation stage', service=service, stage=stage)
+    if timings is not None:
+        timings[stage] = seconds
+
+
+def record_bytes(service, num_bytes):
+    """Record the size of a file written for a request"""
+    metrics.count('arcitek_output_bytes_total', num_bytes,
+                  help='Bytes written to outputs', service=service)
+    metrics.observe('arcitek_output_size_bytes', num_bytes, buckets=SIZE_BUCKETS,
+                    help='Size of each written output', service=service)
+
+
+def record_cache(service, hit):
+    metrics.count('arcitek_cache_requests_total', help='Result cache lookups',
+                  service=service, result='hit' if hit else 'miss')
+
+
+def record_error(service, fallback=False):
+    """Count a failed upstream call, and whether a fallback was served"""
+    metrics.count('arcitek_errors_total', help='Failed generation attempts', service=service)
+    if fallback:
+        metrics.count('arcitek_fallbacks_total', help='Requests served a demo fallback', service=service)
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Formats log records as JSON lines, or as 'event key=value' text
+
+    Fields passed via extra={'fields': {...}} are included in the output.
+    """
+
+    def __init__(self, json_output=True):
+        super().__init__()
+        self.json_output = json_output
+
+    def format(self, record):
+        fields = getattr(record, 'fields', {})
+        if self.json_output:
+            entry = {
+                'ts': round(record.created, 3),
+                'level': record.levelname.lower(),
+                'logger': record.name,
+                'event': record.getMessage()
+            }
+            entry.update(fields)
+            if record.exc_info:
+                entry['exc'] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str, ensure_ascii=False)
+
+        pairs = ' '.join(f"{key}={value}" for key, value in fields.items())
+        return f"{record.levelname:<7} {record.name} {record.getMessage()} {pairs}".rstrip()
+
+
+def configure_logging():
+    """
+    Route 'arcitek' loggers to stderr
+
+    LOG_FORMAT selects json (default) or text; LOG_LEVEL sets the level.
+    """
+    handler = logging.StreamHandler()
+    handler.setFormatter(StructuredFormatter(os.getenv('LOG_FORMAT', 'json').lower() != 'text'))
+
+    logger = logging.getLogger('arcitek')
+    logger.handlers[:] = [handler]
+    logger.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    logger.propagate = False
+
+
+def get_logger(service):
+    return logging.getLogger(f'arcitek.{service}')
+
+
+def log_event(logger, event, level=logging.INFO, **fields):
+    """Log a named event with structured fields"""
+    logger.log(level, event, extra={'fields': fields})
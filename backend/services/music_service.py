@@ -1,20 +1,48 @@
 """
 Music Generation Service
-Uses AI APIs to generate high-quality music (96kHz/24-bit WAV)
+Uses AI APIs to generate high-quality music (96kHz/24-bit FLAC or WAV masters
+with a compressed preview), with optional loudness, trim, fade and resampling
+post-processing
 """
 
+import asyncio
 import os
-import time
-import requests
-from openai import OpenAI
+from services.openai_client import create_client
+from services.cache_service import (
+    get_cache, temp_output_path, content_address, content_hash_from_name, file_digest
+)
+from services.storage_service import get_storage, locate, shard_path
+from services.catalog_service import get_catalog
+from services.singleflight_service import SingleFlight
+from services.audio_encoder_service import (
+    FORMATS, WAV_CHUNK_FRAMES, available_formats, encode_blocks, encode_pcm24, iter_pcm24_wav
+)
+from services.postprocess_service import PostProcessor, normalize_options
+from services.metrics_service import get_logger, log_event, timed, record_bytes, record_cache
+
+logger = get_logger('music')
 
 class MusicService:
     def __init__(self):
-        self.client = OpenAI()
+        self.client = create_client()
+        self.cache = get_cache()
+        self.catalog = get_catalog()
+        self.flight = SingleFlight('music')
         self.output_dir = os.path.join(os.path.dirname(__file__), '..', 'outputs', 'music')
         os.makedirs(self.output_dir, exist_ok=True)
+        
+        self.sample_rate = 96000  # 96kHz
+        self.num_channels = 2  # Stereo
+        
+        # Lossless masters and lossy previews this installation can write
+        formats = available_formats()
+        self.master_formats = [name for name in formats if FORMATS[name]['role'] == 'master']
+        self.preview_formats = [name for name in formats if FORMATS[name]['role'] == 'preview']
+        self.default_format = os.getenv('MUSIC_FORMAT', 'flac' if 'flac' in formats else 'wav')
+        self.default_preview = os.getenv('MUSIC_PREVIEW', 'opus' if 'opus' in formats else 'none')
+        self.processor = PostProcessor()
     
-    def generate(self, prompt, genre, duration):
+    def generate(self, prompt, genre, duration, format=None, preview=None, process=None):
         """
         Generate music from text prompt
         
@@ -22,72 +50,358 @@ class MusicService:
             prompt (str): Description of the music to generate
             genre (str): Music genre
             duration (int): Duration in seconds
+            format (str): Master format, 'flac' or 'wav' (default MUSIC_FORMAT)
+            preview (str): Preview format, 'opus', 'mp3' or 'none'
+                (default MUSIC_PREVIEW)
+            process (dict): Post-processing options (loudness, peak_ceiling,
+                fade_in, fade_out, trim_start, trim_end, trim_silence,
+                sample_rate); see postprocess_service.normalize_options
             
         Returns:
             dict: Generated music information
         """
+        format, preview = self._resolve_formats(format, preview)
+        options = normalize_options(process)
+        
         # Enhanced prompt with genre and style
         enhanced_prompt = f"{prompt}. Genre: {genre}. Duration: approximately {duration} seconds."
         
         # For demo purposes, we'll use a placeholder approach
         # In production, this would integrate with ElevenLabs Music API or similar
         
-        # Simulate music generation (in production, call actual API)
-        filename = f"music_{int(time.time())}.wav"
-        filepath = os.path.join(self.output_dir, filename)
+        # Identical requests reuse the stored track
+        cache_key = self._cache_key(enhanced_prompt, duration, format, preview, options)
+        cached = self._lookup(cache_key)
+        record_cache('music', cached is not None)
+        if cached:
+            log_event(logger, 'music.cache_hit', filename=cached['filename'])
+            return cached
+        
+        def produce():
+            # Simulate music generation (in production, call actual API)
+            outputs = self._scratch_outputs(format, preview)
+            processing = None
+            
+            if options:
+                # Post-processing reads the track twice, so it is rendered
+                # to a scratch WAV that can be memory-mapped
+                raw_path = temp_output_path(self.output_dir, '.wav')
+                try:
+                    with timed('music', 'render'):
+                        self._create_demo({'wav': raw_path}, duration)
+                    with timed('music', 'postprocess'):
+                        encoded, processing = self.processor.process(raw_path, outputs, options)
+                finally:
+                    os.remove(raw_path)
+            else:
+                # Master and preview are encoded from the same blocks in one pass
+                # In production, the blocks would come from the generated music
+                with timed('music', 'render'):
+                    encoded = self._create_demo(outputs, duration)
+            
+            if processing:
+                duration_out = processing['duration']
+            else:
+                duration_out = duration
+            result = self._publish(outputs, format, preview, encoded, duration_out, processing)
+            log_event(logger, 'music.generated', filename=result['filename'], duration=result['duration'],
+                      format=result['format'], sample_rate=result['sample_rate'],
+                      bytes=result['bytes'], encode_time=result['encode_time'], preview=preview,
+                      preview_bytes=result['preview']['bytes'] if preview else None,
+                      processed=bool(options))
+            
+            self.cache.put(cache_key, result)
+            self.catalog.record('music', cache_key, result, **self._catalog_entry(
+                prompt, genre, duration, format=format, preview=preview, process=options))
+            return result
+        
+        # Identical requests already in flight share one render
+        return self.flight.do(cache_key, produce, lambda: self._lookup(cache_key))
+    
+    async def generate_async(self, prompt, genre, duration, format=None, preview=None, process=None):
+        """
+        Async variant of generate for the ASGI server
+        
+        Music is synthesized locally with no API call, so the whole request
+        (synthesis, post-processing, encoding and file I/O) runs in the
+        loop's executor. Arguments and result match generate.
+        """
+        return await asyncio.to_thread(self.generate, prompt, genre, duration, format, preview, process)
+    
+    def reprocess(self, filename, process, format=None, preview=None):
+        """
+        Post-process an existing track into new output files
+        
+        The source is left untouched; the processed master and preview are
+        new content-addressed files.
+        
+        Args:
+            filename (str): Track in the music outputs directory
+            process (dict): Post-processing options, as for generate
+            format (str): Master format of the result (default MUSIC_FORMAT)
+            preview (str): Preview format of the result (default MUSIC_PREVIEW)
+            
+        Returns:
+            dict: Processed music information, with the source filename
+                under 'source'
+        """
+        format, preview = self._resolve_formats(format, preview)
+        options = normalize_options(process)
+        if not options:
+            raise ValueError('At least one processing option is required')
+        
+        name = os.path.basename(filename)
+        source = None if name.startswith('.') else locate(self.output_dir, name)
+        if not source:
+            raise FileNotFoundError(f"Track not found: {name}")
+        
+        # Keyed by content, so a replaced file is never answered from cache
+        digest = content_hash_from_name(name) or file_digest(source)
+        cache_key = self.cache.key('music_reprocess', source=digest, format=format,
+                                   preview=preview, **options)
+        cached = self._lookup(cache_key)
+        record_cache('music', cached is not None)
+        if cached:
+            log_event(logger, 'music.cache_hit', filename=cached['filename'], source=name)
+            return cached
+        
+        def produce():
+            outputs = self._scratch_outputs(format, preview)
+            with timed('music', 'postprocess'):
+                encoded, processing = self.processor.process(source, outputs, options)
+            
+            result = self._publish(outputs, format, preview, encoded, processing['duration'], processing)
+            result['source'] = name
+            log_event(logger, 'music.reprocessed', filename=result['filename'], source=name,
+                      format=result['format'], sample_rate=result['sample_rate'], bytes=result['bytes'])
+            
+            self.cache.put(cache_key, result)
+            self.catalog.record('music', cache_key, result, params={
+                'source': name, 'format': format, 'preview': preview, 'process': options})
+            return result
+        
+        return self.flight.do(cache_key, produce, lambda: self._lookup(cache_key))
+    
+    def generate_stream(self, prompt, genre, duration):
+        """
+        Generate music from text prompt, yielding the WAV body as it is produced
+        
+        Streams are always WAV without a preview. The file is written to the
+        outputs directory alongside the stream, so the returned URL is valid
+        once the stream has been consumed.
+        
+        Args:
+            prompt (str): Description of the music to generate
+            genre (str): Music genre
+            duration (int): Duration in seconds
+            
+        Returns:
+            dict: Generated music information, with the WAV bytes
+                iterator under 'stream'
+        """
+        enhanced_prompt = f"{prompt}. Genre: {genre}. Duration: approximately {duration} seconds."
+        cache_key = self._cache_key(enhanced_prompt, duration, 'wav', None)
+        cached = self.cache.get(cache_key)
+        record_cache('music', cached is not None)
+        if cached:
+            log_event(logger, 'music.cache_hit', filename=cached['filename'], stream=True)
+            return dict(cached, stream=self._read_file(cached['filepath']))
+        
+        # The name must be known before any bytes are sent, so streamed
+        # tracks are named by request key rather than by content
+        filename = f"music_stream_{cache_key[:32]}.wav"
+        filepath = shard_path(self.output_dir, filename)
+        
+        num_frames = int(self.sample_rate * duration)
+        chunks = iter_pcm24_wav(self._synthesize_demo(duration), num_frames,
+                                self.sample_rate, self.num_channels)
+        
+        result = self._result(filename, filepath, duration, 'wav')
+        entry = self._catalog_entry(prompt, genre, duration, format='wav', stream=True)
+        result['stream'] = self._tee_to_file(chunks, filepath, cache_key, dict(result), entry)
+        return result
+    
+    def warm_up(self):
+        """Import NumPy and run the synthesis and 24-bit packing paths once"""
+        for block in self._synthesize_demo(0.01, 440, 0.5, 1024):
+            encode_pcm24(block, self.num_channels)
+    
+    def _resolve_formats(self, format, preview):
+        """
+        Apply defaults to the requested master and preview formats
         
-        # Create a placeholder WAV file header for demo
-        # In production, this would be the actual generated music from API
-        self._create_demo_wav(filepath, duration)
+        Returns:
+            tuple: (master format, preview format or None)
+        """
+        format = (format or self.default_format).lower()
+        if format not in self.master_formats:
+            raise ValueError(f"Format must be one of: {', '.join(self.master_formats)}")
         
+        preview = (preview or self.default_preview).lower()
+        if preview == 'none':
+            return format, None
+        if preview not in self.preview_formats:
+            raise ValueError(f"Preview must be one of: {', '.join(self.preview_formats + ['none'])}")
+        return format, preview
+    
+    def _lookup(self, cache_key):
+        """Return the cached track, or None if it or its preview has been deleted"""
+        cached = self.cache.get(cache_key)
+        if cached and cached.get('preview'):
+            preview_path = locate(self.output_dir, cached['preview']['filename'])
+            if not preview_path:
+                return None
+            get_storage().touch(preview_path)
+        return cached
+    
+    def _cache_key(self, enhanced_prompt, duration, format, preview, options=None):
+        # Unprocessed WAV without a preview keeps the key it had before
+        # other formats existed
+        extra = {}
+        if format != 'wav':
+            extra['format'] = format
+        if preview:
+            extra['preview'] = preview
+        if options:
+            extra['process'] = options
+        return self.cache.key('music', prompt=enhanced_prompt, duration=duration,
+                              sample_rate=self.sample_rate, channels=self.num_channels, **extra)
+    
+    def _catalog_entry(self, prompt, genre, duration, **params):
         return {
+            'prompt': prompt,
+            'params': dict(params, genre=genre, duration=duration)
+        }
+    
+    def _scratch_outputs(self, format, preview):
+        """Scratch paths for the master and optional preview, keyed by format"""
+        outputs = {format: temp_output_path(self.output_dir, FORMATS[format]['extension'])}
+        if preview:
+            outputs[preview] = temp_output_path(self.output_dir, FORMATS[preview]['extension'])
+        return outputs
+    
+    def _publish(self, outputs, format, preview, encoded, duration, processing=None):
+        """
+        Content-address freshly encoded files and describe them
+        
+        Args:
+            outputs (dict): Format name -> scratch path
+            format (str): Master format
+            preview (str): Preview format, or None
+            encoded (dict): Per-format statistics from encode_blocks
+            duration (float): Track duration in seconds
+            processing (dict): Post-processing report, if any
+            
+        Returns:
+            dict: Result payload
+        """
+        with timed('music', 'file_write'):
+            filename, filepath = content_address(outputs[format], 'music')
+            if preview:
+                preview_name, _ = content_address(outputs[preview], 'preview')
+        record_bytes('music', sum(stats['bytes'] for stats in encoded.values()))
+        
+        sample_rate = processing['sample_rate'] if processing else self.sample_rate
+        result = self._result(filename, filepath, duration, format, encoded[format], sample_rate)
+        if preview:
+            result['preview'] = {
+                'url': f'/api/outputs/music/{preview_name}',
+                'filename': preview_name,
+                'format': FORMATS[preview]['label'],
+                'bitrate': FORMATS[preview]['bitrate'],
+                'sample_rate': _rate_label(FORMATS[preview]['sample_rate']),
+                **encoded[preview]
+            }
+        if processing:
+            result['processing'] = processing
+        return result
+    
+    def _result(self, filename, filepath, duration, format, encoded=None, sample_rate=None):
+        """Build the response payload for a generated track"""
+        result = {
             'url': f'/api/outputs/music/{filename}',
             'filename': filename,
             'filepath': filepath,
             'duration': duration,
-            'format': 'WAV',
-            'sample_rate': '96kHz',
+            'format': FORMATS[format]['label'],
+            'sample_rate': _rate_label(sample_rate or self.sample_rate),
             'bit_depth': '24-bit'
         }
+        if encoded:
+            result.update(encoded)
+        return result
+    
+    def _tee_to_file(self, chunks, filepath, cache_key, result, entry):
+        """Yield chunks unchanged while writing them to filepath, then cache and catalog it"""
+        scratch_path = temp_output_path(self.output_dir, '.wav')
+        try:
+            with open(scratch_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+        except BaseException:
+            # Client disconnected or synthesis failed; drop the partial file
+            os.remove(scratch_path)
+            raise
+        
+        # Only publish and cache the file once it is complete
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        os.replace(scratch_path, filepath)
+        get_storage().register(filepath)
+        self.cache.put(cache_key, result)
+        self.catalog.record('music', cache_key, result, **entry)
+        record_bytes('music', os.path.getsize(filepath))
+        log_event(logger, 'music.streamed', filename=result['filename'], duration=result['duration'])
+    
+    def _read_file(self, filepath, chunk_size=1024 * 1024):
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                yield chunk
     
-    def _create_demo_wav(self, filepath, duration):
+    def _create_demo(self, outputs, duration):
         """
-        Create a demo WAV file
+        Create demo audio files
         In production, this would be replaced with actual API call
+        
+        Args:
+            outputs (dict): Format name -> destination path
+            duration (float): Duration in seconds
+            
+        Returns:
+            dict: Format name -> {'bytes', 'encode_time'}
         """
-        # Simple WAV file header for demonstration
-        # In production, use actual music generation API
+        # Audio is synthesized and encoded block by block, so memory use
+        # does not grow with duration
+        return encode_blocks(self._synthesize_demo(duration), outputs,
+                             self.sample_rate, self.num_channels)
+    
+    def _synthesize_demo(self, duration, frequency=440.0, amplitude=0.3, block_frames=WAV_CHUNK_FRAMES):
+        """
+        Synthesize a sine tone for demonstration, one block at a time
         
-        import wave
+        Args:
+            duration (float): Duration in seconds
+            frequency (float): Tone frequency in Hz (default A4)
+            amplitude (float): Peak amplitude in [0.0, 1.0]
+            block_frames (int): Frames per yielded block
+            
+        Yields:
+            ndarray: Mono float64 blocks of at most block_frames samples
+        """
         import numpy as np
         
-        sample_rate = 96000  # 96kHz
-        num_channels = 2  # Stereo
-        sample_width = 3  # 24-bit (3 bytes)
-        
-        # Generate silence or simple tone for demo
-        num_samples = int(sample_rate * duration)
+        num_frames = int(self.sample_rate * duration)
+        step = 2 * np.pi * frequency / self.sample_rate
+        ramp = np.arange(block_frames) * step
+        phase = 0.0
         
-        # Create a simple sine wave for demonstration
-        frequency = 440.0  # A4 note
-        t = np.linspace(0, duration, num_samples)
-        audio_data = np.sin(2 * np.pi * frequency * t) * 0.3
-        
-        # Convert to 24-bit PCM
-        audio_data = (audio_data * (2**23 - 1)).astype(np.int32)
-        
-        # Write WAV file
-        with wave.open(filepath, 'w') as wav_file:
-            wav_file.setnchannels(num_channels)
-            wav_file.setsampwidth(sample_width)
-            wav_file.setframerate(sample_rate)
-            
-            # Write stereo data (duplicate mono to both channels)
-            for sample in audio_data:
-                # Convert to 24-bit bytes
-                sample_bytes = sample.to_bytes(3, byteorder='little', signed=True)
-                wav_file.writeframes(sample_bytes * num_channels)
-        
-        print(f"✓ Generated demo music: {filepath}")
-        print(f"  Format: 96kHz/24-bit WAV, Duration: {duration}s")
+        for start in range(0, num_frames, block_frames):
+            count = min(block_frames, num_frames - start)
+            yield np.sin(phase + ramp[:count]) * amplitude
+            # Carry phase into the next block, wrapped to keep precision
+            phase = (phase + count * step) % (2 * np.pi)
+
 
+def _rate_label(sample_rate):
+    """'96kHz', '44.1kHz' etc. for a rate in Hz"""
+    return f"{sample_rate / 1000:g}kHz"
@@ -0,0 +1,173 @@
+"""
+OpenAI Client Factory
+Shared, pooled HTTP transport used by all generation services
+"""
+
+import os
+import random
+import threading
+from services.ratelimit_service import ScheduledClient, get_limiter, response_hook, async_response_hook
+from services.circuit_service import get_breakers
+
+# Connection pool and timeout settings (seconds)
+POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 20))
+CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 10))
+READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 600))
+MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', 3))
+
+# The async client holds many more requests in flight than a thread pool
+ASYNC_POOL_SIZE = int(os.getenv('HTTP_ASYNC_POOL_SIZE', 256))
+
+# Statuses worth retrying for plain downloads
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_client = None
+_async_client = None
+_session = None
+_lock = threading.Lock()
+
+
+def create_client():
+    """
+    Return the process-wide OpenAI client
+
+    All services share one client, and therefore one keep-alive connection
+    pool. Calls wait for their model's budget in the shared RateLimiter,
+    which also reads the rate-limit headers of every response. The SDK
+    retries 429/5xx responses with jittered exponential backoff (honouring
+    Retry-After) up to HTTP_MAX_RETRIES times. Calls to a model whose
+    circuit breaker is open raise CircuitOpenError without being sent.
+
+    Set OPENAI_FAKE=1 to use the offline fake client instead of the real API.
+
+    Returns:
+        OpenAI or FakeOpenAI: Client exposing images, chat and audio APIs
+    """
+    global _client
+    with _lock:
+        if _client is None:
+            _client = ScheduledClient(_build_client(), get_limiter(), breakers=get_breakers())
+        return _client
+
+
+def create_async_client():
+    """
+    Return the process-wide AsyncOpenAI client
+
+    Used by the services' *_async methods under the ASGI server. It has
+    its own connection pool, sized by HTTP_ASYNC_POOL_SIZE, and the same
+    rate limiter, circuit breakers and retry policy as the sync client.
+    Set OPENAI_FAKE=1 for the offline fake.
+
+    Returns:
+        AsyncOpenAI or AsyncFakeOpenAI: Client exposing awaitable images,
+            chat and audio APIs
+    """
+    global _async_client
+    with _lock:
+        if _async_client is None:
+            _async_client = ScheduledClient(_build_async_client(), get_limiter(), is_async=True,
+                                            breakers=get_breakers())
+        return _async_client
+
+
+def get_session():
+    """
+    Return the process-wide requests session for downloading results
+
+    Returns:
+        requests.Session: Pooled session with jittered retries on 429/5xx
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            _session = _build_session()
+        return _session
+
+
+def download_to_file(url, filepath, chunk_size=1024 * 1024):
+    """
+    Stream a URL to disk without buffering the body in memory
+
+    Args:
+        url (str): Source URL
+        filepath (str): Destination path
+        chunk_size (int): Bytes read per chunk
+
+    Returns:
+        int: Bytes written
+    """
+    written = 0
+    with get_session().get(url, stream=True, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)) as response:
+        response.raise_for_status()
+        with open(filepath, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+                written += len(chunk)
+    return written
+
+
+def _build_client():
+    if os.getenv('OPENAI_FAKE', '').lower() in ('1', 'true', 'yes'):
+        from services.fake_openai import FakeOpenAI
+        return FakeOpenAI()
+
+    import httpx
+    from openai import OpenAI
+
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=POOL_SIZE,
+            max_keepalive_connections=POOL_SIZE,
+            keepalive_expiry=60
+        ),
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+        event_hooks={'response': [response_hook(get_limiter())]}
+    )
+    return OpenAI(http_client=http_client, max_retries=MAX_RETRIES)
+
+
+def _build_async_client():
+    if os.getenv('OPENAI_FAKE', '').lower() in ('1', 'true', 'yes'):
+        from services.fake_openai import AsyncFakeOpenAI
+        return AsyncFakeOpenAI()
+
+    import httpx
+    from openai import AsyncOpenAI
+
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=ASYNC_POOL_SIZE,
+            max_keepalive_connections=ASYNC_POOL_SIZE,
+            keepalive_expiry=60
+        ),
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+        event_hooks={'response': [async_response_hook(get_limiter())]}
+    )
+    return AsyncOpenAI(http_client=http_client, max_retries=MAX_RETRIES)
+
+
+def _build_session():
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    class JitteredRetry(Retry):
+        """Exponential backoff with full jitter, so retries do not synchronize"""
+
+        def get_backoff_time(self):
+            return random.uniform(0, super().get_backoff_time())
+
+    retry = JitteredRetry(
+        total=MAX_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        respect_retry_after_header=True
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
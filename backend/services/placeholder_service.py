@@ -0,0 +1,166 @@
+"""
+Placeholder Service
+Cheap fallback images for when the image API is unavailable
+"""
+
+import struct
+import threading
+import zlib
+
+# Background and text colours of the placeholder
+BACKGROUND = (20, 30, 60)
+FOREGROUND = (100, 200, 255)
+
+# Longest edge of small placeholders and of the previews cut from them
+SMALL_EDGE = 1024
+
+# Blank pixels above and below the text block
+BAND_PADDING = 16
+
+# Most text lines a placeholder carries
+TEXT_LINES = 7
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Modulus of the Adler-32 checksum closing a zlib stream
+ADLER_BASE = 65521
+
+
+class PlaceholderRenderer:
+    """
+    Renders "Demo Image" placeholders without touching full-resolution pixels
+
+    A placeholder is a flat background with a short text block in the
+    middle. Its PNG is assembled from deflate segments: the blank rows above
+    and below the text are compressed once per size and cached, and each
+    request compresses only the band of rows holding its text. Segments end
+    on a full flush, so they can be concatenated into one valid stream.
+    """
+
+    def __init__(self):
+        self.bases = {}
+        self.lock = threading.Lock()
+
+    def render_png(self, size, lines):
+        """
+        Encode a full-size placeholder as PNG
+
+        Args:
+            size (tuple): (width, height) in pixels
+            lines (list): At most TEXT_LINES text lines, centred as one block
+
+        Returns:
+            bytes: PNG file contents
+        """
+        width, height = size
+        base = self._base(size)
+        band_raw = _scanlines(self.render(width, base['band_height'], lines))
+
+        compressor = zlib.compressobj(1, zlib.DEFLATED, -15)
+        band = compressor.compress(band_raw) + compressor.flush(zlib.Z_FULL_FLUSH)
+
+        # Adler-32 over all rows: cached top, this band, cached bottom
+        adler = zlib.adler32(band_raw, base['top_adler'])
+        adler = _adler32_combine(adler, base['bottom_adler'], base['bottom_length'])
+
+        return b''.join((
+            PNG_SIGNATURE,
+            _chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)),
+            base['top_chunk'],
+            _chunk(b'IDAT', band),
+            base['bottom_chunk'],
+            # The stream's checksum depends on the band, so it gets its own chunk
+            _chunk(b'IDAT', struct.pack('>I', adler)),
+            _chunk(b'IEND', b'')
+        ))
+
+    def render(self, width, height, lines):
+        """
+        Draw a placeholder (or the text band of one) with PIL
+
+        Returns:
+            PIL.Image: RGB image of the given size
+        """
+        from PIL import Image, ImageDraw
+
+        img = Image.new('RGB', (width, height), color=BACKGROUND)
+        draw = ImageDraw.Draw(img)
+        text = '\n'.join(lines)
+        bbox = draw.textbbox((0, 0), text)
+        position = ((width - (bbox[2] - bbox[0])) // 2, (height - (bbox[3] - bbox[1])) // 2)
+        draw.text(position, text, fill=FOREGROUND)
+        return img
+
+    def small_size(self, size):
+        """Scale size so its longest edge is at most SMALL_EDGE"""
+        scale = min(1.0, SMALL_EDGE / max(size))
+        return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+    def warm_up(self, sizes):
+        """Pre-encode the blank rows for each (width, height) in sizes"""
+        for size in sizes:
+            self._base(size)
+
+    def _base(self, size):
+        """
+        Compressed blank rows around the text band for one size, built once
+
+        Returns:
+            dict: IDAT chunks above and below the band, their Adler-32
+                state and the band height
+        """
+        with self.lock:
+            if size in self.bases:
+                return self.bases[size]
+
+        width, height = size
+        band_height = min(height, self._text_height() + 2 * BAND_PADDING)
+        top_rows = (height - band_height) // 2
+        bottom_rows = height - band_height - top_rows
+
+        row = b'\x00' + bytes(BACKGROUND) * width
+        top_raw = row * top_rows
+        bottom_raw = row * bottom_rows
+
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+        top = compressor.compress(top_raw) + compressor.flush(zlib.Z_FULL_FLUSH)
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+        bottom = compressor.compress(bottom_raw) + compressor.flush(zlib.Z_FINISH)
+
+        base = {
+            'band_height': band_height,
+            # zlib header: deflate with a 32K window
+            'top_chunk': _chunk(b'IDAT', b'\x78\x9c' + top),
+            'top_adler': zlib.adler32(top_raw),
+            'bottom_chunk': _chunk(b'IDAT', bottom),
+            'bottom_adler': zlib.adler32(bottom_raw),
+            'bottom_length': len(bottom_raw)
+        }
+        with self.lock:
+            self.bases[size] = base
+        return base
+
+    def _text_height(self):
+        """Height of the tallest text block render() draws (TEXT_LINES lines)"""
+        from PIL import Image, ImageDraw
+
+        bbox = ImageDraw.Draw(Image.new('RGB', (1, 1))).textbbox((0, 0), '\n'.join(['Xg'] * TEXT_LINES))
+        return bbox[3] - bbox[1]
+
+
+def _scanlines(img):
+    """Raw PNG rows (filter type 0) of an RGB image"""
+    stride = img.width * 3
+    data = img.tobytes()
+    return b''.join(b'\x00' + data[i:i + stride] for i in range(0, len(data), stride))
+
+
+def _chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def _adler32_combine(adler1, adler2, length2):
+    """Adler-32 of A+B from the checksums of A and B and the length of B"""
+    s1 = ((adler1 & 0xffff) + (adler2 & 0xffff) - 1) % ADLER_BASE
+    s2 = ((adler1 >> 16) + (adler2 >> 16) + length2 * (adler1 & 0xffff) - length2) % ADLER_BASE
+    return (s2 << 16) | s1
@@ -0,0 +1,474 @@
+"""
+Post-Processing Service
+Loudness normalization, trimming, fades and resampling of generated tracks
+"""
+
+import math
+import os
+import struct
+import time
+from services.audio_encoder_service import Resampler, encode_blocks
+from services.metrics_service import get_logger, log_event, record_stage
+
+logger = get_logger('postprocess')
+
+# Frames decoded and processed per step (~256 KB of 24-bit stereo)
+BLOCK_FRAMES = 32768
+
+# Loudness is measured over 400 ms gating blocks overlapping by 75%,
+# assembled from 100 ms sub-blocks (ITU-R BS.1770)
+SUB_BLOCK_SECONDS = 0.1
+GATE_SUB_BLOCKS = 4
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+
+# Level below which leading and trailing audio counts as silence (dBFS)
+SILENCE_THRESHOLD = -60.0
+
+# Output sample rates a track can be resampled to
+SAMPLE_RATES = (96000, 48000, 44100)
+
+# Option -> (type, minimum, maximum); None bounds are open
+OPTIONS = {
+    'loudness': (float, -40.0, -5.0),
+    'peak_ceiling': (float, -20.0, 0.0),
+    'fade_in': (float, 0.0, 60.0),
+    'fade_out': (float, 0.0, 60.0),
+    'trim_start': (float, 0.0, None),
+    'trim_end': (float, 0.0, None),
+    'trim_silence': (bool, None, None),
+    'sample_rate': (int, None, None)
+}
+
+# Peak ceiling used when only a loudness target is given (dBFS)
+DEFAULT_PEAK_CEILING = -1.0
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def normalize_options(options):
+    """
+    Validate post-processing options and drop the ones that change nothing
+
+    The result is canonical, so equal requests produce equal cache keys.
+
+    Args:
+        options (dict): Any of the keys in OPTIONS, or None
+
+    Returns:
+        dict: Validated options; empty when no processing is requested
+    """
+    if not options:
+        return {}
+    if not isinstance(options, dict):
+        raise ValueError('Processing options must be an object')
+    unknown = set(options) - set(OPTIONS)
+    if unknown:
+        raise ValueError(f"Unknown processing options: {', '.join(sorted(unknown))}")
+
+    cleaned = {}
+    for name, value in options.items():
+        if value is None:
+            continue
+        kind, minimum, maximum = OPTIONS[name]
+        if kind is bool:
+            if not isinstance(value, bool):
+                raise ValueError(f"{name} must be true or false")
+        else:
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f"{name} must be a number")
+            value = kind(value)
+            if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+                upper = maximum if maximum is not None else 'any'
+                raise ValueError(f"{name} must be between {minimum} and {upper}")
+        cleaned[name] = value
+
+    if 'sample_rate' in cleaned and cleaned['sample_rate'] not in SAMPLE_RATES:
+        raise ValueError(f"sample_rate must be one of: {', '.join(map(str, SAMPLE_RATES))}")
+    if 'peak_ceiling' in cleaned and 'loudness' not in cleaned:
+        raise ValueError('peak_ceiling requires a loudness target')
+
+    # Defaults that leave the audio untouched
+    for name in ('fade_in', 'fade_out', 'trim_start', 'trim_end'):
+        if cleaned.get(name) == 0:
+            del cleaned[name]
+    if cleaned.get('trim_silence') is False:
+        del cleaned['trim_silence']
+    if 'loudness' in cleaned:
+        cleaned.setdefault('peak_ceiling', DEFAULT_PEAK_CEILING)
+    return cleaned
+
+
+class WavSource:
+    """
+    PCM samples of a WAV file, read through a memory map
+
+    Only the frames of the requested block are paged in and decoded, so
+    memory use does not depend on the length of the track.
+    """
+
+    def __init__(self, path):
+        import numpy as np
+
+        layout = read_wav_layout(path)
+        self.sample_rate = layout['sample_rate']
+        self.channels = layout['channels']
+        self.width = layout['sample_width']
+        self.float = layout['float']
+        self.frames = layout['frames']
+        self.data = np.memmap(path, dtype=np.uint8, mode='r', offset=layout['offset'],
+                              shape=(self.frames, self.channels, self.width))
+
+    def read(self, start, stop):
+        """
+        Decode frames [start, stop) to float
+
+        Returns:
+            ndarray: float64 samples in [-1.0, 1.0] with shape (frames, channels)
+        """
+        import numpy as np
+
+        raw = self.data[start:stop]
+        if self.float:
+            return raw.view('<f4' if self.width == 4 else '<f8')[..., 0].astype(np.float64)
+        if self.width == 3:
+            # Widen to int32 with the sample in the top three bytes, then
+            # shift back down so the sign is extended
+            wide = np.zeros(raw.shape[:2] + (4,), dtype=np.uint8)
+            wide[..., 1:] = raw
+            samples = wide.view('<i4')[..., 0] >> 8
+        elif self.width == 1:
+            samples = raw[..., 0].astype(np.int16) - 128
+        else:
+            samples = raw.view(f'<i{self.width}')[..., 0]
+        return samples / float(2 ** (8 * self.width - 1))
+
+    def close(self):
+        self.data._mmap.close()
+
+
+class SoundFileSource:
+    """PCM samples of a FLAC (or other libsndfile) file, decoded block by block"""
+
+    def __init__(self, path):
+        import soundfile
+
+        self.file = soundfile.SoundFile(path)
+        self.sample_rate = self.file.samplerate
+        self.channels = self.file.channels
+        self.frames = self.file.frames
+
+    def read(self, start, stop):
+        self.file.seek(start)
+        return self.file.read(stop - start, dtype='float64', always_2d=True)
+
+    def close(self):
+        self.file.close()
+
+
+def open_source(path):
+    """Open a track for block reads: WAV through a memory map, others through soundfile"""
+    if os.path.splitext(path)[1].lower() == '.wav':
+        return WavSource(path)
+    return SoundFileSource(path)
+
+
+def read_wav_layout(path):
+    """
+    Locate the PCM data of a WAV file
+
+    Returns:
+        dict: sample_rate, channels, sample_width (bytes), float, offset of
+            the first frame and the number of frames
+    """
+    with open(path, 'rb') as f:
+        riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise ValueError('Not a WAV file')
+
+        layout = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError('WAV file has no data chunk')
+            chunk_id, size = struct.unpack('<4sI', header)
+            if chunk_id == b'fmt ':
+                fmt = f.read(size)
+                tag, channels, sample_rate, _, _, bits = struct.unpack('<HHIIHH', fmt[:16])
+                if tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+                    tag = struct.unpack('<H', fmt[24:26])[0]
+                if tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+                    raise ValueError('Only PCM and float WAV files can be processed')
+                layout = {
+                    'sample_rate': sample_rate,
+                    'channels': channels,
+                    'sample_width': bits // 8,
+                    'float': tag == WAVE_FORMAT_IEEE_FLOAT
+                }
+            elif chunk_id == b'data':
+                if layout is None:
+                    raise ValueError('WAV data chunk precedes its format chunk')
+                offset = f.tell()
+                # A truncated file holds fewer frames than its header claims
+                available = min(size, os.path.getsize(path) - offset)
+                layout['offset'] = offset
+                layout['frames'] = available // (layout['channels'] * layout['sample_width'])
+                return layout
+            else:
+                f.seek(size, os.SEEK_CUR)
+            # Chunks are word-aligned
+            if size % 2:
+                f.seek(1, os.SEEK_CUR)
+
+
+class PostProcessor:
+    """
+    Two-pass processing of a finished track
+
+    Pass one reads the file once, collecting K-weighted power and peak
+    level per 100 ms sub-block. Trimming, integrated loudness and the gain
+    that meets the target without exceeding the peak ceiling are computed
+    from those statistics alone. Pass two reads the kept range again, applies
+    gain and fades, resamples and encodes, one block at a time.
+    """
+
+    def process(self, source_path, outputs, options):
+        """
+        Process a track into one or more encoded files
+
+        Args:
+            source_path (str): WAV or FLAC file to read
+            outputs (dict): Format name -> destination path, as for encode_blocks
+            options (dict): Options from normalize_options
+
+        Returns:
+            tuple: (encode_blocks statistics per format, processing report)
+        """
+        source = open_source(source_path)
+        try:
+            start_time = time.perf_counter()
+            stats = self.analyze(source)
+            record_stage('music', 'analyze', time.perf_counter() - start_time)
+
+            start, stop = self._kept_range(source, stats, options)
+            gain_db, loudness = self._gain(stats, start, stop, options)
+            target_rate = options.get('sample_rate', source.sample_rate)
+
+            blocks = self._render(source, start, stop, 10 ** (gain_db / 20), options, target_rate)
+            encoded = encode_blocks(blocks, outputs, target_rate, source.channels)
+        finally:
+            source.close()
+
+        report = {
+            'sample_rate': target_rate,
+            'duration': round((stop - start) / source.sample_rate, 3),
+            'trimmed': {
+                'start': round(start / source.sample_rate, 3),
+                'end': round((source.frames - stop) / source.sample_rate, 3)
+            },
+            'fade_in': options.get('fade_in', 0.0),
+            'fade_out': options.get('fade_out', 0.0),
+            'loudness': loudness,
+            'gain_db': round(gain_db, 2),
+            'analysis_time': round(stats['seconds'], 4)
+        }
+        log_event(logger, 'postprocess.done', source=os.path.basename(source_path), **{
+            key: value for key, value in report.items() if not isinstance(value, dict)
+        })
+        return encoded, report
+
+    def analyze(self, source):
+        """
+        First pass: per-sub-block statistics
+
+        Returns:
+            dict: 'power' (sub-blocks x channels mean square after
+                K-weighting), 'peak' (sub-block sample peak), 'sub_block'
+                (frames per sub-block) and 'seconds' spent
+        """
+        import numpy as np
+
+        start_time = time.perf_counter()
+        sub_block = max(1, round(source.sample_rate * SUB_BLOCK_SECONDS))
+        weighting = k_weighting(np.fft.rfftfreq(sub_block, 1 / source.sample_rate), source.sample_rate)
+        # Parseval over a real FFT: interior bins stand for two conjugate bins
+        weighting[1:(sub_block + 1) // 2] *= 2
+
+        count = -(-source.frames // sub_block)
+        power = np.zeros((count, source.channels))
+        peak = np.zeros(count)
+        per_read = max(1, BLOCK_FRAMES // sub_block) * sub_block
+        for offset in range(0, source.frames, per_read):
+            audio = source.read(offset, min(offset + per_read, source.frames))
+            first = offset // sub_block
+            whole = len(audio) // sub_block
+            if whole:
+                blocks = audio[:whole * sub_block].reshape(whole, sub_block, source.channels)
+                spectrum = np.abs(np.fft.rfft(blocks, axis=1)) ** 2
+                power[first:first + whole] = (spectrum * weighting[:, np.newaxis]).sum(axis=1) / sub_block ** 2
+                peak[first:first + whole] = np.abs(blocks).max(axis=(1, 2))
+            if len(audio) > whole * sub_block:
+                # A short final sub-block is measured unweighted
+                tail = audio[whole * sub_block:]
+                power[first + whole] = (tail ** 2).mean(axis=0)
+                peak[first + whole] = np.abs(tail).max()
+
+        return {'power': power, 'peak': peak, 'sub_block': sub_block,
+                'seconds': time.perf_counter() - start_time}
+
+    def _kept_range(self, source, stats, options):
+        """Frames [start, stop) left after fixed and silence trimming"""
+        start = min(source.frames, round(options.get('trim_start', 0.0) * source.sample_rate))
+        stop = max(start, source.frames - round(options.get('trim_end', 0.0) * source.sample_rate))
+
+        if options.get('trim_silence') and stop > start:
+            threshold = 10 ** (SILENCE_THRESHOLD / 20)
+            sub_block = stats['sub_block']
+            loud = [index for index in range(start // sub_block, -(-stop // sub_block))
+                    if stats['peak'][index] > threshold]
+            if not loud:
+                return start, start
+            # Sub-block statistics find the edges; the sub-blocks there are
+            # re-read to place them on the exact frame
+            first = max(start, loud[0] * sub_block)
+            last = min(stop, (loud[-1] + 1) * sub_block)
+            start = first + self._first_loud(source.read(first, min(last, first + sub_block)), threshold)
+            tail_start = max(start, last - sub_block)
+            stop = tail_start + self._last_loud(source.read(tail_start, last), threshold)
+        return start, stop
+
+    def _gain(self, stats, start, stop, options):
+        """
+        Gain that brings the kept range to the loudness target
+
+        Returns:
+            tuple: (gain in dB, loudness report or None)
+        """
+        if 'loudness' not in options or stop <= start:
+            return 0.0, None
+
+        sub_block = stats['sub_block']
+        power = stats['power'][start // sub_block:-(-stop // sub_block)]
+        peak = float(stats['peak'][start // sub_block:-(-stop // sub_block)].max())
+        measured = integrated_loudness(power)
+        if measured is None:
+            # Silent: nothing to normalize
+            return 0.0, {'measured': None, 'target': options['loudness'], 'peak_limited': False}
+
+        gain_db = options['loudness'] - measured
+        peak_limited = False
+        if peak > 0:
+            headroom = options['peak_ceiling'] - 20 * math.log10(peak)
+            if gain_db > headroom:
+                gain_db, peak_limited = headroom, True
+        return gain_db, {
+            'measured': round(measured, 2),
+            'target': options['loudness'],
+            'output': round(measured + gain_db, 2),
+            'peak_limited': peak_limited
+        }
+
+    def _render(self, source, start, stop, gain, options, target_rate):
+        """Second pass: yield processed, resampled blocks of the kept range"""
+        import numpy as np
+
+        length = stop - start
+        fade_in = min(length, round(options.get('fade_in', 0.0) * source.sample_rate))
+        fade_out = min(length, round(options.get('fade_out', 0.0) * source.sample_rate))
+        resampler = Resampler(source.sample_rate, target_rate) if target_rate != source.sample_rate else None
+
+        for offset in range(start, stop, BLOCK_FRAMES):
+            audio = source.read(offset, min(offset + BLOCK_FRAMES, stop)) * gain
+            position = np.arange(offset - start, offset - start + len(audio))
+            envelope = np.ones(len(audio))
+            if fade_in:
+                envelope *= _fade_curve(np.clip(position / fade_in, 0.0, 1.0))
+            if fade_out:
+                envelope *= _fade_curve(np.clip((length - position) / fade_out, 0.0, 1.0))
+            audio *= envelope[:, np.newaxis]
+            np.clip(audio, -1.0, 1.0, out=audio)
+            yield resampler.process(audio) if resampler else audio
+
+        if resampler:
+            yield resampler.flush()
+
+    def _first_loud(self, audio, threshold):
+        above = (abs(audio) > threshold).any(axis=1).nonzero()[0]
+        return int(above[0]) if len(above) else len(audio)
+
+    def _last_loud(self, audio, threshold):
+        above = (abs(audio) > threshold).any(axis=1).nonzero()[0]
+        return int(above[-1]) + 1 if len(above) else 0
+
+
+def integrated_loudness(power):
+    """
+    Gated integrated loudness from sub-block statistics
+
+    Args:
+        power (ndarray): Mean square per 100 ms sub-block and channel,
+            after K-weighting
+
+    Returns:
+        float: Loudness in LUFS, or None if everything is below the gates
+    """
+    import numpy as np
+
+    if len(power) < GATE_SUB_BLOCKS:
+        # Shorter than one gating block: measure it whole
+        blocks = power.mean(axis=0, keepdims=True)
+    else:
+        windows = np.lib.stride_tricks.sliding_window_view(power, GATE_SUB_BLOCKS, axis=0)
+        blocks = windows.mean(axis=-1)
+    # Channel weights are 1.0 for left and right
+    total = blocks.sum(axis=1)
+    with np.errstate(divide='ignore'):
+        loudness = -0.691 + 10 * np.log10(total)
+
+    gated = total[loudness > ABSOLUTE_GATE]
+    if not len(gated):
+        return None
+    relative = -0.691 + 10 * math.log10(gated.mean()) + RELATIVE_GATE
+    gated = total[(loudness > ABSOLUTE_GATE) & (loudness > relative)]
+    return -0.691 + 10 * math.log10(gated.mean())
+
+
+def k_weighting(frequencies, sample_rate):
+    """
+    Power response of the BS.1770 K-weighting filter (high shelf, then
+    high pass) at the given frequencies, designed for sample_rate
+
+    Returns:
+        ndarray: |H(f)|^2 per frequency
+    """
+    import numpy as np
+
+    z = np.exp(-2j * np.pi * np.asarray(frequencies) / sample_rate)
+
+    # Stage 1: +4 dB shelf above ~1.7 kHz modelling the head
+    k = math.tan(math.pi * 1681.974450955533 / sample_rate)
+    q = 0.7071752369554196
+    gain_high = 10 ** (3.999843853973347 / 20)
+    gain_band = gain_high ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = ((gain_high + gain_band * k / q + k * k) + 2 * (k * k - gain_high) * z
+             + (gain_high - gain_band * k / q + k * k) * z ** 2) / a0
+    shelf /= 1 + 2 * (k * k - 1) / a0 * z + (1 - k / q + k * k) / a0 * z ** 2
+
+    # Stage 2: high pass at ~38 Hz
+    k = math.tan(math.pi * 38.13547087602444 / sample_rate)
+    q = 0.5003270373238773
+    a0 = 1 + k / q + k * k
+    high_pass = (1 - 2 * z + z ** 2)
+    high_pass /= 1 + 2 * (k * k - 1) / a0 * z + (1 - k / q + k * k) / a0 * z ** 2
+
+    return np.abs(shelf * high_pass) ** 2
+
+
+def _fade_curve(progress):
+    """Raised-cosine gain for progress 0 (silent) to 1 (full level)"""
+    import numpy as np
+
+    return 0.5 - 0.5 * np.cos(np.pi * progress)
@@ -0,0 +1,566 @@
+"""
+Rate Limit Service
+Client-side request and token budgets per model, with priority queueing
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from services.metrics_service import get_logger, log_event, metrics
+
+logger = get_logger('ratelimit')
+
+# Lower runs first when a model's budget is short
+PRIORITIES = {'interactive': 0, 'batch': 1, 'background': 2}
+
+# Starting budgets per model: (requests per minute, tokens per minute), 0 for
+# no limit. Overridden by RATE_LIMIT_<MODEL>_RPM/_TPM, then by the limits
+# the API reports in its x-ratelimit-* response headers.
+DEFAULT_LIMITS = {
+    'gpt-4.1-mini': (500, 200000),
+    'dall-e-3': (7, 0),
+    'tts-1-hd': (50, 0)
+}
+
+# Durations in x-ratelimit-reset-* headers, e.g. "6m0s", "20ms"
+DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+
+_priority = contextvars.ContextVar('ratelimit_priority', default='interactive')
+
+
+class RateLimitedError(Exception):
+    """Raised instead of queueing when a request would wait too long for budget"""
+
+    def __init__(self, model, retry_after):
+        super().__init__(f"Rate limit for {model} reached; retry in {retry_after:.0f}s")
+        self.model = model
+        self.retry_after = retry_after
+
+
+class _Bucket:
+    """Requests and tokens available to one model, refilled continuously"""
+
+    def __init__(self, model, rpm, tpm, headroom):
+        self.model = model
+        self.headroom = headroom
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = self.capacity(rpm)
+        self.tokens = self.capacity(tpm)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.waiting = []  # heap of (priority, sequence)
+
+    def set_limits(self, rpm=None, tpm=None):
+        if rpm:
+            self.rpm = rpm
+            self.requests = min(self.requests, self.capacity(rpm))
+        if tpm:
+            self.tpm = tpm
+            self.tokens = min(self.tokens, self.capacity(tpm))
+
+    def refill(self, now):
+        elapsed = now - self.updated
+        self.updated = now
+        if self.rpm:
+            self.requests = min(self.capacity(self.rpm), self.requests + elapsed * self.capacity(self.rpm) / 60)
+        if self.tpm:
+            self.tokens = min(self.capacity(self.tpm), self.tokens + elapsed * self.capacity(self.tpm) / 60)
+
+    def wait_for(self, cost, now):
+        """Seconds until one request of cost tokens fits the budget"""
+        wait = max(0.0, self.paused_until - now)
+        if self.rpm and self.requests < 1:
+            wait = max(wait, (1 - self.requests) * 60 / self.capacity(self.rpm))
+        if self.tpm:
+            # A request larger than the whole budget waits for a full bucket
+            cost = min(cost, self.capacity(self.tpm))
+            if self.tokens < cost:
+                wait = max(wait, (cost - self.tokens) * 60 / self.capacity(self.tpm))
+        return wait
+
+    def take(self, cost):
+        if self.rpm:
+            self.requests -= 1
+        if self.tpm:
+            self.tokens -= min(cost, self.capacity(self.tpm))
+
+    def capacity(self, limit):
+        # At least one request must fit, or a tiny quota would never admit any
+        return max(1.0, limit * self.headroom) if limit else 0.0
+
+
+class RateLimiter:
+    """
+    Keeps each model's traffic under its requests/tokens-per-minute quota
+
+    Callers reserve budget before each API call. While a model's budget is
+    short they queue in priority order (interactive before batch before
+    background jobs); a call that would wait longer than its priority's
+    max_wait is shed with RateLimitedError so the route can answer 429
+    instead of piling onto the provider. Budgets follow the limits and
+    remaining counts the API reports, and a 429 pauses the model until its
+    reset time.
+    """
+
+    def __init__(self, limits=None, headroom=None, max_wait=None, background_max_wait=None):
+        """
+        Args:
+            limits (dict): Model -> (rpm, tpm); defaults to DEFAULT_LIMITS
+                with RATE_LIMIT_<MODEL>_RPM/_TPM overrides
+            headroom (float): Fraction of each quota to use (RATE_LIMIT_HEADROOM)
+            max_wait (float): Seconds interactive and batch calls may queue
+                before being shed (RATE_LIMIT_MAX_WAIT)
+            background_max_wait (float): The same for background jobs
+                (RATE_LIMIT_BACKGROUND_MAX_WAIT)
+        """
+        self.limits = limits or {
+            model: _env_limits(model, rpm, tpm) for model, (rpm, tpm) in DEFAULT_LIMITS.items()
+        }
+        self.headroom = headroom or float(os.getenv('RATE_LIMIT_HEADROOM', 0.95))
+        interactive_wait = max_wait or float(os.getenv('RATE_LIMIT_MAX_WAIT', 20))
+        self.max_wait = {
+            'interactive': interactive_wait,
+            'batch': interactive_wait,
+            'background': background_max_wait or float(os.getenv('RATE_LIMIT_BACKGROUND_MAX_WAIT', 600))
+        }
+        self.buckets = {}
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+
+    def acquire(self, model, tokens=0, priority=None):
+        """
+        Block until the model has budget for one request of tokens tokens
+
+        Args:
+            model (str): Model name, e.g. 'gpt-4.1-mini'
+            tokens (int): Estimated tokens the request counts against TPM
+            priority (str): Key of PRIORITIES; defaults to the current context's
+
+        Raises:
+            RateLimitedError: If the wait would exceed the priority's max_wait
+        """
+        priority = priority or _priority.get()
+        start = time.monotonic()
+        ticket = self._enqueue(model, priority)
+        try:
+            with self.condition:
+                while True:
+                    wait = self._try_take(model, ticket, tokens, priority, start)
+                    if wait == 0:
+                        break
+                    self.condition.wait(min(wait, 1.0))
+        finally:
+            self._dequeue(model, ticket)
+        self._record_wait(model, priority, time.monotonic() - start)
+
+    async def acquire_async(self, model, tokens=0, priority=None):
+        """Async variant of acquire; waits on the event loop"""
+        priority = priority or _priority.get()
+        start = time.monotonic()
+        ticket = self._enqueue(model, priority)
+        try:
+            while True:
+                with self.condition:
+                    wait = self._try_take(model, ticket, tokens, priority, start)
+                if wait == 0:
+                    break
+                await asyncio.sleep(min(wait, 0.25))
+        finally:
+            self._dequeue(model, ticket)
+        self._record_wait(model, priority, time.monotonic() - start)
+
+    def observe_headers(self, model, headers):
+        """
+        Adapt a model's budget to the x-ratelimit-* headers of a response
+
+        Args:
+            model (str): Model the request was for
+            headers (Mapping): Response headers (case-insensitive)
+        """
+        limit_requests = _int(headers.get('x-ratelimit-limit-requests'))
+        limit_tokens = _int(headers.get('x-ratelimit-limit-tokens'))
+        remaining_requests = _int(headers.get('x-ratelimit-remaining-requests'))
+        remaining_tokens = _int(headers.get('x-ratelimit-remaining-tokens'))
+        if None in (limit_requests, remaining_requests) and None in (limit_tokens, remaining_tokens):
+            return
+
+        with self.condition:
+            bucket = self._bucket(model)
+            bucket.refill(time.monotonic())
+            bucket.set_limits(limit_requests, limit_tokens)
+            # Other clients share the quota; never assume more than the API has left
+            if remaining_requests is not None and bucket.rpm:
+                bucket.requests = min(bucket.requests, remaining_requests)
+            if remaining_tokens is not None and bucket.tpm:
+                bucket.tokens = min(bucket.tokens, remaining_tokens)
+            self.condition.notify_all()
+
+    def observe_rejection(self, model, retry_after=None, headers=None):
+        """
+        Pause a model after a 429 until the API says it will accept requests
+
+        Args:
+            model (str): Model the request was for
+            retry_after (float): Seconds from Retry-After, if known
+            headers (Mapping): Response headers, for x-ratelimit-reset-*
+        """
+        if retry_after is None and headers is not None:
+            retry_after = _float(headers.get('retry-after'))
+            if retry_after is None:
+                resets = [_duration(headers.get(name)) for name in
+                          ('x-ratelimit-reset-requests', 'x-ratelimit-reset-tokens')]
+                resets = [reset for reset in resets if reset is not None]
+                retry_after = max(resets) if resets else None
+        retry_after = retry_after if retry_after is not None else 1.0
+
+        with self.condition:
+            bucket = self._bucket(model)
+            bucket.paused_until = max(bucket.paused_until, time.monotonic() + retry_after)
+            bucket.requests = min(bucket.requests, 0)
+        metrics.count('arcitek_ratelimit_rejections_total', help='429 responses from the API', model=model)
+        log_event(logger, 'ratelimit.rejected', model=model, retry_after=round(retry_after, 3))
+
+    def stats(self):
+        """
+        Returns:
+            dict: Model -> limits, available budget and queued calls
+        """
+        now = time.monotonic()
+        with self.condition:
+            stats = {}
+            for model, bucket in self.buckets.items():
+                bucket.refill(now)
+                stats[model] = {
+                    'rpm': bucket.rpm or None,
+                    'tpm': bucket.tpm or None,
+                    'requests_available': round(bucket.requests, 2) if bucket.rpm else None,
+                    'tokens_available': round(bucket.tokens) if bucket.tpm else None,
+                    'paused_for': round(max(0.0, bucket.paused_until - now), 3),
+                    'queued': len(bucket.waiting)
+                }
+            return stats
+
+    def _enqueue(self, model, priority):
+        ticket = (PRIORITIES.get(priority, 0), next(self.sequence))
+        with self.condition:
+            heapq.heappush(self._bucket(model).waiting, ticket)
+        return ticket
+
+    def _dequeue(self, model, ticket):
+        with self.condition:
+            waiting = self.buckets[model].waiting
+            if ticket in waiting:
+                waiting.remove(ticket)
+                heapq.heapify(waiting)
+            self.condition.notify_all()
+
+    def _try_take(self, model, ticket, tokens, priority, start):
+        """
+        Take budget if ticket is first in line and it fits (condition held)
+
+        Returns:
+            float: 0 if taken, otherwise seconds worth waiting before retrying
+
+        Raises:
+            RateLimitedError: If the caller would wait past its max_wait
+        """
+        bucket = self.buckets[model]
+        now = time.monotonic()
+        bucket.refill(now)
+        wait = bucket.wait_for(tokens, now)
+
+        if bucket.waiting[0] == ticket and wait == 0:
+            bucket.take(tokens)
+            return 0
+
+        # Callers ahead in line will use budget first; estimate from their
+        # count as well as this caller's own deficit
+        ahead = sum(1 for other in bucket.waiting if other < ticket)
+        if bucket.rpm:
+            wait = max(wait, ahead * 60 / bucket.capacity(bucket.rpm))
+        if now - start + wait > self.max_wait.get(priority, self.max_wait['interactive']):
+            metrics.count('arcitek_ratelimit_shed_total', help='Calls rejected before reaching the API',
+                          model=model, priority=priority)
+            log_event(logger, 'ratelimit.shed', model=model, priority=priority, wait=round(wait, 3), queued=ahead)
+            raise RateLimitedError(model, wait)
+        return max(wait, 0.01)
+
+    def _bucket(self, model):
+        """Return a model's bucket, creating it on first use (condition held)"""
+        if model not in self.buckets:
+            rpm, tpm = self.limits.get(model) or _env_limits(model, 0, 0)
+            self.buckets[model] = _Bucket(model, rpm, tpm, self.headroom)
+        return self.buckets[model]
+
+    def _record_wait(self, model, priority, seconds):
+        metrics.observe('arcitek_ratelimit_wait_seconds', seconds,
+                        help='Time calls queued for rate-limit budget', model=model, priority=priority)
+
+
+class ScheduledClient:
+    """
+    Wraps an OpenAI (or fake) client so every generate/create call first
+    passes its model's circuit breaker, then reserves budget from the
+    RateLimiter
+
+    Resource namespaces (images, chat.completions, audio.speech) are
+    wrapped on access; everything else passes through to the client.
+    """
+
+    NAMESPACES = ('images', 'chat', 'completions', 'audio', 'speech')
+    CALLS = ('generate', 'create')
+
+    def __init__(self, target, limiter, is_async=False, breakers=None):
+        self._target = target
+        self._limiter = limiter
+        self._is_async = is_async
+        self._breakers = breakers
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if name in self.NAMESPACES:
+            return ScheduledClient(value, self._limiter, self._is_async, self._breakers)
+        if name in self.CALLS:
+            return self._wrap(value)
+        return value
+
+    def _wrap(self, call):
+        limiter = self._limiter
+        breakers = self._breakers or _NO_BREAKERS
+
+        # An open circuit fails the call before it queues for budget
+        if self._is_async:
+            async def scheduled(**kwargs):
+                model = kwargs.get('model')
+                breaker = breakers.get(model)
+                breaker.before_call()
+                try:
+                    await limiter.acquire_async(model, estimate_tokens(kwargs))
+                except BaseException:
+                    breaker.release()
+                    raise
+                awaited = awaited_tokens(kwargs)
+                ticket = breaker.start(awaited)
+                try:
+                    response = await call(**_with_timeout(kwargs, breaker, awaited))
+                except Exception as e:
+                    _observe_error(limiter, model, e)
+                    breaker.failure(ticket, e)
+                    raise
+                except BaseException:
+                    breaker.release(ticket)
+                    raise
+                breaker.success(ticket)
+                return response
+        else:
+            def scheduled(**kwargs):
+                model = kwargs.get('model')
+                breaker = breakers.get(model)
+                breaker.before_call()
+                try:
+                    limiter.acquire(model, estimate_tokens(kwargs))
+                except BaseException:
+                    breaker.release()
+                    raise
+                awaited = awaited_tokens(kwargs)
+                ticket = breaker.start(awaited)
+                try:
+                    response = call(**_with_timeout(kwargs, breaker, awaited))
+                except Exception as e:
+                    _observe_error(limiter, model, e)
+                    breaker.failure(ticket, e)
+                    raise
+                except BaseException:
+                    breaker.release(ticket)
+                    raise
+                breaker.success(ticket)
+                return response
+        return scheduled
+
+
+class _NoBreaker:
+    """Stands in for a CircuitBreaker when a client has none"""
+
+    def get(self, model):
+        return self
+
+    def before_call(self):
+        pass
+
+    def start(self, completion_tokens=0):
+        return None
+
+    def call_timeout(self, completion_tokens=0):
+        return None
+
+    def success(self, ticket):
+        pass
+
+    def failure(self, ticket, error):
+        pass
+
+    def release(self, ticket=None):
+        pass
+
+
+def _with_timeout(kwargs, breaker, completion_tokens):
+    """
+    Bound each request by the breaker's call timeout for its size, so a
+    hanging model frees its callers instead of holding them for the
+    client's full read timeout; an explicit timeout is kept
+    """
+    timeout = breaker.call_timeout(completion_tokens)
+    if timeout is None or 'timeout' in kwargs:
+        return kwargs
+    return dict(kwargs, timeout=timeout)
+
+
+_NO_BREAKERS = _NoBreaker()
+
+
+def estimate_tokens(kwargs):
+    """
+    Tokens a request counts against TPM: prompt (about 4 characters per
+    token) plus the completion budget for every choice
+
+    Returns:
+        int: Estimated tokens; 0 for non-chat requests
+    """
+    messages = kwargs.get('messages')
+    if not messages:
+        return 0
+    prompt_chars = sum(len(message.get('content') or '') for message in messages)
+    return prompt_chars // 4 + (kwargs.get('max_tokens') or 0) * (kwargs.get('n') or 1)
+
+
+def awaited_tokens(kwargs):
+    """
+    Completion tokens a call waits for before it returns: max_tokens for
+    every choice, or none for a stream, which returns at its first chunk
+
+    Returns:
+        int: Tokens to extend the call's slow-call limit and timeout by
+    """
+    if kwargs.get('stream'):
+        return 0
+    return (kwargs.get('max_tokens') or 0) * (kwargs.get('n') or 1)
+
+
+def response_hook(limiter):
+    """
+    httpx response hook that feeds every API response's rate-limit headers
+    to limiter, including attempts the SDK retries
+    """
+    def hook(response):
+        model = _request_model(response.request)
+        if not model:
+            return
+        if response.status_code == 429:
+            limiter.observe_rejection(model, headers=response.headers)
+        else:
+            limiter.observe_headers(model, response.headers)
+    return hook
+
+
+def async_response_hook(limiter):
+    hook = response_hook(limiter)
+
+    async def async_hook(response):
+        hook(response)
+    return async_hook
+
+
+@contextlib.contextmanager
+def priority(level):
+    """
+    Run API calls made in this context (and this thread) at level
+
+    Args:
+        level (str): Key of PRIORITIES
+    """
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    """Priority of API calls made in this context"""
+    return _priority.get()
+
+
+def submit_with_priority(executor, fn, *args):
+    """
+    Submit fn to a thread pool so its API calls keep this context's priority
+
+    Pool threads do not inherit context variables; each task runs in its
+    own copy of the caller's context.
+
+    Returns:
+        Future: Completes with fn's return value
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def _observe_error(limiter, model, error):
+    # 429s the API sent already reached response_hook, retried ones included;
+    # only those raised without a response (the fake client's) count here
+    if getattr(error, 'status_code', None) == 429 and getattr(error, 'response', None) is None:
+        limiter.observe_rejection(model)
+
+
+def _request_model(request):
+    try:
+        return json.loads(request.content).get('model')
+    except (ValueError, AttributeError, TypeError):
+        return None
+
+
+def _env_limits(model, rpm, tpm):
+    name = re.sub(r'[^A-Z0-9]+', '_', model.upper())
+    return (int(os.getenv(f'RATE_LIMIT_{name}_RPM', rpm)), int(os.getenv(f'RATE_LIMIT_{name}_TPM', tpm)))
+
+
+def _duration(value):
+    """Parse an x-ratelimit-reset-* duration such as '1m30s' into seconds"""
+    if not value:
+        return None
+    units = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+    parts = DURATION_PART.findall(value)
+    return sum(float(amount) * units[unit] for amount, unit in parts) if parts else None
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    """Return the process-wide RateLimiter"""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+        return _limiter
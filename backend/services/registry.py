@@ -0,0 +1,121 @@
+"""
+Service Registry
+Builds services on first use, so a worker only pays for the routes it serves
+"""
+
+import importlib
+import threading
+import time
+from services.metrics_service import get_logger, log_event, record_stage
+
+logger = get_logger('registry')
+
+
+class ServiceRegistry:
+    """
+    Named, lazily constructed service singletons
+
+    Services are registered as 'module:Class' strings, so neither the
+    module nor its heavy dependencies (PIL, NumPy, the OpenAI SDK) are
+    imported until the first request that needs them.
+    """
+
+    def __init__(self):
+        self.factories = {}
+        self.instances = {}
+        self.timings = {}
+        self.locks = {}
+
+    def register(self, name, target):
+        """
+        Args:
+            name (str): Service name, e.g. 'image'
+            target (str or callable): 'module:Class' imported on first use,
+                or a zero-argument factory
+        """
+        self.factories[name] = target
+        self.locks[name] = threading.Lock()
+
+    def get(self, name):
+        """
+        Return a service, constructing it on first use
+
+        Raises:
+            KeyError: If no service is registered under name
+        """
+        instance = self.instances.get(name)
+        if instance is not None:
+            return instance
+        if name not in self.factories:
+            raise KeyError(f"Unknown service: {name}")
+
+        # One lock per service, so building the image service does not
+        # hold up the first story request
+        with self.locks[name]:
+            if name not in self.instances:
+                self.instances[name] = self._build(name)
+            return self.instances[name]
+
+    def warm(self, names):
+        """
+        Construct services ahead of traffic and run their warm_up() hooks
+
+        Args:
+            names (iterable): Service names; 'all' warms every registered one
+
+        Returns:
+            dict: Service name -> {'import', 'init', 'warm_up'} seconds
+        """
+        names = list(self.factories) if names == 'all' else list(names)
+        for name in names:
+            instance = self.get(name)
+            if hasattr(instance, 'warm_up') and 'warm_up' not in self.timings[name]:
+                start = time.perf_counter()
+                instance.warm_up()
+                self.timings[name]['warm_up'] = time.perf_counter() - start
+                record_stage('startup', f'{name}_warm_up', self.timings[name]['warm_up'])
+                log_event(logger, 'service.warmed', service=name,
+                          seconds=round(self.timings[name]['warm_up'], 4))
+        return {name: dict(self.timings[name]) for name in names}
+
+    def loaded(self):
+        """Names of services constructed so far"""
+        return sorted(self.instances)
+
+    def shutdown(self):
+        """Release worker pools held by constructed services"""
+        for instance in list(self.instances.values()):
+            if hasattr(instance, 'shutdown'):
+                instance.shutdown()
+
+    def _build(self, name):
+        target = self.factories[name]
+        start = time.perf_counter()
+        if isinstance(target, str):
+            module_name, _, attribute = target.partition(':')
+            factory = getattr(importlib.import_module(module_name), attribute)
+        else:
+            factory = target
+        imported = time.perf_counter()
+        instance = factory()
+        built = time.perf_counter()
+
+        self.timings[name] = {'import': imported - start, 'init': built - imported}
+        record_stage('startup', f'{name}_import', imported - start)
+        record_stage('startup', f'{name}_init', built - imported)
+        log_event(logger, 'service.loaded', service=name,
+                  import_seconds=round(imported - start, 4), init_seconds=round(built - imported, 4))
+        return instance
+
+
+def parse_service_names(value):
+    """
+    Parse a WARM_SERVICES style list
+
+    Returns:
+        'all', or a list of names from a comma-separated string
+    """
+    value = (value or '').strip()
+    if value.lower() == 'all':
+        return 'all'
+    return [name.strip() for name in value.split(',') if name.strip()]
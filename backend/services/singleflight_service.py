@@ -0,0 +1,363 @@
+"""
+Single-Flight Service
+Coalesces concurrent identical generations into one upstream call
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from services.metrics_service import get_logger, log_event, metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: coalesce within a process only
+    fcntl = None
+
+logger = get_logger('singleflight')
+
+LOCK_DIR = os.path.join(os.path.dirname(__file__), '..', 'outputs', '.locks')
+
+
+class LocalLockBackend:
+    """No cross-process coordination; each worker generates on its own"""
+
+    @contextlib.contextmanager
+    def lock(self, key):
+        yield
+
+    @contextlib.asynccontextmanager
+    async def lock_async(self, key):
+        yield
+
+    def publish(self, key, result):
+        pass
+
+    def published(self, key):
+        return None
+
+
+class FileLockBackend:
+    """
+    One flock()ed file per key, shared by every worker on the host
+
+    The worker holding the lock generates; the others wait for it, then
+    find the result in the shared ResultCache. Results the cache does not
+    keep, such as demo fallbacks during an outage, are instead published
+    next to the lock for result_ttl seconds, so waiting workers take the
+    same fallback instead of each retrying the upstream call in turn.
+    Expired results, and lock files left by workers that died holding
+    them, are removed at most once per result_ttl.
+    """
+
+    def __init__(self, directory=LOCK_DIR, timeout=None, poll_interval=0.05, result_ttl=None):
+        """
+        Args:
+            directory (str): Where lock files are created
+            timeout (float): Seconds to wait for another worker before
+                generating anyway
+            poll_interval (float): Seconds between lock attempts
+            result_ttl (float): Seconds a published result is shared
+                (SINGLEFLIGHT_RESULT_TTL)
+        """
+        self.directory = directory
+        self.timeout = timeout or float(os.getenv('SINGLEFLIGHT_LOCK_TIMEOUT', 600))
+        self.poll_interval = poll_interval
+        self.result_ttl = result_ttl or float(os.getenv('SINGLEFLIGHT_RESULT_TTL', 30))
+        self.swept = time.monotonic()
+        self.sweep_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @contextlib.contextmanager
+    def lock(self, key):
+        deadline = time.monotonic() + self.timeout
+        fd = self._try_acquire(key)
+        while fd is None and time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            fd = self._try_acquire(key)
+        try:
+            yield
+        finally:
+            self._release(key, fd)
+
+    @contextlib.asynccontextmanager
+    async def lock_async(self, key):
+        deadline = time.monotonic() + self.timeout
+        fd = self._try_acquire(key)
+        while fd is None and time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            fd = self._try_acquire(key)
+        try:
+            yield
+        finally:
+            self._release(key, fd)
+
+    def publish(self, key, result):
+        """Share the leader's result with workers waiting on key (lock held)"""
+        path = self._result_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(result, f)
+            os.replace(tmp_path, path)
+        except (TypeError, ValueError, OSError) as e:
+            log_event(logger, 'singleflight.publish_failed', key=key[:16], error=str(e))
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+
+    def published(self, key):
+        """
+        The result another worker published for key (lock held)
+
+        Returns:
+            The result, or None if there is none younger than result_ttl
+        """
+        path = self._result_path(key)
+        try:
+            if time.time() - os.stat(path).st_mtime > self.result_ttl:
+                os.remove(path)
+                return None
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def sweep(self):
+        """
+        Remove published results older than result_ttl, and lock files
+        nobody holds (their worker died before releasing them)
+
+        Returns:
+            int: Files removed
+        """
+        removed = 0
+        cutoff = time.time() - self.result_ttl
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return 0
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                if os.stat(path).st_mtime > cutoff:
+                    continue
+                if name.endswith('.lock'):
+                    key = name[:-len('.lock')]
+                    fd = self._try_acquire(key)
+                    if fd is None:
+                        continue  # Held by a live worker
+                    self._unlock(key, fd)
+                else:
+                    os.remove(path)
+                removed += 1
+            except OSError:
+                continue
+        if removed:
+            log_event(logger, 'singleflight.swept', files=removed)
+        return removed
+
+    def _try_acquire(self, key):
+        """
+        Take the key's lock without blocking
+
+        Returns:
+            int: Locked file descriptor, or None if another worker holds it
+        """
+        path = self._path(key)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        # The previous holder unlinks the file on release; a lock on that
+        # unlinked file would not exclude anyone, so start over
+        try:
+            if os.fstat(fd).st_ino != os.stat(path).st_ino:
+                os.close(fd)
+                return self._try_acquire(key)
+        except FileNotFoundError:
+            os.close(fd)
+            return self._try_acquire(key)
+        return fd
+
+    def _release(self, key, fd):
+        if fd is None:
+            log_event(logger, 'singleflight.lock_timeout', key=key[:16], seconds=self.timeout)
+        else:
+            self._unlock(key, fd)
+        self._maybe_sweep()
+
+    def _unlock(self, key, fd):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+    def _maybe_sweep(self):
+        """Sweep if result_ttl has passed since the last sweep"""
+        with self.sweep_lock:
+            if time.monotonic() - self.swept < self.result_ttl:
+                return
+            self.swept = time.monotonic()
+        self.sweep()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.lock")
+
+    def _result_path(self, key):
+        return os.path.join(self.directory, f"{key}.result")
+
+
+# SINGLEFLIGHT_BACKEND -> lock backend class
+BACKENDS = {
+    'local': LocalLockBackend,
+    'file': FileLockBackend
+}
+
+
+class SingleFlight:
+    """
+    Runs one generation per key at a time and shares its result
+
+    Callers in this process that arrive while a key is in flight wait for
+    the same call instead of starting their own. The backend extends this
+    across processes: whoever wins its lock generates, and the rest re-check
+    the cache, then the result the winner published if it could not be
+    stored, once it is released.
+    """
+
+    def __init__(self, service, backend=None):
+        """
+        Args:
+            service (str): Service name for metrics, e.g. 'image'
+            backend: Lock backend; defaults to SINGLEFLIGHT_BACKEND
+                ('file' where flock() is available, else 'local')
+        """
+        self.service = service
+        self.backend = backend or get_backend()
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, fn, lookup=None):
+        """
+        Return fn()'s result, running it at most once across concurrent callers
+
+        Args:
+            key (str): Normalized request key, e.g. from ResultCache.key
+            fn (callable): Produces the result
+            lookup (callable): Returns the stored result for key, or None;
+                checked once the cross-process lock is held
+
+        Returns:
+            The result (a shallow copy for callers that joined an in-flight call)
+        """
+        future, leader = self._join(key)
+        if not leader:
+            self._count('shared')
+            return _copy(future.result())
+
+        try:
+            with self.backend.lock(key):
+                result = lookup() if lookup else None
+                if result is None:
+                    # Fallbacks are not cached, but the last worker's is shared
+                    result = self.backend.published(key)
+                if result is not None:
+                    self._count('remote')
+                else:
+                    self._count('leader')
+                    result = fn()
+                    # Waiting workers find a stored result themselves
+                    if lookup is None or lookup() is None:
+                        self.backend.publish(key, result)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result=result)
+        return result
+
+    async def do_async(self, key, fn, lookup=None):
+        """
+        Async variant of do; fn is a coroutine function and lookup runs
+        in the loop's executor
+
+        Sync and async callers of the same key share one call.
+        """
+        future, leader = self._join(key)
+        if not leader:
+            self._count('shared')
+            return _copy(await asyncio.wrap_future(future))
+
+        try:
+            async with self.backend.lock_async(key):
+                result = await asyncio.to_thread(lookup) if lookup else None
+                if result is None:
+                    result = await asyncio.to_thread(self.backend.published, key)
+                if result is not None:
+                    self._count('remote')
+                else:
+                    self._count('leader')
+                    result = await fn()
+                    if lookup is None or await asyncio.to_thread(lookup) is None:
+                        await asyncio.to_thread(self.backend.publish, key, result)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result=result)
+        return result
+
+    def in_flight(self):
+        with self.lock:
+            return len(self.calls)
+
+    def _join(self, key):
+        """
+        Returns:
+            tuple: (Future for the key's call, True if the caller must run it)
+        """
+        with self.lock:
+            if key in self.calls:
+                return self.calls[key], False
+            future = Future()
+            self.calls[key] = future
+            return future, True
+
+    def _finish(self, key, future, result=None, error=None):
+        with self.lock:
+            del self.calls[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _count(self, outcome):
+        metrics.count('arcitek_singleflight_total',
+                      help='Generations by coalescing outcome (leader ran it, shared in-process, '
+                           'remote from another worker)',
+                      service=self.service, outcome=outcome)
+
+
+def _copy(result):
+    # Callers may add keys to their result (e.g. a stream); keep them apart
+    return dict(result) if isinstance(result, dict) else result
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Return the process-wide lock backend named by SINGLEFLIGHT_BACKEND"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            name = os.getenv('SINGLEFLIGHT_BACKEND', 'file' if fcntl else 'local')
+            if name not in BACKENDS:
+                raise ValueError(f"SINGLEFLIGHT_BACKEND must be one of: {', '.join(BACKENDS)}")
+            _backend = BACKENDS[name]()
+        return _backend
@@ -0,0 +1,448 @@
+"""
+Storage Service
+Lifecycle of generated outputs: sharded layout, usage index, quotas and TTLs
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from services.metrics_service import get_logger, log_event, metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: one process per outputs tree
+    fcntl = None
+
+logger = get_logger('storage')
+
+OUTPUT_ROOT = os.path.join(os.path.dirname(__file__), '..', 'outputs')
+
+# Top-level output directories, one per artifact category
+CATEGORIES = ('images', 'music', 'stories')
+
+# Default byte budget across all categories (5 GiB)
+DEFAULT_MAX_BYTES = 5 * 1024**3
+
+# Default idle time before an output expires (30 days)
+DEFAULT_TTL = 30 * 24 * 3600
+
+# Index writes from register/touch are batched at most this often (seconds)
+SAVE_INTERVAL = 10
+
+
+class JsonIndex:
+    """
+    A JSON object on disk that several worker processes update
+
+    Each process keeps its own copy and tracks the keys it changed or
+    removed since it last wrote. merge() applies those on top of the
+    current file, so a save never drops another worker's entries; keys
+    missing from the file that this process did not touch were removed
+    by another worker and are dropped. Read, merge and write happen under
+    an exclusive flock() on a sidecar lock file.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Index file
+        """
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self.mtime = None
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Hold the cross-process lock (a no-op without fcntl)"""
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def read(self):
+        """
+        Returns:
+            dict: The index as last written by any process ({} if missing)
+        """
+        try:
+            self.mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def stale(self):
+        """Whether another process wrote the file since we last read or wrote it"""
+        try:
+            return os.stat(self.path).st_mtime_ns != self.mtime
+        except FileNotFoundError:
+            return False
+
+    def merge(self, entries, changed, removed):
+        """
+        Current file contents with this process's changes applied
+
+        Args:
+            entries (dict): This process's copy; values carry 'last_access'
+            changed (set): Keys added or updated here since the last write
+            removed (set): Keys deleted here since the last write
+
+        Returns:
+            dict: Merged index; the later 'last_access' wins for shared keys
+        """
+        merged = self.read()
+        for key in removed:
+            merged.pop(key, None)
+        for key in changed:
+            entry = entries.get(key)
+            if entry is None:
+                continue
+            theirs = merged.get(key)
+            if theirs and theirs.get('last_access', 0) > entry.get('last_access', 0):
+                entry = dict(entry, last_access=theirs['last_access'])
+            merged[key] = entry
+        return merged
+
+    def write(self, entries):
+        """Replace the file atomically (hold locked() after merging)"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
+        self.mtime = os.stat(self.path).st_mtime_ns
+
+
+class StorageManager:
+    """
+    Tracks every output file and deletes the ones that outlive their budget
+
+    The index maps paths relative to the outputs root to size, creation
+    time and last access. A background sweeper reconciles it with the disk,
+    then removes files idle for longer than their category's TTL and, least
+    recently used first, files over the category quota or the total budget.
+    """
+
+    def __init__(self, root=OUTPUT_ROOT, quotas=None, ttls=None, max_bytes=None, interval=None):
+        """
+        Args:
+            root (str): Outputs directory
+            quotas (dict): Category -> byte quota (0 for none); defaults from
+                STORAGE_QUOTA_<CATEGORY>
+            ttls (dict): Category -> seconds since last access before a file
+                expires (0 for never); defaults from STORAGE_TTL_<CATEGORY>
+            max_bytes (int): Budget across all categories
+            interval (int): Seconds between background sweeps (0 disables them)
+        """
+        self.root = os.path.abspath(root)
+        self.quotas = quotas or {
+            category: int(os.getenv(f'STORAGE_QUOTA_{category.upper()}', 0)) for category in CATEGORIES
+        }
+        self.ttls = ttls or {
+            category: int(os.getenv(f'STORAGE_TTL_{category.upper()}', DEFAULT_TTL)) for category in CATEGORIES
+        }
+        if max_bytes is None:
+            max_bytes = int(os.getenv('OUTPUT_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES))
+        self.max_bytes = max_bytes
+        if interval is None:
+            interval = int(os.getenv('STORAGE_SWEEP_INTERVAL', 300))
+        self.interval = interval
+
+        self.index = JsonIndex(os.path.join(self.root, 'storage_index.json'))
+        self.lock = threading.Lock()
+        self.entries = self.index.read()
+        # Paths updated or deleted here since the index was last written
+        self.changed = set()
+        self.removed = set()
+        self.last_save = 0.0
+        self.dirty = False
+        self.last_sweep = None
+        self.listeners = []
+        self._sweeper = None
+        self._stop = threading.Event()
+
+    def register(self, filepath):
+        """Record a finished output file; paths outside the root are ignored"""
+        path = self._relative(filepath)
+        if not path:
+            return
+        now = time.time()
+        with self.lock:
+            self.entries[path] = {
+                'size': os.path.getsize(filepath),
+                'created_at': now,
+                'last_access': now
+            }
+            self.changed.add(path)
+            self.removed.discard(path)
+            self._mark_dirty()
+
+    def touch(self, filepath):
+        """Record that an output was served or reused"""
+        path = self._relative(filepath)
+        if not path:
+            return
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry:
+                entry['last_access'] = time.time()
+                self.changed.add(path)
+                self._mark_dirty()
+
+    def sweep(self):
+        """
+        Reconcile the index with the disk and enforce TTLs and quotas
+
+        Returns:
+            dict: Summary with removed file count and freed bytes per reason
+        """
+        start = time.perf_counter()
+        on_disk = self._scan()
+        now = time.time()
+        removed = []
+        summary = {'ttl': [0, 0], 'quota': [0, 0], 'budget': [0, 0]}
+
+        # The index stays locked from merge to write, so other workers'
+        # registrations and access times count and none are lost
+        with self.lock, self.index.locked():
+            self._sync()
+            
+            # Files not yet saved by other processes or from before the index
+            for path, (size, mtime) in on_disk.items():
+                if path not in self.entries:
+                    self.entries[path] = {'size': size, 'created_at': mtime, 'last_access': mtime}
+                else:
+                    self.entries[path]['size'] = size
+            for path in [path for path in self.entries if path not in on_disk]:
+                del self.entries[path]
+
+            for path, entry in list(self.entries.items()):
+                ttl = self.ttls.get(_category(path))
+                if ttl and now - entry['last_access'] > ttl:
+                    removed.append(self._remove(path, 'ttl', summary))
+
+            for category in CATEGORIES:
+                quota = self.quotas.get(category)
+                if quota:
+                    paths = [path for path in self.entries if _category(path) == category]
+                    removed.extend(self._evict(paths, quota, 'quota', summary))
+
+            if self.max_bytes:
+                removed.extend(self._evict(list(self.entries), self.max_bytes, 'budget', summary))
+
+            self._write()
+
+        self.last_sweep = {
+            'at': now,
+            'seconds': round(time.perf_counter() - start, 4),
+            'removed': {reason: {'files': files, 'bytes': freed} for reason, (files, freed) in summary.items()}
+        }
+        if removed:
+            log_event(logger, 'storage.swept', files=len(removed), **{
+                f'{reason}_bytes': freed for reason, (_, freed) in summary.items()
+            })
+            for listener in self.listeners:
+                listener(removed)
+        return self.last_sweep
+
+    def stats(self):
+        """
+        Report usage per category against quotas and TTLs
+
+        Returns:
+            dict: Totals, per-category usage and the last sweep summary
+        """
+        now = time.time()
+        with self.lock:
+            if self.index.stale():
+                self.entries = self.index.merge(self.entries, self.changed, self.removed)
+            categories = {}
+            for category in CATEGORIES:
+                entries = [entry for path, entry in self.entries.items() if _category(path) == category]
+                used = sum(entry['size'] for entry in entries)
+                quota = self.quotas.get(category) or None
+                categories[category] = {
+                    'files': len(entries),
+                    'bytes': used,
+                    'quota_bytes': quota,
+                    'quota_used': round(used / quota, 4) if quota else None,
+                    'ttl_seconds': self.ttls.get(category) or None,
+                    'oldest_access_age': round(now - min(entry['last_access'] for entry in entries))
+                    if entries else None
+                }
+            total = sum(category['bytes'] for category in categories.values())
+
+        return {
+            'total': {
+                'files': sum(category['files'] for category in categories.values()),
+                'bytes': total,
+                'max_bytes': self.max_bytes or None
+            },
+            'categories': categories,
+            'sweep_interval': self.interval,
+            'last_sweep': self.last_sweep
+        }
+
+    def start(self):
+        """Start the background sweeper thread (idempotent)"""
+        with self.lock:
+            if self._sweeper:
+                return
+            self._sweeper = threading.Thread(target=self._run, name='storage-sweeper', daemon=True)
+            self._sweeper.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                log_event(logger, 'storage.sweep_failed', error=str(e))
+            if self._stop.wait(self.interval):
+                return
+
+    def _evict(self, paths, limit, reason, summary):
+        """Remove least recently used paths until their total fits limit (lock held)"""
+        total = sum(self.entries[path]['size'] for path in paths)
+        removed = []
+        for path in sorted(paths, key=lambda p: self.entries[p]['last_access']):
+            if total <= limit:
+                break
+            total -= self.entries[path]['size']
+            removed.append(self._remove(path, reason, summary))
+        return removed
+
+    def _remove(self, path, reason, summary):
+        entry = self.entries.pop(path)
+        self.removed.add(path)
+        self.changed.discard(path)
+        try:
+            os.remove(os.path.join(self.root, path))
+        except FileNotFoundError:
+            pass
+        summary[reason][0] += 1
+        summary[reason][1] += entry['size']
+        metrics.count('arcitek_storage_evictions_total', help='Output files deleted by the storage sweeper',
+                      category=_category(path), reason=reason)
+        log_event(logger, 'storage.evicted', path=path, bytes=entry['size'], reason=reason)
+        return path
+
+    def _scan(self):
+        """
+        Walk the category directories
+
+        Returns:
+            dict: Relative path -> (size, mtime) for every finished output
+        """
+        found = {}
+        stack = [os.path.join(self.root, category) for category in CATEGORIES]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as it:
+                    for item in it:
+                        # Scratch files (.tmp_*) and .gitkeep are not outputs
+                        if item.name.startswith('.'):
+                            continue
+                        if item.is_dir(follow_symlinks=False):
+                            stack.append(item.path)
+                        elif item.is_file(follow_symlinks=False):
+                            stat = item.stat()
+                            found[os.path.relpath(item.path, self.root)] = (stat.st_size, stat.st_mtime)
+            except FileNotFoundError:
+                continue
+        return found
+
+    def _relative(self, filepath):
+        path = os.path.relpath(os.path.abspath(filepath), self.root)
+        if path.startswith('..') or _category(path) not in CATEGORIES:
+            return None
+        return path
+
+    def _mark_dirty(self):
+        """Save the index if the last save is old enough (lock held)"""
+        self.dirty = True
+        if time.time() - self.last_save > SAVE_INTERVAL:
+            self._save()
+
+    def _save(self):
+        """Merge this process's changes into the shared index (lock held)"""
+        with self.index.locked():
+            self._sync()
+            self._write()
+
+    def _sync(self):
+        """Take in other workers' changes (lock and index lock held)"""
+        self.entries = self.index.merge(self.entries, self.changed, self.removed)
+        self.changed.clear()
+        self.removed.clear()
+
+    def _write(self):
+        """Write the synced index atomically (lock and index lock held)"""
+        self.index.write(self.entries)
+        self.changed.clear()
+        self.removed.clear()
+        self.last_save = time.time()
+        self.dirty = False
+
+
+def shard_path(directory, filename):
+    """
+    Return where an output named filename lives under directory
+
+    Files are spread over two levels of 256 subdirectories keyed by a hash
+    of the name, so no single directory grows large enough to slow down
+    lookups.
+
+    Args:
+        directory (str): Category directory, e.g. outputs/images
+        filename (str): Output filename
+
+    Returns:
+        str: directory/ab/cd/filename
+    """
+    digest = hashlib.sha256(filename.encode('utf-8')).hexdigest()
+    return os.path.join(directory, digest[:2], digest[2:4], filename)
+
+
+def locate(directory, filename):
+    """
+    Return the path of an existing output, sharded or from the flat
+    layout used before sharding
+
+    Returns:
+        str: Path to the file, or None if it does not exist
+    """
+    for path in (shard_path(directory, filename), os.path.join(directory, filename)):
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def _category(path):
+    return path.split(os.sep, 1)[0]
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """Return the process-wide StorageManager"""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = StorageManager()
+        return _storage
@@ -3,13 +3,32 @@ Story Generation and Narration Service
 Uses GPT-4 for story creation and OpenAI TTS for voice narration
 """
 
+import asyncio
+import json
+import logging
 import os
+import re
 import time
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
+from services.openai_client import create_client, create_async_client
+from services.cache_service import get_cache, temp_output_path, content_address
+from services.catalog_service import get_catalog
+from services.singleflight_service import SingleFlight
+from services.ratelimit_service import RateLimitedError, submit_with_priority
+from services.metrics_service import (
+    get_logger, log_event, timed, record_stage, record_bytes, record_cache, record_error
+)
+
+logger = get_logger('story')
 
 class StoryService:
     def __init__(self):
-        self.client = OpenAI()
+        self.client = create_client()
+        self._async_client = None
+        self.cache = get_cache()
+        self.catalog = get_catalog()
+        self.flight = SingleFlight('story')
+        self.narration_flight = SingleFlight('narration')
         self.output_dir = os.path.join(os.path.dirname(__file__), '..', 'outputs', 'stories')
         os.makedirs(self.output_dir, exist_ok=True)
         
@@ -20,8 +39,18 @@ class StoryService:
             'medium': 10000,
             'long': 25000
         }
+        
+        # Narration chunking: characters per TTS request and requests in flight
+        self.tts_max_chars = 4000
+        self.tts_concurrency = int(os.getenv('TTS_CONCURRENCY', 4))
+        
+        # Lengths written as outline + chapters, target words per chapter,
+        # and chapters drafted at once
+        self.chaptered_lengths = ('medium', 'long')
+        self.chapter_words = 2500
+        self.chapter_concurrency = int(os.getenv('STORY_CHAPTER_CONCURRENCY', 8))
     
-    def generate(self, prompt, genre, length):
+    def generate(self, prompt, genre, length, variant=0):
         """
         Generate creative story from text prompt
         
@@ -29,12 +58,705 @@ class StoryService:
             prompt (str): Story concept/idea
             genre (str): Story genre
             length (str): Story length (flash, short, medium, long)
+            variant (int): Variant number; non-zero variants of the same
+                request are generated and cached separately
             
         Returns:
             dict: Generated story information
         """
         word_count = self.lengths.get(length, 2000)
+        chaptered = length in self.chaptered_lengths
+        
+        system_prompt, user_prompt = self._build_prompts(prompt, genre, word_count)
+        
+        # Identical requests reuse the stored story
+        cache_key = self._cache_key(system_prompt, user_prompt, chaptered, variant)
+        cached = self.cache.get(cache_key)
+        record_cache('story', cached is not None)
+        if cached:
+            log_event(logger, 'story.cache_hit', filename=cached['filename'], title=cached['title'])
+            return self._load_cached_story(cached)
+        
+        def produce():
+            try:
+                log_event(logger, 'story.generate', length=length, genre=genre, target_words=word_count,
+                          chaptered=chaptered)
+                
+                if chaptered:
+                    title, content = None, []
+                    for event, data in self._chapter_events(prompt, genre, word_count, system_prompt):
+                        if event == 'title':
+                            title = data
+                        else:
+                            content.append(data)
+                    content = ''.join(content).strip()
+                else:
+                    title, content = self._generate_single(genre, word_count, system_prompt, user_prompt)
+                
+                return self._save_story(cache_key, title, content,
+                                        self._catalog_entry(prompt, genre, length, variant))
+                
+            except RateLimitedError:
+                # Shed before reaching the API; the caller retries, not a demo story
+                raise
+            except Exception as e:
+                log_event(logger, 'story.error', level=logging.ERROR, error=str(e), fallback=True)
+                record_error('story', fallback=True)
+                # Return demo story
+                return self._create_demo_story(prompt, genre)
+        
+        # Identical requests already in flight share one completion
+        return self.flight.do(cache_key, produce, lambda: self._lookup_story(cache_key))
+    
+    async def generate_async(self, prompt, genre, length, variant=0):
+        """
+        Async variant of generate for the ASGI server
+        
+        Completions are awaited on the event loop, with chapters drafted
+        concurrently up to chapter_concurrency; cache and file I/O run in
+        the loop's executor. Arguments and result match generate.
+        """
+        word_count = self.lengths.get(length, 2000)
+        chaptered = length in self.chaptered_lengths
+        
+        system_prompt, user_prompt = self._build_prompts(prompt, genre, word_count)
+        
+        cache_key = self._cache_key(system_prompt, user_prompt, chaptered, variant)
+        cached = await asyncio.to_thread(self.cache.get, cache_key)
+        record_cache('story', cached is not None)
+        if cached:
+            log_event(logger, 'story.cache_hit', filename=cached['filename'], title=cached['title'])
+            return await asyncio.to_thread(self._load_cached_story, cached)
+        
+        async def produce():
+            try:
+                log_event(logger, 'story.generate', length=length, genre=genre, target_words=word_count,
+                          chaptered=chaptered, mode='async')
+                
+                if chaptered:
+                    title, content = await self._write_chapters_async(prompt, genre, word_count, system_prompt)
+                else:
+                    with timed('story', 'api', cpu=False):
+                        response = await self.async_client.chat.completions.create(
+                            **self._story_request(system_prompt, user_prompt, word_count))
+                    title, content = self._parse_choices(response, genre)[0]
+                
+                return await asyncio.to_thread(self._save_story, cache_key, title, content,
+                                               self._catalog_entry(prompt, genre, length, variant))
+                
+            except RateLimitedError:
+                raise
+            except Exception as e:
+                log_event(logger, 'story.error', level=logging.ERROR, error=str(e), fallback=True)
+                record_error('story', fallback=True)
+                return await asyncio.to_thread(self._create_demo_story, prompt, genre)
+        
+        return await self.flight.do_async(cache_key, produce, lambda: self._lookup_story(cache_key))
+    
+    @property
+    def async_client(self):
+        # Built on first async call, so sync-only servers never create it
+        if self._async_client is None:
+            self._async_client = create_async_client()
+        return self._async_client
+    
+    def generate_variants(self, prompt, genre, length, count):
+        """
+        Generate several different stories for the same request
+        
+        Single-pass lengths ask the model for every uncached variant in one
+        completion (n=missing), sharing the prompt tokens and round trip;
+        cached variants are reused. Chaptered lengths have no multi-choice equivalent for their outline
+        and chapter calls, so their variants are written one after another.
+        
+        Args:
+            prompt (str): Story concept/idea
+            genre (str): Story genre
+            length (str): Story length (flash, short, medium, long)
+            count (int): Number of variants
+            
+        Returns:
+            list: One generated story dict per variant, in variant order
+        """
+        if count == 1 or length in self.chaptered_lengths:
+            return [self.generate(prompt, genre, length, variant) for variant in range(count)]
+        
+        word_count = self.lengths.get(length, 2000)
+        system_prompt, user_prompt = self._build_prompts(prompt, genre, word_count)
+        
+        cache_keys = [self._cache_key(system_prompt, user_prompt, False, variant) for variant in range(count)]
+        cached = [self.cache.get(cache_key) for cache_key in cache_keys]
+        missing = [variant for variant, entry in enumerate(cached) if not entry]
+        record_cache('story', not missing)
+        stories = [self._load_cached_story(entry) if entry else None for entry in cached]
+        if not missing:
+            log_event(logger, 'story.cache_hit', filenames=[entry['filename'] for entry in cached])
+            return stories
+        missing_keys = [cache_keys[variant] for variant in missing]
+        
+        def produce():
+            try:
+                log_event(logger, 'story.generate', length=length, genre=genre, target_words=word_count,
+                          variants=len(missing), cached_variants=count - len(missing))
+                completed = self._complete_stories(genre, word_count, system_prompt, user_prompt, len(missing))
+                return [
+                    self._save_story(cache_key, title, content,
+                                     self._catalog_entry(prompt, genre, length, variant))
+                    for variant, cache_key, (title, content) in zip(missing, missing_keys, completed)
+                ]
+                
+            except RateLimitedError:
+                raise
+            except Exception as e:
+                log_event(logger, 'story.error', level=logging.ERROR, error=str(e), fallback=True)
+                record_error('story', fallback=True)
+                return [self._create_demo_story(prompt, genre) for _ in missing]
+        
+        # Identical requests already in flight share one completion
+        flight_key = self.cache.key('story', variants=missing_keys)
+        generated = self.flight.do(flight_key, produce, lambda: self._lookup_stories(missing_keys))
+        for variant, story in zip(missing, generated):
+            stories[variant] = dict(story)
+        return stories
+    
+    def _save_story(self, cache_key, title, content, entry):
+        """
+        Write a finished story under a content-addressed name, then cache
+        and catalog it
+        
+        Args:
+            cache_key (str): Request key
+            title (str): Story title
+            content (str): Story text
+            entry (dict): Prompt and parameters for the catalog, from _catalog_entry
+        
+        Returns:
+            dict: Generated story information including content
+        """
+        # Calculate actual word count
+        actual_word_count = len(content.split())
+        
+        # Save story to file under a content-addressed name
+        with timed('story', 'file_write'):
+            filename, filepath = self._write_story(title, content, 'story')
+        record_bytes('story', os.path.getsize(filepath))
+        
+        log_event(logger, 'story.generated', filename=filename, title=title, word_count=actual_word_count)
+        
+        result = {
+            'title': title,
+            'word_count': actual_word_count,
+            'filename': filename,
+            'filepath': filepath
+        }
+        # Content lives in the file, not the cache index
+        self.cache.put(cache_key, result)
+        self.catalog.record('story', cache_key, result, body=content, **entry)
+        return dict(result, content=content)
+    
+    def _write_story(self, title, content, prefix):
+        """
+        Write title and content under a content-addressed name
+        
+        Returns:
+            tuple: (filename, filepath)
+        """
+        filepath = temp_output_path(self.output_dir, '.txt')
+        with open(filepath, 'w', encoding='utf-8') as f:
+            f.write(f"{title}\n\n{content}")
+        return content_address(filepath, prefix)
+    
+    def _catalog_entry(self, prompt, genre, length, variant=0):
+        return {
+            'prompt': prompt,
+            'params': {'genre': genre, 'length': length, 'variant': variant}
+        }
+    
+    def _cache_key(self, system_prompt, user_prompt, chaptered, variant=0):
+        # Variant 0 keeps the key plain stories have always used
+        extra = {'variant': variant} if variant else {}
+        return self.cache.key('story', model='gpt-4.1-mini', system=system_prompt, prompt=user_prompt,
+                              chaptered=chaptered, **extra)
+    
+    def _generate_single(self, genre, word_count, system_prompt, user_prompt):
+        """
+        Write a whole story in one completion
+        
+        Returns:
+            tuple: (title, content)
+        """
+        return self._complete_stories(genre, word_count, system_prompt, user_prompt, 1)[0]
+    
+    def _complete_stories(self, genre, word_count, system_prompt, user_prompt, count):
+        """
+        Write count whole stories in one completion request
+        
+        Returns:
+            list: (title, content) per choice
+        """
+        with timed('story', 'api'):
+            response = self.client.chat.completions.create(
+                **self._story_request(system_prompt, user_prompt, word_count, count))
+        
+        return self._parse_choices(response, genre)
+    
+    def _story_request(self, system_prompt, user_prompt, word_count, count=1):
+        """Keyword arguments for a whole-story chat completion"""
+        # Use available model (gpt-4.1-mini as per environment)
+        return {
+            'model': "gpt-4.1-mini",
+            'messages': [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            'temperature': 0.8,
+            'max_tokens': min(word_count * 2, 16000),  # Generous token limit
+            'n': count
+        }
+    
+    def _parse_choices(self, response, genre):
+        """
+        Returns:
+            list: (title, content) per choice, in choice order
+        """
+        choices = sorted(response.choices, key=lambda choice: choice.index)
+        return [self._parse_story(choice.message.content.strip(), genre) for choice in choices]
+    
+    def _parse_story(self, full_text, genre):
+        """
+        Split a 'TITLE: ...' reply into title and content
+        
+        Returns:
+            tuple: (title, content)
+        """
+        # Extract title and content
+        if "TITLE:" in full_text:
+            parts = full_text.split("\n", 2)
+            title = parts[0].replace("TITLE:", "").strip()
+            content = parts[2].strip() if len(parts) > 2 else parts[1].strip()
+        else:
+            title = f"{genre.title()} Story"
+            content = full_text
+        
+        return title, content
+    
+    def generate_stream(self, prompt, genre, length):
+        """
+        Generate a story, yielding events as tokens arrive
+        
+        The title is parsed from the first line as soon as it is complete,
+        and content is appended to the story file while it streams. Chaptered
+        lengths stream each chapter once it and all earlier ones are drafted.
+        
+        Args:
+            prompt (str): Story concept/idea
+            genre (str): Story genre
+            length (str): Story length (flash, short, medium, long)
+            
+        Yields:
+            tuple: (event, data) where event is 'title' (str), 'delta' (str),
+                'done' (result dict without content) or 'error' (str)
+        """
+        word_count = self.lengths.get(length, 2000)
+        chaptered = length in self.chaptered_lengths
+        system_prompt, user_prompt = self._build_prompts(prompt, genre, word_count)
+        
+        cache_key = self._cache_key(system_prompt, user_prompt, chaptered)
+        cached = self.cache.get(cache_key)
+        record_cache('story', cached is not None)
+        if cached:
+            log_event(logger, 'story.cache_hit', filename=cached['filename'], title=cached['title'], stream=True)
+            story = self._load_cached_story(cached)
+            yield from self._replay_story(story)
+            return
+        
+        log_event(logger, 'story.stream', length=length, genre=genre, target_words=word_count,
+                  chaptered=chaptered)
+        start = time.perf_counter()
+        if chaptered:
+            events = self._chapter_events(prompt, genre, word_count, system_prompt)
+        else:
+            events = self._stream_single(genre, word_count, system_prompt, user_prompt)
+        
+        scratch_path = temp_output_path(self.output_dir, '.txt')
+        title = None
+        actual_word_count = 0
+        at_word_boundary = True
+        # Streamed text, kept for the catalog's full-text index
+        parts = []
+        # Set once the story file has its final name
+        committed = False
+        
+        try:
+            try:
+                with open(scratch_path, 'w', encoding='utf-8') as f:
+                    for event, data in events:
+                        if event == 'title':
+                            title = data
+                            f.write(f"{title}\n\n")
+                            record_stage('story', 'first_event', time.perf_counter() - start)
+                            yield 'title', title
+                            continue
+                        
+                        # Count words across chunk boundaries without rejoining text
+                        words = len(data.split())
+                        if words and not at_word_boundary and not data[0].isspace():
+                            words -= 1
+                        actual_word_count += words
+                        at_word_boundary = data[-1].isspace()
+                        
+                        f.write(data)
+                        f.flush()
+                        parts.append(data)
+                        yield 'delta', data
+            except Exception as e:
+                # Nothing sent yet means the demo story can stand in, unless
+                # the call was shed and the client should retry
+                fallback = title is None and not isinstance(e, RateLimitedError)
+                log_event(logger, 'story.error', level=logging.ERROR, error=str(e), fallback=fallback, stream=True)
+                record_error('story', fallback=fallback)
+                if fallback:
+                    yield from self._replay_story(self._create_demo_story(prompt, genre))
+                else:
+                    yield 'error', str(e)
+                return
+            
+            record_stage('story', 'stream', time.perf_counter() - start)
+            filename, filepath = content_address(scratch_path, 'story')
+            committed = True
+        finally:
+            # Also runs when the client disconnects, which closes this
+            # generator with GeneratorExit rather than an Exception
+            events.close()
+            if not committed and os.path.exists(scratch_path):
+                os.remove(scratch_path)
+        
+        record_bytes('story', os.path.getsize(filepath))
+        result = {
+            'title': title,
+            'word_count': actual_word_count,
+            'filename': filename,
+            'filepath': filepath
+        }
+        self.cache.put(cache_key, result)
+        self.catalog.record('story', cache_key, result, body=''.join(parts),
+                            **self._catalog_entry(prompt, genre, length))
+        
+        log_event(logger, 'story.streamed', filename=filename, title=title, word_count=actual_word_count)
+        yield 'done', result
+    
+    def _stream_single(self, genre, word_count, system_prompt, user_prompt):
+        """
+        Stream a whole story from one completion
+        
+        Yields:
+            tuple: ('title', str) once, then ('delta', str) for each
+                non-empty piece of content
+        """
+        stream = self.client.chat.completions.create(
+            model="gpt-4.1-mini",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=0.8,
+            max_tokens=min(word_count * 2, 16000),
+            stream=True
+        )
+        
+        title = None
+        pending = ''  # Text held back until the title line is complete
+        started = False  # Whitespace between title and content is dropped
+        
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content or ''
+            if not delta:
+                continue
+            
+            if title is None:
+                pending = (pending + delta).lstrip()
+                if '\n' not in pending:
+                    continue
+                first_line, delta = pending.split('\n', 1)
+                if first_line.startswith('TITLE:'):
+                    title = first_line.replace('TITLE:', '').strip()
+                else:
+                    title = f"{genre.title()} Story"
+                    delta = f"{first_line}\n{delta}"
+                yield 'title', title
+            
+            if not started:
+                delta = delta.lstrip()
+                if not delta:
+                    continue
+                started = True
+            
+            yield 'delta', delta
+        
+        # A reply without any newline is all title line
+        if title is None:
+            yield 'title', f"{genre.title()} Story"
+            if pending:
+                yield 'delta', pending
+    
+    def _chapter_events(self, prompt, genre, word_count, system_prompt):
+        """
+        Write a long story as an outline followed by concurrently drafted chapters
+        
+        One call plans the chapters; each chapter is then drafted in parallel
+        with the whole outline as shared context, so wall-clock time tracks
+        chapter length rather than total length.
+        
+        Yields:
+            tuple: ('title', str) once, then ('delta', str) per chapter in order
+        """
+        num_chapters = max(2, round(word_count / self.chapter_words))
+        chapter_words = word_count // num_chapters
+        
+        log_event(logger, 'story.outline', chapters=num_chapters, chapter_words=chapter_words)
+        with timed('story', 'outline'):
+            response = self.client.chat.completions.create(
+                **self._outline_request(prompt, genre, word_count, num_chapters, system_prompt))
+        outline = parse_outline(response.choices[0].message.content)
+        title = outline['title'] or f"{genre.title()} Story"
+        chapters = outline['chapters']
+        yield 'title', title
+        
+        def draft(index):
+            with timed('story', 'chapter'):
+                response = self.client.chat.completions.create(**self._chapter_request(
+                    prompt, genre, title, chapters, index, chapter_words, system_prompt))
+            return response.choices[0].message.content.strip()
+        
+        with ThreadPoolExecutor(max_workers=self.chapter_concurrency) as executor:
+            drafts = [submit_with_priority(executor, draft, index) for index in range(len(chapters))]
+            try:
+                for index, future in enumerate(drafts):
+                    yield 'delta', self._chapter_text(chapters, index, future.result())
+            finally:
+                # A closed stream does not wait for chapters not yet started
+                for future in drafts:
+                    future.cancel()
+    
+    async def _write_chapters_async(self, prompt, genre, word_count, system_prompt):
+        """
+        Async counterpart of _chapter_events
+        
+        Returns:
+            tuple: (title, content)
+        """
+        num_chapters = max(2, round(word_count / self.chapter_words))
+        chapter_words = word_count // num_chapters
+        
+        log_event(logger, 'story.outline', chapters=num_chapters, chapter_words=chapter_words, mode='async')
+        with timed('story', 'outline', cpu=False):
+            response = await self.async_client.chat.completions.create(
+                **self._outline_request(prompt, genre, word_count, num_chapters, system_prompt))
+        outline = parse_outline(response.choices[0].message.content)
+        title = outline['title'] or f"{genre.title()} Story"
+        chapters = outline['chapters']
+        
+        semaphore = asyncio.Semaphore(self.chapter_concurrency)
         
+        async def draft(index):
+            async with semaphore:
+                with timed('story', 'chapter', cpu=False):
+                    response = await self.async_client.chat.completions.create(**self._chapter_request(
+                        prompt, genre, title, chapters, index, chapter_words, system_prompt))
+            return response.choices[0].message.content.strip()
+        
+        drafts = await asyncio.gather(*(draft(index) for index in range(len(chapters))))
+        content = ''.join(self._chapter_text(chapters, index, text) for index, text in enumerate(drafts))
+        return title, content.strip()
+    
+    def _outline_request(self, prompt, genre, word_count, num_chapters, system_prompt):
+        return {
+            'model': "gpt-4.1-mini",
+            'messages': [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": self._build_outline_prompt(prompt, genre, word_count, num_chapters)}
+            ],
+            'temperature': 0.8,
+            'max_tokens': 2000,
+            'response_format': {"type": "json_object"}
+        }
+    
+    def _chapter_request(self, prompt, genre, title, chapters, index, chapter_words, system_prompt):
+        return {
+            'model': "gpt-4.1-mini",
+            'messages': [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": self._build_chapter_prompt(
+                    prompt, genre, title, chapters, index, chapter_words)}
+            ],
+            'temperature': 0.8,
+            'max_tokens': min(chapter_words * 2, 16000)
+        }
+    
+    def _chapter_text(self, chapters, index, draft):
+        """Chapter draft with its heading, separated from the previous one"""
+        separator = '\n\n' if index else ''
+        heading = f"Chapter {index + 1}: {chapters[index]['title']}"
+        return f"{separator}{heading}\n\n{draft}"
+    
+    
+    def narrate(self, text, voice, speed):
+        """
+        Generate voice narration for story text
+        
+        Text longer than the TTS input limit is split at paragraph or
+        sentence boundaries, the chunks are synthesized concurrently, and
+        the MP3 results are joined in order without re-encoding.
+        
+        Args:
+            text (str): Story text to narrate
+            voice (str): Voice model (alloy, echo, fable, onyx, nova, shimmer)
+            speed (float): Narration speed (0.25 to 4.0)
+            
+        Returns:
+            dict: Generated narration information, including per-chunk
+                start/end timestamps in seconds
+        """
+        # Identical requests reuse the stored narration
+        cache_key = self.cache.key('narration', model='tts-1-hd', text=text, voice=voice, speed=speed)
+        cached = self.cache.get(cache_key)
+        record_cache('narration', cached is not None)
+        if cached:
+            log_event(logger, 'narration.cache_hit', filename=cached['filename'])
+            return cached
+        
+        def produce():
+            try:
+                # OpenAI TTS accepts up to 4096 characters per request
+                chunks = split_text(text, self.tts_max_chars)
+                log_event(logger, 'narration.generate', voice=voice, speed=speed, chars=len(text),
+                          chunks=len(chunks))
+                
+                def synthesize(chunk):
+                    with timed('narration', 'tts'):
+                        response = self.client.audio.speech.create(**self._speech_request(chunk, voice, speed))
+                        return response.read()
+                
+                # Bounded parallelism; results are collected in text order
+                with timed('narration', 'tts_total'), \
+                        ThreadPoolExecutor(max_workers=self.tts_concurrency) as executor:
+                    futures = [submit_with_priority(executor, synthesize, chunk) for chunk in chunks]
+                    audio_parts = [future.result() for future in futures]
+                
+                return self._write_narration(cache_key, chunks, audio_parts, voice, speed)
+                
+            except Exception as e:
+                log_event(logger, 'narration.error', level=logging.ERROR, error=str(e), fallback=False)
+                record_error('narration')
+                raise
+        
+        # Identical requests already in flight share one set of TTS calls
+        return self.narration_flight.do(cache_key, produce, lambda: self.cache.get(cache_key))
+    
+    async def narrate_async(self, text, voice, speed):
+        """
+        Async variant of narrate for the ASGI server
+        
+        TTS requests for all chunks are awaited concurrently, up to
+        tts_concurrency at once; joining the MP3 parts and cache I/O run in
+        the loop's executor. Arguments and result match narrate.
+        """
+        cache_key = self.cache.key('narration', model='tts-1-hd', text=text, voice=voice, speed=speed)
+        cached = await asyncio.to_thread(self.cache.get, cache_key)
+        record_cache('narration', cached is not None)
+        if cached:
+            log_event(logger, 'narration.cache_hit', filename=cached['filename'])
+            return cached
+        
+        async def produce():
+            try:
+                chunks = split_text(text, self.tts_max_chars)
+                log_event(logger, 'narration.generate', voice=voice, speed=speed, chars=len(text),
+                          chunks=len(chunks), mode='async')
+                
+                semaphore = asyncio.Semaphore(self.tts_concurrency)
+                
+                async def synthesize(chunk):
+                    async with semaphore:
+                        with timed('narration', 'tts', cpu=False):
+                            response = await self.async_client.audio.speech.create(
+                                **self._speech_request(chunk, voice, speed))
+                            return await response.aread()
+                
+                # gather() keeps results in text order
+                with timed('narration', 'tts_total', cpu=False):
+                    audio_parts = await asyncio.gather(*(synthesize(chunk) for chunk in chunks))
+                
+                return await asyncio.to_thread(self._write_narration, cache_key, chunks, audio_parts, voice, speed)
+                
+            except Exception as e:
+                log_event(logger, 'narration.error', level=logging.ERROR, error=str(e), fallback=False)
+                record_error('narration')
+                raise
+        
+        return await self.narration_flight.do_async(cache_key, produce, lambda: self.cache.get(cache_key))
+    
+    def _speech_request(self, chunk, voice, speed):
+        return {
+            'model': "tts-1-hd",  # High-quality model
+            'voice': voice,
+            'input': chunk,
+            'speed': speed
+        }
+    
+    def _write_narration(self, cache_key, chunks, audio_parts, voice, speed):
+        """
+        Join synthesized MP3 parts into one content-addressed file and cache it
+        
+        Returns:
+            dict: Narration information with per-chunk timestamps
+        """
+        # MP3 frames are self-contained, so parts join by concatenation once
+        # each part's ID3 tag (after the first) and Xing/Info frame are dropped
+        filepath = temp_output_path(self.output_dir, '.mp3')
+        timestamps = []
+        position = 0.0
+        with timed('narration', 'file_write'), open(filepath, 'wb') as f:
+            for index, (chunk, audio) in enumerate(zip(chunks, audio_parts)):
+                frames = strip_info_frame(strip_id3(audio) if index else audio)
+                length = mp3_duration(frames)
+                timestamps.append({
+                    'index': index,
+                    'start': round(position, 3),
+                    'end': round(position + length, 3),
+                    'chars': len(chunk)
+                })
+                position += length
+                f.write(frames)
+        filename, filepath = content_address(filepath, 'narration')
+        
+        duration = round(position, 2)
+        record_bytes('narration', os.path.getsize(filepath))
+        
+        log_event(logger, 'narration.generated', filename=filename, duration=duration, voice=voice, speed=speed)
+        
+        result = {
+            'url': f'/api/outputs/stories/{filename}',
+            'filename': filename,
+            'filepath': filepath,
+            'duration': duration,
+            'voice': voice,
+            'speed': speed,
+            'chunks': timestamps
+        }
+        self.cache.put(cache_key, result)
+        self.catalog.record('narration', cache_key, result, params={'voice': voice, 'speed': speed})
+        return result
+    
+    def _build_prompts(self, prompt, genre, word_count):
+        """
+        Build the system and user prompts for story generation
+        
+        Returns:
+            tuple: (system_prompt, user_prompt)
+        """
         # Create detailed system prompt for story generation
         system_prompt = f"""You are an expert creative writer specializing in {genre} fiction.
 Write engaging, well-structured stories with vivid descriptions, compelling characters, and strong narrative arcs.
@@ -55,116 +777,77 @@ TITLE: [Story Title]
 
 [Story content]"""
 
-        try:
-            print(f"Generating {length} {genre} story...")
-            print(f"Target: ~{word_count} words")
-            
-            # Use available model (gpt-4.1-mini as per environment)
-            response = self.client.chat.completions.create(
-                model="gpt-4.1-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.8,
-                max_tokens=min(word_count * 2, 16000)  # Generous token limit
-            )
-            
-            # Parse response
-            full_text = response.choices[0].message.content.strip()
-            
-            # Extract title and content
-            if "TITLE:" in full_text:
-                parts = full_text.split("\n", 2)
-                title = parts[0].replace("TITLE:", "").strip()
-                content = parts[2].strip() if len(parts) > 2 else parts[1].strip()
-            else:
-                title = f"{genre.title()} Story"
-                content = full_text
-            
-            # Calculate actual word count
-            actual_word_count = len(content.split())
-            
-            print(f"✓ Generated story: '{title}'")
-            print(f"  Word count: {actual_word_count}")
-            
-            # Save story to file
-            filename = f"story_{int(time.time())}.txt"
-            filepath = os.path.join(self.output_dir, filename)
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(f"{title}\n\n{content}")
-            
-            return {
-                'title': title,
-                'content': content,
-                'word_count': actual_word_count,
-                'filename': filename,
-                'filepath': filepath
-            }
-            
-        except Exception as e:
-            print(f"Error generating story: {e}")
-            # Return demo story
-            return self._create_demo_story(prompt, genre)
+        return system_prompt, user_prompt
     
-    def narrate(self, text, voice, speed):
-        """
-        Generate voice narration for story text
+    def _build_outline_prompt(self, prompt, genre, word_count, num_chapters):
+        return f"""Plan a {genre} story based on this concept: {prompt}
+
+The finished story will be approximately {word_count} words, told in exactly {num_chapters} chapters.
+Give it a compelling title, and for each chapter a title and a 2-4 sentence summary of what happens,
+so that the chapters together build tension and reach a satisfying resolution.
+
+Respond with JSON only, in this form:
+{{"title": "Story Title", "chapters": [{{"title": "Chapter Title", "summary": "What happens"}}]}}"""
+    
+    def _build_chapter_prompt(self, prompt, genre, title, chapters, index, chapter_words):
+        outline = "\n".join(
+            f"Chapter {i + 1}: {chapter['title']} - {chapter['summary']}"
+            for i, chapter in enumerate(chapters)
+        )
+        if index == len(chapters) - 1:
+            position = "This is the final chapter: bring the story to a satisfying resolution."
+        elif index == 0:
+            position = "This is the opening chapter: introduce the characters and setting."
+        else:
+            position = "Continue seamlessly from the previous chapter and set up the next one."
         
-        Args:
-            text (str): Story text to narrate
-            voice (str): Voice model (alloy, echo, fable, onyx, nova, shimmer)
-            speed (float): Narration speed (0.25 to 4.0)
-            
-        Returns:
-            dict: Generated narration information
+        return f"""You are writing the {genre} story "{title}", based on this concept: {prompt}
+
+Full outline:
+{outline}
+
+Write chapter {index + 1} of {len(chapters)}: "{chapters[index]['title']}"
+{position}
+
+Requirements:
+- Target length: approximately {chapter_words} words
+- Cover only the events of this chapter's summary
+- Keep characters, names and setting consistent with the outline
+- Use descriptive, engaging prose
+- Write only the chapter text, without a title or chapter heading"""
+    
+    def _replay_story(self, story):
+        """Yield a finished story as stream events"""
+        yield 'title', story['title']
+        yield 'delta', story['content']
+        yield 'done', {k: v for k, v in story.items() if k != 'content'}
+    
+    def _lookup_story(self, cache_key):
+        """Return a stored story with its content, or None"""
+        cached = self.cache.get(cache_key)
+        return self._load_cached_story(cached) if cached else None
+    
+    def _lookup_stories(self, cache_keys):
+        """Return stored stories for every key, or None if any is missing"""
+        stories = [self._lookup_story(cache_key) for cache_key in cache_keys]
+        return stories if all(stories) else None
+    
+    def _load_cached_story(self, cached):
         """
-        try:
-            print(f"Generating voice narration with {voice} voice...")
-            
-            # Limit text length for TTS (OpenAI has 4096 char limit)
-            max_chars = 4000
-            if len(text) > max_chars:
-                text = text[:max_chars] + "..."
-                print(f"  Text truncated to {max_chars} characters")
-            
-            # Generate speech using OpenAI TTS
-            response = self.client.audio.speech.create(
-                model="tts-1-hd",  # High-quality model
-                voice=voice,
-                input=text,
-                speed=speed
-            )
-            
-            # Save audio file
-            filename = f"narration_{int(time.time())}.mp3"
-            filepath = os.path.join(self.output_dir, filename)
-            
-            response.stream_to_file(filepath)
-            
-            # Estimate duration (rough approximation: ~150 words per minute at 1.0 speed)
-            word_count = len(text.split())
-            duration = int((word_count / 150) * 60 / speed)
-            
-            print(f"✓ Generated narration: {filepath}")
-            print(f"  Duration: ~{duration}s, Voice: {voice}, Speed: {speed}x")
-            
-            return {
-                'url': f'/api/outputs/stories/{filename}',
-                'filename': filename,
-                'filepath': filepath,
-                'duration': duration,
-                'voice': voice,
-                'speed': speed
-            }
-            
-        except Exception as e:
-            print(f"Error generating narration: {e}")
-            raise
+        Restore story content for a cache hit from its saved file
+        """
+        with open(cached['filepath'], encoding='utf-8') as f:
+            saved = f.read()
+        # Saved as "{title}\n\n{content}"
+        content = saved.split("\n\n", 1)[1] if "\n\n" in saved else saved
+        return dict(cached, content=content)
     
     def _create_demo_story(self, prompt, genre):
         """
         Create a demo story when API is unavailable
+        
+        It is saved like a generated story, so its URL can be fetched, but
+        not cached or cataloged.
         """
         title = f"The {genre.title()} Tale"
         content = f"""In a world where {prompt}, extraordinary events were about to unfold.
@@ -178,12 +861,201 @@ This demo showcases the story generation and narration capabilities of ArciTEK.A
 infinite♾2025"""
         
         word_count = len(content.split())
+        filename, filepath = self._write_story(title, content, 'story_demo')
         
         return {
             'title': title,
             'content': content,
             'word_count': word_count,
-            'filename': 'demo_story.txt',
-            'filepath': os.path.join(self.output_dir, 'demo_story.txt')
+            'filename': filename,
+            'filepath': filepath
+        }
+
+
+def parse_outline(text):
+    """
+    Parse the JSON chapter plan returned by the outline call
+    
+    Args:
+        text (str): Model reply, optionally wrapped in a ```json fence
+        
+    Returns:
+        dict: {'title': str, 'chapters': [{'title': str, 'summary': str}, ...]}
+    """
+    text = text.strip()
+    if text.startswith('```'):
+        text = text.strip('`')
+        text = text[text.index('\n') + 1:] if '\n' in text else text
+    
+    plan = json.loads(text)
+    chapters = [
+        {
+            'title': str(chapter.get('title') or f"Chapter {i + 1}").strip(),
+            'summary': str(chapter.get('summary') or '').strip()
         }
+        for i, chapter in enumerate(plan.get('chapters') or [])
+    ]
+    if not chapters:
+        raise ValueError('Outline has no chapters')
+    
+    return {'title': str(plan.get('title') or '').strip(), 'chapters': chapters}
+
+
+def split_text(text, max_chars):
+    """
+    Split text into chunks of at most max_chars characters
+    
+    Breaks prefer paragraph boundaries, then sentence ends, then spaces;
+    a single word longer than max_chars is hard-split.
+    
+    Args:
+        text (str): Text to split
+        max_chars (int): Maximum characters per chunk
+        
+    Returns:
+        list: Non-empty chunks in order
+    """
+    chunks = []
+    current = ''
+    
+    for piece, separator in _split_units(text, max_chars):
+        if current and len(current) + len(separator) + len(piece) > max_chars:
+            chunks.append(current)
+            current = ''
+        current = f"{current}{separator}{piece}" if current else piece
+    
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _split_units(text, max_chars):
+    """
+    Yield (piece, separator) pairs: paragraphs, falling back to sentences
+    and words, each at most max_chars long
+    """
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = ' '.join(paragraph.split())
+        if not paragraph:
+            continue
+        # Paragraph breaks are kept so the voice still pauses between them
+        separator = '\n\n'
+        if len(paragraph) <= max_chars:
+            yield paragraph, separator
+            continue
+        for sentence in re.split(r'(?<=[.!?…])\s+', paragraph):
+            if len(sentence) <= max_chars:
+                yield sentence, separator
+                separator = ' '
+                continue
+            for word in sentence.split(' '):
+                for start in range(0, len(word), max_chars):
+                    yield word[start:start + max_chars], separator
+                    separator = ' '
+
+
+# MPEG audio header tables: bitrates (kbps) by [version][layer], sample rates by version
+_MP3_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+}
+_MP3_SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 2.5: (11025, 12000, 8000)}
+
+
+def strip_id3(data):
+    """Remove a leading ID3v2 tag so MP3 parts can be concatenated"""
+    if data[:3] != b'ID3' or len(data) < 10:
+        return data
+    # Tag size is a 28-bit syncsafe integer, excluding the 10-byte header
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+    return data[10 + size + footer:]
+
+
+def strip_info_frame(data):
+    """
+    Remove the Xing/Info/VBRI frame from the start of an MP3 stream
+
+    Encoders put the stream's frame count and seek table in this frame.
+    Kept in a concatenation, it makes players report the length of the
+    part it came from and seek wrongly through the joined file. A leading
+    ID3v2 tag is kept.
+    """
+    start = len(data) - len(strip_id3(data))
+    for position, frame_length, _, _ in _mp3_frames(data, start):
+        if position == start and _is_info_frame(data, position):
+            return data[:position] + data[position + frame_length:]
+        break
+    return data
+
+
+def mp3_duration(data):
+    """
+    Compute MP3 duration in seconds by walking its frame headers
+    
+    A Xing/Info/VBRI frame carries no audio and is not counted.
+    
+    Args:
+        data (bytes): MP3 stream, optionally starting with an ID3v2 tag
+        
+    Returns:
+        float: Duration in seconds
+    """
+    data = strip_id3(data)
+    duration = 0.0
+    for position, _, samples, sample_rate in _mp3_frames(data):
+        if position == 0 and _is_info_frame(data, position):
+            continue
+        duration += samples / sample_rate
+    return duration
+
+
+def _mp3_frames(data, position=0):
+    """
+    Walk MPEG audio frame headers from position
+    
+    Yields:
+        tuple: (offset, frame length, samples, sample rate) per frame
+    """
+    while position + 4 <= len(data):
+        b1, b2 = data[position + 1], data[position + 2]
+        if data[position] != 0xFF or (b1 & 0xE0) != 0xE0:
+            position += 1  # Resynchronize past junk
+            continue
+        
+        version = {3: 1, 2: 2, 0: 2.5}.get((b1 >> 3) & 0x03)
+        layer = {3: 1, 2: 2, 1: 3}.get((b1 >> 1) & 0x03)
+        bitrate_index = b2 >> 4
+        rate_index = (b2 >> 2) & 0x03
+        if version is None or layer is None or bitrate_index in (0, 15) or rate_index == 3:
+            position += 1
+            continue
+        
+        bitrate = _MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+        sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+        padding = (b2 >> 1) & 0x01
+        
+        if layer == 1:
+            samples = 384
+            frame_length = (12 * bitrate // sample_rate + padding) * 4
+        else:
+            samples = 1152 if layer == 2 or version == 1 else 576
+            frame_length = samples // 8 * bitrate // sample_rate + padding
+        
+        yield position, frame_length, samples, sample_rate
+        position += frame_length
+
 
+def _is_info_frame(data, position):
+    """Whether the frame at position is a Xing/Info or VBRI header frame"""
+    b1, b3 = data[position + 1], data[position + 3]
+    mpeg1 = (b1 >> 3) & 0x03 == 3
+    mono = b3 >> 6 == 3
+    # The Xing tag follows the header, optional CRC and side information
+    side_info = {(True, False): 32, (True, True): 17, (False, False): 17, (False, True): 9}[(mpeg1, mono)]
+    xing = position + 4 + (0 if b1 & 0x01 else 2) + side_info
+    return data[xing:xing + 4] in (b'Xing', b'Info') or data[position + 36:position + 40] == b'VBRI'
@@ -0,0 +1,166 @@
+"""
+Upscaling Service
+Tiled, multi-core image resampling for high-resolution output
+"""
+
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Output tile edge in pixels; 8k splits into 8x5 tiles
+DEFAULT_TILE_SIZE = 1024
+
+# Extra source pixels around each tile, beyond the kernel's reach, so
+# every tile sees the same neighbourhood a single full resize would
+TILE_MARGIN = 8
+
+# How tile workers are started. Forking the multi-threaded server would copy
+# locks other threads hold (logging, the HTTP pool, SQLite) into children that
+# can then deadlock; forkserver forks them from a clean single-threaded process
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+class LanczosResampler:
+    """
+    Default resampler using PIL's Lanczos filter
+
+    Any object with a compatible resize() and support attribute can be
+    passed to TiledUpscaler; it must be picklable to run in worker processes.
+    """
+
+    # Kernel radius in source pixels when upscaling
+    support = 3
+
+    def resize(self, img, size, box):
+        """
+        Resample the region box of img to size
+
+        Args:
+            img (PIL.Image): Source image (or a crop of it)
+            size (tuple): Output (width, height)
+            box (tuple): Source region (left, top, right, bottom) as floats
+
+        Returns:
+            PIL.Image: Resampled region
+        """
+        from PIL import Image
+        return img.resize(size, Image.Resampling.LANCZOS, box=box)
+
+
+class TiledUpscaler:
+    def __init__(self, resampler=None, tile_size=None, workers=None):
+        """
+        Args:
+            resampler: Resampler implementation (default LanczosResampler)
+            tile_size (int): Output tile edge in pixels
+            workers (int): Worker processes; 1 resamples on the calling thread
+
+        Workers are started with UPSCALE_START_METHOD (default START_METHOD).
+        """
+        self.resampler = resampler or LanczosResampler()
+        self.tile_size = tile_size or int(os.getenv('UPSCALE_TILE_SIZE', DEFAULT_TILE_SIZE))
+        self.workers = workers or int(os.getenv('UPSCALE_WORKERS', os.cpu_count() or 1))
+        self.start_method = os.getenv('UPSCALE_START_METHOD', START_METHOD)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def upscale(self, img, size):
+        """
+        Resize img to size, resampling tiles in parallel
+
+        Tiles are cut with enough surrounding source pixels that each one
+        matches the corresponding region of a single full-image resize, so
+        the stitched result has no seams.
+
+        Args:
+            img (PIL.Image): Source image
+            size (tuple): Target (width, height)
+
+        Returns:
+            tuple: (PIL.Image, dict of stage timings in seconds)
+        """
+        from PIL import Image
+
+        timings = {}
+        start = time.perf_counter()
+
+        tiles = list(self._split(img, size))
+        timings['split'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if self.workers > 1 and len(tiles) > 1:
+            results = list(self._get_pool().map(_resample_tile, [(self.resampler, tile) for tile in tiles]))
+        else:
+            results = [_resample_tile((self.resampler, tile)) for tile in tiles]
+        timings['resample'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        output = Image.new(img.mode, size)
+        for (position, _, _, _), tile in zip(tiles, results):
+            output.paste(tile, position)
+        timings['stitch'] = time.perf_counter() - start
+
+        return output, timings
+
+    def warm_up(self):
+        """Start the worker processes now rather than on the first upscale"""
+        if self.workers > 1:
+            list(self._get_pool().map(_noop, range(self.workers)))
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool:
+                self._pool.shutdown()
+                self._pool = None
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                context = multiprocessing.get_context(self.start_method)
+                if self.start_method == 'forkserver':
+                    # Imported once in the server instead of in every worker
+                    context.set_forkserver_preload(['PIL.Image', 'services.upscale_service'])
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._pool
+
+    def _split(self, img, size):
+        """
+        Yield (output position, tile size, source crop, box within crop) per tile
+        """
+        scale_x = img.width / size[0]
+        scale_y = img.height / size[1]
+
+        # When downscaling the kernel widens with the scale factor
+        margin_x = math.ceil(self.resampler.support * max(scale_x, 1)) + TILE_MARGIN
+        margin_y = math.ceil(self.resampler.support * max(scale_y, 1)) + TILE_MARGIN
+
+        for top in range(0, size[1], self.tile_size):
+            bottom = min(top + self.tile_size, size[1])
+            for left in range(0, size[0], self.tile_size):
+                right = min(left + self.tile_size, size[0])
+
+                # Exact source region covered by this output tile
+                box = (left * scale_x, top * scale_y, right * scale_x, bottom * scale_y)
+
+                # Crop with a margin so the kernel sees real neighbours
+                crop = (
+                    max(0, math.floor(box[0]) - margin_x),
+                    max(0, math.floor(box[1]) - margin_y),
+                    min(img.width, math.ceil(box[2]) + margin_x),
+                    min(img.height, math.ceil(box[3]) + margin_y)
+                )
+                relative_box = (box[0] - crop[0], box[1] - crop[1], box[2] - crop[0], box[3] - crop[1])
+
+                yield (left, top), (right - left, bottom - top), img.crop(crop), relative_box
+
+
+def _resample_tile(args):
+    resampler, (_, tile_size, source, box) = args
+    return resampler.resize(source, tile_size, box)
+
+
+def _noop(_):
+    return None
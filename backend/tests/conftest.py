@@ -0,0 +1,35 @@
+"""
+Shared test setup
+
+Tests run offline against the fake OpenAI client, with background
+sweeps, cross-process locks and the shared catalog kept out of the real
+outputs directory.
+"""
+
+import os
+import sys
+import tempfile
+import pytest
+
+os.environ.setdefault('OPENAI_FAKE', '1')
+os.environ.setdefault('STORAGE_SWEEP_INTERVAL', '0')
+os.environ.setdefault('WARM_SERVICES', '')
+os.environ.setdefault('SINGLEFLIGHT_BACKEND', 'local')
+os.environ.setdefault('CATALOG_PATH', os.path.join(tempfile.mkdtemp(prefix='arcitek-tests-'), 'catalog.db'))
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+@pytest.fixture
+def story_service(tmp_path):
+    """StoryService writing to a scratch outputs tree"""
+    from services.cache_service import ResultCache
+    from services.catalog_service import Catalog
+    from services.story_service import StoryService
+
+    service = StoryService()
+    service.output_dir = str(tmp_path / 'stories')
+    os.makedirs(service.output_dir)
+    service.cache = ResultCache(str(tmp_path))
+    service.catalog = Catalog(str(tmp_path / 'catalog.db'), root=str(tmp_path))
+    return service
@@ -0,0 +1,71 @@
+import asyncio
+import threading
+
+import asgi
+
+
+def streaming_app(produced, closed):
+    def wsgi_app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/event-stream')])
+
+        def events():
+            try:
+                for index in range(1000):
+                    produced.append(index)
+                    yield f'data: {index}\n\n'.encode()
+            finally:
+                closed.set()
+        return events()
+    return wsgi_app
+
+
+def test_stream_closes_when_client_disconnects(monkeypatch):
+    produced, closed = [], threading.Event()
+    monkeypatch.setattr(asgi.backend, 'app', streaming_app(produced, closed))
+
+    async def run():
+        gone = asyncio.Event()
+        sent = []
+
+        async def receive():
+            await gone.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+            if len(sent) == 3:
+                gone.set()  # Later sends go nowhere, as with uvicorn
+            await asyncio.sleep(0)
+
+        scope = {'type': 'http', 'method': 'GET', 'path': '/api/stream', 'headers': []}
+        await asyncio.wait_for(asgi._serve_wsgi(scope, b'', receive, send), 5)
+        return sent
+
+    sent = asyncio.run(run())
+    assert closed.is_set()
+    assert len(produced) < 10
+    assert sent[0]['status'] == 200
+    assert sent[-1].get('more_body')  # Never finished the body
+
+
+def test_stream_completes_without_disconnect(monkeypatch):
+    produced, closed = [], threading.Event()
+    monkeypatch.setattr(asgi.backend, 'app', streaming_app(produced, closed))
+
+    async def run():
+        sent = []
+
+        async def receive():
+            await asyncio.Event().wait()
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': 'GET', 'path': '/api/stream', 'headers': []}
+        await asgi._serve_wsgi(scope, b'', receive, send)
+        return sent
+
+    sent = asyncio.run(run())
+    assert closed.is_set()
+    assert len(produced) == 1000
+    assert sent[-1] == {'type': 'http.response.body', 'body': b''}
@@ -0,0 +1,31 @@
+import pytest
+
+from services.batch_service import BatchService
+
+
+def batch_service():
+    return BatchService(None, {'image': 'prompt', 'story': 'prompt'}, variant_types=('story',), max_items=8)
+
+
+def test_plan_expands_every_combination():
+    tasks = batch_service().plan([
+        {'type': 'image', 'params': {'prompt': 'a fox'}, 'expand': {'style': ['oil', 'anime'], 'resolution': ['hd', '4k']}},
+        {'type': 'story', 'params': {'prompt': 'a fox'}, 'variants': 2}
+    ])
+    assert [task['first_index'] for task in tasks] == [0, 1, 2, 3, 4, 5]
+    assert tasks[3]['params'] == {'prompt': 'a fox', 'style': 'anime', 'resolution': '4k'}
+    assert [task['variants'] for task in tasks[4:]] == [[0], [1]]
+
+
+def test_oversized_expansion_is_rejected_before_expanding():
+    values = list(range(1000))
+    with pytest.raises(ValueError, match='at least 1000000000 results'):
+        batch_service().plan([
+            {'type': 'image', 'params': {'prompt': 'a fox'}, 'expand': {'a': values, 'b': values, 'c': values}}
+        ])
+
+
+def test_limit_counts_earlier_items():
+    items = [{'type': 'story', 'params': {'prompt': 'a fox'}, 'variants': 4}] * 3
+    with pytest.raises(ValueError, match='at least 12 results'):
+        batch_service().plan(items)
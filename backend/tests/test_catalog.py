@@ -0,0 +1,69 @@
+import pytest
+
+from services.catalog_service import Catalog
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    catalog = Catalog(str(tmp_path / 'catalog.db'), root=str(tmp_path))
+    stories = [
+        ('The Dragon Library', 'a dragon guards a library', 'Scrolls burned in the dragon library.'),
+        ('Harbour Lights', 'a lighthouse keeper', 'The lamp turned all night over the harbour.'),
+        ('Dragonfly', 'an insect in summer', 'Wings over the pond.')
+    ]
+    for index, (title, prompt, body) in enumerate(stories):
+        path = tmp_path / 'stories' / f'story_{index}.txt'
+        path.parent.mkdir(exist_ok=True)
+        path.write_text(body)
+        catalog.record('story', f'key{index}', {'filename': path.name, 'filepath': str(path), 'title': title},
+                       prompt=prompt, body=body)
+    path = tmp_path / 'images' / 'image_0.png'
+    path.parent.mkdir()
+    path.write_bytes(b'png')
+    catalog.record('image', 'image0', {'filename': path.name, 'filepath': str(path)}, prompt='a dragon at dawn')
+    return catalog
+
+
+def titles(page):
+    return [item['title'] for item in page['items']]
+
+
+def test_search_ranks_title_matches_first(catalog):
+    page = catalog.search('dragon')
+    assert page['total'] == 3  # 'dragon' also prefix-matches 'dragonfly'
+    assert titles(page)[0] == 'The Dragon Library'
+    assert '[' in page['items'][0]['snippet']
+
+
+def test_search_filters_by_kind_and_pages(catalog):
+    page = catalog.search('dragon', kind='image')
+    assert [item['filename'] for item in page['items']] == ['image_0.png']
+
+    first = catalog.search('dragon', kind='story', per_page=1)
+    second = catalog.search('dragon', kind='story', page=2, per_page=1)
+    assert first['total'] == second['total'] == 2
+    assert titles(first) != titles(second)
+
+
+def test_search_keeps_query_syntax_literal(catalog):
+    assert catalog.search('harbour OR "dragon')['total'] == 0
+    assert titles(catalog.search('lamp harbour')) == ['Harbour Lights']
+    with pytest.raises(ValueError):
+        catalog.search('  ')
+
+
+def test_rerecording_a_request_updates_its_row(catalog, tmp_path):
+    path = tmp_path / 'stories' / 'story_0.txt'
+    catalog.record('story', 'key0', {'filename': path.name, 'filepath': str(path), 'title': 'Renamed'},
+                   prompt='a renamed tale', body='nothing here')
+    assert catalog.list(kind='story')['total'] == 3
+    assert catalog.search('scrolls')['total'] == 0
+    assert titles(catalog.search('renamed')) == ['Renamed']
+
+
+def test_forget_drops_rows_and_search_text(catalog):
+    catalog.forget(['stories/story_0.txt', 'images/image_0.png'])
+
+    assert catalog.list()['total'] == 2
+    assert titles(catalog.search('dragon')) == ['Dragonfly']
+    assert catalog.search('scrolls')['total'] == 0
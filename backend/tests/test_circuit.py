@@ -0,0 +1,172 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from services.circuit_service import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, is_upstream_failure
+from services.fake_openai import FakeAPIError
+
+
+def breaker(**options):
+    defaults = dict(failure_rate=0.5, min_calls=4, window=60, slow_seconds=1, seconds_per_token=0.001,
+                    open_seconds=0.05, half_open_calls=2)
+    return CircuitBreaker('test-model', **dict(defaults, **options))
+
+
+def call(breaker, error=None, seconds=0.0, tokens=0):
+    breaker.before_call()
+    ticket = breaker.start(tokens)
+    backdate(breaker, ticket, seconds)
+    if error is None:
+        breaker.success(ticket)
+    else:
+        breaker.failure(ticket, error)
+
+
+def backdate(breaker, ticket, seconds):
+    # Instead of sleeping
+    started, limit = breaker.outstanding[ticket]
+    breaker.outstanding[ticket] = (started - seconds, limit)
+
+
+def test_opens_at_failure_rate_after_min_calls():
+    circuit = breaker()
+    call(circuit)
+    call(circuit, FakeAPIError(500))
+    call(circuit, FakeAPIError(503))
+    assert circuit.state == CLOSED  # 3 calls, below min_calls
+
+    call(circuit, FakeAPIError(500))
+    assert circuit.state == OPEN
+    with pytest.raises(CircuitOpenError) as raised:
+        circuit.before_call()
+    assert 0 < raised.value.retry_after <= 0.05
+
+
+def test_slow_successes_count_as_failures():
+    circuit = breaker()
+    for _ in range(4):
+        call(circuit, seconds=2)
+    assert circuit.state == OPEN
+
+
+def test_long_completions_get_a_longer_slow_limit():
+    circuit = breaker()
+    # A long story drafting its chapters at once: each asks for 4000 tokens
+    tickets = []
+    for _ in range(10):
+        circuit.before_call()
+        tickets.append(circuit.start(4000))
+        backdate(circuit, tickets[-1], 3)
+    circuit.before_call()  # Running past slow_seconds, not past their own limit
+    circuit.release()
+    assert circuit.stats()['overdue'] == 0
+
+    for ticket in tickets:
+        circuit.success(ticket)
+    assert circuit.state == CLOSED
+    assert circuit.stats()['failures'] == 0
+
+    circuit = breaker()
+    for _ in range(4):
+        call(circuit, seconds=6, tokens=4000)  # Past 1s + 4000 x 0.001s
+    assert circuit.state == OPEN
+
+
+def test_client_errors_do_not_count():
+    circuit = breaker()
+    for status in (400, 401, 429, 429, 429):
+        call(circuit, FakeAPIError(status))
+    assert circuit.state == CLOSED
+    assert circuit.stats()['calls'] == 0
+
+
+def test_half_open_probes_close_after_successes():
+    circuit = breaker()
+    for _ in range(4):
+        call(circuit, TimeoutError())
+    time.sleep(0.06)
+    assert circuit.stats()['state'] == HALF_OPEN
+
+    circuit.before_call()
+    circuit.before_call()
+    with pytest.raises(CircuitOpenError):
+        circuit.before_call()  # Only half_open_calls probes at once
+    circuit.success(circuit.start())
+    assert circuit.state == HALF_OPEN
+    circuit.success(circuit.start())
+    assert circuit.state == CLOSED
+    assert circuit.stats()['calls'] == 0
+
+
+def test_failed_probe_reopens():
+    circuit = breaker()
+    for _ in range(4):
+        call(circuit, ConnectionError())
+    time.sleep(0.06)
+
+    call(circuit, FakeAPIError(502))
+    assert circuit.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        circuit.before_call()
+
+
+def test_released_probe_frees_its_slot():
+    circuit = breaker(half_open_calls=1)
+    for _ in range(4):
+        call(circuit, FakeAPIError(500))
+    time.sleep(0.06)
+
+    circuit.before_call()
+    circuit.release()
+    circuit.before_call()
+    assert circuit.state == HALF_OPEN
+
+
+def test_hanging_calls_open_circuit_before_they_finish():
+    circuit = breaker(slow_seconds=0.05)
+    tickets = []
+    for _ in range(4):
+        circuit.before_call()
+        tickets.append(circuit.start())
+    circuit.before_call()  # Not overdue yet
+    circuit.release()
+
+    time.sleep(0.06)
+    assert circuit.stats()['overdue'] == 4
+    with pytest.raises(CircuitOpenError):
+        circuit.before_call()
+    assert circuit.state == OPEN
+
+    for ticket in tickets:
+        circuit.failure(ticket, TimeoutError())
+    assert circuit.stats()['outstanding'] == 0
+
+
+def test_client_calls_get_a_timeout_from_the_breaker():
+    from services.circuit_service import CircuitBreakers
+    from services.ratelimit_service import RateLimiter, ScheduledClient
+
+    seen = []
+
+    def create(**kwargs):
+        seen.append(kwargs.get('timeout'))
+
+    target = SimpleNamespace(audio=SimpleNamespace(speech=SimpleNamespace(create=create)),
+                             chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    breakers = CircuitBreakers(slow_seconds=3, seconds_per_token=0.01)
+    client = ScheduledClient(target, RateLimiter(), breakers=breakers)
+    client.audio.speech.create(model='tts-1-hd', input='hi')
+    client.audio.speech.create(model='tts-1-hd', input='hi', timeout=1)
+    messages = [{'role': 'user', 'content': 'hi'}]
+    client.chat.completions.create(model='gpt-4.1-mini', messages=messages, max_tokens=100, n=2)
+    client.chat.completions.create(model='gpt-4.1-mini', messages=messages, max_tokens=100, stream=True)
+    assert seen == [6, 1, 10, 6]
+
+
+def test_upstream_failure_classification():
+    assert is_upstream_failure(FakeAPIError(500))
+    assert is_upstream_failure(FakeAPIError(408))
+    assert is_upstream_failure(TimeoutError())
+    assert not is_upstream_failure(FakeAPIError(429))
+    assert not is_upstream_failure(ValueError())
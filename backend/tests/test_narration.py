@@ -0,0 +1,32 @@
+from services.story_service import mp3_duration, strip_id3, strip_info_frame
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, joint stereo: 417-byte frames of 1152 samples
+AUDIO_FRAME = b'\xff\xfb\x90\x64' + b'\x00' * 413
+INFO_FRAME = b'\xff\xfb\x90\x64' + b'\x00' * 32 + b'Info' + b'\x00' * 377
+ID3_TAG = b'ID3\x04\x00\x00\x00\x00\x00\x0a' + b'\x00' * 10
+FRAME_SECONDS = 1152 / 44100
+
+
+def test_info_frame_is_removed_after_id3_tag():
+    part = ID3_TAG + INFO_FRAME + AUDIO_FRAME * 3
+    assert strip_info_frame(part) == ID3_TAG + AUDIO_FRAME * 3
+    assert strip_info_frame(AUDIO_FRAME * 3) == AUDIO_FRAME * 3
+
+
+def test_duration_skips_info_frame():
+    assert abs(mp3_duration(ID3_TAG + INFO_FRAME + AUDIO_FRAME * 10) - 10 * FRAME_SECONDS) < 1e-9
+
+
+def test_joined_narration_has_no_info_frames(story_service):
+    story_service.tts_max_chars = 200
+    text = ' '.join(f"Sentence number {i} of the story." for i in range(40))
+
+    result = story_service.narrate(text, 'alloy', 1.0)
+
+    with open(result['filepath'], 'rb') as f:
+        data = f.read()
+    assert len(result['chunks']) > 1
+    assert b'Info' not in data and b'Xing' not in data
+    assert strip_id3(data)[:4] == AUDIO_FRAME[:4]
+    assert result['duration'] == round(mp3_duration(data), 2)
+    assert result['chunks'][-1]['end'] == round(len(data) // len(AUDIO_FRAME) * FRAME_SECONDS, 3)
@@ -0,0 +1,37 @@
+import pytest
+
+import app as backend
+
+
+@pytest.fixture
+def outputs(tmp_path, monkeypatch):
+    """An outputs tree with public files and the internal indexes beside them"""
+    (tmp_path / 'images').mkdir()
+    (tmp_path / 'images' / 'cover.txt').write_text('public')
+    (tmp_path / 'images' / '.tmp_cover.txt').write_text('partial')
+    (tmp_path / 'catalog.db').write_text('internal')
+    (tmp_path / 'cache_index.json').write_text('{}')
+    (tmp_path / 'storage_index.json').write_text('{}')
+    monkeypatch.setattr(backend, 'OUTPUT_DIR', str(tmp_path))
+    return tmp_path
+
+
+def test_serves_category_file(outputs):
+    response = backend.app.test_client().get('/api/outputs/images/cover.txt')
+    assert response.status_code == 200
+    assert response.data == b'public'
+
+
+@pytest.mark.parametrize('path', [
+    'images/../catalog.db',
+    'images/%2e%2e/cache_index.json',
+    'images/%2E%2E/storage_index.json',
+    'images/./../catalog.db',
+    'catalog.db',
+    'images/.tmp_cover.txt',
+    'images',
+    '../app.py'
+])
+def test_rejects_paths_outside_categories(outputs, path):
+    response = backend.app.test_client().get(f'/api/outputs/{path}')
+    assert response.status_code == 404
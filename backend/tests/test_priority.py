@@ -0,0 +1,46 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from services.ratelimit_service import current_priority, get_limiter, priority, submit_with_priority
+
+
+@pytest.fixture
+def acquired(monkeypatch):
+    """(model, priority) of every call that reserved rate-limit budget"""
+    calls = []
+    limiter = get_limiter()
+    original = limiter.acquire
+
+    def acquire(model, tokens=0, priority=None):
+        calls.append((model, priority or current_priority()))
+        return original(model, tokens, priority)
+
+    monkeypatch.setattr(limiter, 'acquire', acquire)
+    return calls
+
+
+def test_pool_tasks_keep_caller_priority():
+    with ThreadPoolExecutor(max_workers=2) as executor, priority('background'):
+        futures = [submit_with_priority(executor, current_priority) for _ in range(4)]
+        assert [future.result() for future in futures] == ['background'] * 4
+
+
+def test_narration_chunks_run_at_job_priority(story_service, acquired):
+    story_service.tts_max_chars = 200
+    text = ' '.join(f"Sentence number {i} of the story." for i in range(40))
+
+    with priority('background'):
+        result = story_service.narrate(text, 'alloy', 1.0)
+
+    assert len(result['chunks']) > 1
+    assert [level for _, level in acquired] == ['background'] * len(result['chunks'])
+
+
+def test_chapters_run_at_batch_priority(story_service, acquired):
+    with priority('batch'):
+        story_service.generate('A lighthouse keeper', 'mystery', 'medium')
+
+    models = [model for model, _ in acquired]
+    assert len(models) > 2  # outline plus chapters
+    assert {level for _, level in acquired} == {'batch'}
@@ -0,0 +1,56 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from services.fake_openai import FakeAPIError
+from services.ratelimit_service import RateLimiter, ScheduledClient, response_hook
+
+
+class APIStatusError(Exception):
+    """Like the SDK's: the final response is attached"""
+
+    def __init__(self, response):
+        super().__init__('rate limited')
+        self.response = response
+        self.status_code = response.status_code
+
+
+def rejections(limiter):
+    seen = []
+    observe = limiter.observe_rejection
+    limiter.observe_rejection = lambda model, *args, **kwargs: (seen.append(model), observe(model, *args, **kwargs))
+    return seen
+
+
+def client_for(create, limiter):
+    target = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return ScheduledClient(target, limiter)
+
+
+def test_api_429_is_counted_once():
+    limiter = RateLimiter(max_wait=5)
+    seen = rejections(limiter)
+    hook = response_hook(limiter)
+
+    def create(**kwargs):
+        request = SimpleNamespace(content=json.dumps({'model': kwargs['model']}).encode())
+        response = SimpleNamespace(request=request, status_code=429, headers={'retry-after': '0'})
+        hook(response)  # As httpx calls it for the final attempt
+        raise APIStatusError(response)
+
+    with pytest.raises(APIStatusError):
+        client_for(create, limiter).chat.completions.create(model='gpt-4.1-mini', messages=[])
+    assert seen == ['gpt-4.1-mini']
+
+
+def test_fake_client_429_is_counted():
+    limiter = RateLimiter(max_wait=5)
+    seen = rejections(limiter)
+
+    def create(**kwargs):
+        raise FakeAPIError(429)
+
+    with pytest.raises(FakeAPIError):
+        client_for(create, limiter).chat.completions.create(model='gpt-4.1-mini', messages=[])
+    assert seen == ['gpt-4.1-mini']
@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+
+from services.singleflight_service import FileLockBackend, SingleFlight
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """Two SingleFlights sharing a lock directory, like two worker processes"""
+    return [SingleFlight('test', FileLockBackend(str(tmp_path), result_ttl=5)) for _ in range(2)]
+
+
+def test_waiting_worker_shares_uncached_fallback(workers):
+    calls = []
+
+    def fallback():
+        calls.append(threading.current_thread().name)
+        time.sleep(0.2)
+        return {'filename': 'demo.png', 'fallback': True}
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda flight=flight: results.append(flight.do('key', fallback, lambda: None)))
+        for flight in workers
+    ]
+    threads[0].start()
+    time.sleep(0.05)
+    threads[1].start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{'filename': 'demo.png', 'fallback': True}] * 2
+
+
+def test_published_result_expires(tmp_path):
+    backend = FileLockBackend(str(tmp_path), result_ttl=0.05)
+    flight = SingleFlight('test', backend)
+    calls = []
+
+    def produce():
+        calls.append(1)
+        return {'n': len(calls)}
+
+    assert flight.do('key', produce, lambda: None) == {'n': 1}
+    assert flight.do('key', produce, lambda: None) == {'n': 1}
+    time.sleep(0.1)
+    assert flight.do('key', produce, lambda: None) == {'n': 2}
+
+
+def test_stored_results_are_not_published(tmp_path):
+    flight = SingleFlight('test', FileLockBackend(str(tmp_path)))
+    stored = {}
+
+    def produce():
+        stored['key'] = {'filename': 'story.txt'}
+        return stored['key']
+
+    assert flight.do('key', produce, lambda: stored.get('key')) == {'filename': 'story.txt'}
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_sweep_removes_expired_results_and_abandoned_locks(tmp_path):
+    backend = FileLockBackend(str(tmp_path), result_ttl=0.05)
+    backend.publish('old', {'n': 1})
+    (tmp_path / 'crashed.lock').touch()  # Left by a worker that died
+    with backend.lock('held'):
+        time.sleep(0.1)
+        backend.publish('new', {'n': 2})
+        assert backend.sweep() == 2
+        assert sorted(path.name for path in tmp_path.iterdir()) == ['held.lock', 'new.result']
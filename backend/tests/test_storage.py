@@ -0,0 +1,76 @@
+import json
+import os
+
+import pytest
+
+from services import storage_service
+from services.cache_service import ResultCache
+from services.storage_service import StorageManager
+
+
+@pytest.fixture(autouse=True)
+def save_every_change(monkeypatch):
+    monkeypatch.setattr(storage_service, 'SAVE_INTERVAL', 0)
+
+
+def manager(root, **options):
+    """A StorageManager as a separate worker process would build it"""
+    return StorageManager(root=str(root), interval=0, max_bytes=options.pop('max_bytes', 0), **options)
+
+
+def write(root, name, size=100):
+    path = root / 'images' / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'x' * size)
+    return str(path)
+
+
+def saved_paths(root):
+    with open(root / 'storage_index.json') as f:
+        return set(json.load(f))
+
+
+def test_workers_keep_each_others_entries(tmp_path):
+    first, second = manager(tmp_path), manager(tmp_path)
+    first.register(write(tmp_path, 'a.png'))
+    second.register(write(tmp_path, 'b.png'))
+
+    assert saved_paths(tmp_path) == {'images/a.png', 'images/b.png'}
+
+
+def test_swept_entries_are_not_restored_by_other_workers(tmp_path):
+    first = manager(tmp_path, max_bytes=150)
+    first.register(write(tmp_path, 'old.png'))
+    second = manager(tmp_path)
+    second.register(write(tmp_path, 'new.png'))
+
+    first.sweep()
+    second.register(write(tmp_path, 'later.png'))
+
+    assert not os.path.exists(tmp_path / 'images' / 'old.png')
+    assert saved_paths(tmp_path) == {'images/new.png', 'images/later.png'}
+
+
+def test_eviction_sees_other_workers_access_times(tmp_path):
+    first, second = manager(tmp_path, max_bytes=150), manager(tmp_path)
+    first.register(write(tmp_path, 'a.png'))
+    first.register(write(tmp_path, 'b.png'))
+    second.sweep()
+
+    # Only the other worker served a.png since
+    second.touch(str(tmp_path / 'images' / 'a.png'))
+    first.sweep()
+
+    assert os.path.exists(tmp_path / 'images' / 'a.png')
+    assert not os.path.exists(tmp_path / 'images' / 'b.png')
+
+
+def test_cache_workers_keep_each_others_entries(tmp_path):
+    first, second = ResultCache(str(tmp_path)), ResultCache(str(tmp_path))
+    first.put('a', {'filepath': write(tmp_path, 'a.png')})
+    second.put('b', {'filepath': write(tmp_path, 'b.png')})
+    first.forget(['images/a.png'])
+    second.put('c', {'filepath': write(tmp_path, 'c.png')})
+
+    assert set(ResultCache(str(tmp_path)).entries) == {'b', 'c'}
+    assert first.get('c')['filepath'].endswith('c.png')
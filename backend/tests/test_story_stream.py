@@ -0,0 +1,64 @@
+import glob
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import app as backend
+from services.storage_service import locate
+
+
+def scratch_files(service):
+    return glob.glob(os.path.join(service.output_dir, '**', '.tmp_*'), recursive=True)
+
+
+def story_files(service):
+    return glob.glob(os.path.join(service.output_dir, '**', 'story_*.txt'), recursive=True)
+
+
+@pytest.mark.parametrize('length', ['short', 'medium'])
+def test_closing_stream_part_way_removes_scratch_file(story_service, length):
+    stream = story_service.generate_stream('A quiet harbour', 'mystery', length)
+    assert next(stream)[0] == 'title'
+    assert next(stream)[0] == 'delta'
+    assert scratch_files(story_service)
+
+    stream.close()
+
+    assert scratch_files(story_service) == []
+    assert story_files(story_service) == []
+
+
+def test_finished_stream_keeps_only_final_file(story_service):
+    events = list(story_service.generate_stream('A quiet harbour', 'mystery', 'short'))
+
+    assert events[-1][0] == 'done'
+    assert scratch_files(story_service) == []
+    assert story_files(story_service) == [events[-1][1]['filepath']]
+
+
+def test_client_disconnect_removes_scratch_file(story_service, monkeypatch):
+    monkeypatch.setitem(backend.registry.instances, 'story', story_service)
+    response = backend.app.test_client().post(
+        '/api/generate-story/stream', json={'prompt': 'A quiet harbour', 'length': 'short'}, buffered=False)
+    body = response.response
+    assert next(iter(body)).startswith(b'event: title')
+
+    response.close()
+
+    assert scratch_files(story_service) == []
+
+
+def test_fallback_story_url_points_at_a_saved_file(story_service):
+    def unavailable(**kwargs):
+        raise ConnectionError('API down')
+
+    story_service.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=unavailable)))
+    events = list(story_service.generate_stream('A quiet harbour', 'mystery', 'short'))
+
+    event, done = events[-1]
+    assert event == 'done'
+    assert done['filename'].startswith('story_demo_')
+    assert locate(story_service.output_dir, done['filename']) == done['filepath']
+    with open(done['filepath'], encoding='utf-8') as f:
+        assert f.read().startswith(done['title'])
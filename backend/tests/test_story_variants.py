@@ -0,0 +1,46 @@
+import os
+import threading
+import time
+
+
+def spy_completions(story_service, delay=0.0):
+    """Record the choice count of every whole-story completion"""
+    counts = []
+    complete = story_service._complete_stories
+
+    def recorded(genre, word_count, system_prompt, user_prompt, count):
+        counts.append(count)
+        time.sleep(delay)
+        return complete(genre, word_count, system_prompt, user_prompt, count)
+
+    story_service._complete_stories = recorded
+    return counts
+
+
+def test_only_missing_variants_are_regenerated(story_service):
+    first = story_service.generate_variants('A quiet harbour', 'mystery', 'short', 3)
+    os.remove(first[1]['filepath'])
+
+    counts = spy_completions(story_service)
+    second = story_service.generate_variants('A quiet harbour', 'mystery', 'short', 3)
+
+    assert counts == [1]
+    assert [story['filename'] for story in second[::2]] == [story['filename'] for story in first[::2]]
+    assert os.path.exists(second[1]['filepath'])
+
+
+def test_concurrent_variant_requests_share_one_completion(story_service):
+    counts = spy_completions(story_service, delay=0.2)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(
+            story_service.generate_variants('A quiet harbour', 'mystery', 'short', 2)))
+        for _ in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counts == [2]
+    assert results[0] == results[1]
@@ -0,0 +1,39 @@
+from PIL import Image, ImageChops
+
+from services.upscale_service import LanczosResampler, TiledUpscaler
+
+
+def _gradient(width, height):
+    img = Image.new('RGB', (width, height))
+    img.putdata([((x * 7) % 256, (y * 5) % 256, (x * y) % 256) for y in range(height) for x in range(width)])
+    return img
+
+
+def test_pool_does_not_fork_the_server():
+    upscaler = TiledUpscaler(tile_size=64, workers=2)
+    try:
+        assert upscaler._pool is None  # Started on first use or by warm_up()
+        assert upscaler._get_pool()._mp_context.get_start_method() != 'fork'
+    finally:
+        upscaler.shutdown()
+
+
+def test_tiled_upscale_matches_single_resize():
+    img = _gradient(96, 80)
+    size = (288, 240)
+    upscaler = TiledUpscaler(tile_size=64, workers=2)
+    try:
+        tiled, _ = upscaler.upscale(img, size)
+    finally:
+        upscaler.shutdown()
+
+    whole = LanczosResampler().resize(img, size, (0, 0) + img.size)
+    extrema = ImageChops.difference(tiled, whole).getextrema()
+    assert max(high for _, high in extrema) <= 1
+
+
+def test_image_service_starts_no_workers_until_used():
+    from services.image_service import ImageService
+
+    service = ImageService()
+    assert service.upscaler._pool is None